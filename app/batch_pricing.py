@@ -0,0 +1,210 @@
+"""
+Offline pricing of order files, for example for re-pricing historical orders.
+
+Reads Parquet, Arrow IPC (file or stream format) or CSV files of orders with the
+columns `cart_value`, `delivery_distance`, `number_of_items` and `time`, and
+writes them to a Parquet file with an added delivery fee column. The fees are
+calculated with the configuration of `app/delivery_fee/settings.py`, the same
+as the HTTP endpoints use.
+
+The input is memory mapped and read one record batch at a time and every batch
+is written out before the next one is read, so the memory use stays the same
+no matter how big the file is.
+
+Run with: python -m app.batch_pricing orders.parquet priced_orders.parquet
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+import pyarrow.parquet as pq
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, DeliveryFeeCalculator
+from app.delivery_fee.order_columns import OrderInfoColumns
+
+
+ORDER_COLUMNS = ("cart_value", "delivery_distance", "number_of_items", "time")
+DEFAULT_BATCH_SIZE = 64 * 1024
+DEFAULT_FEE_COLUMN = "delivery_fee"
+# CSV files are read in blocks of bytes instead of rows.
+CSV_BLOCK_SIZE = 4 * 1024 * 1024
+
+_PARQUET_MAGIC = b"PAR1"
+_ARROW_FILE_MAGIC = b"ARROW1"
+
+
+@dataclass(frozen=True)
+class BatchPricingReport:
+    rows: int
+    batches: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def price_file(input_path: str | Path, output_path: str | Path,
+               batch_size: int = DEFAULT_BATCH_SIZE,
+               fee_column: str = DEFAULT_FEE_COLUMN,
+               row_groups: range | None = None,
+               calculator: DeliveryFeeCalculator = DELIVERY_FEE_CALCULATOR
+               ) -> BatchPricingReport:
+    """Prices the orders of the input file and writes them with the fee column to
+    the output Parquet file. An existing column with the fee column name is
+    replaced. `row_groups` limits a Parquet input to the given row groups.
+    Raises `ValueError` if the orders are invalid, the row numbers of the failed
+    batch are in the message. The output is written to a temporary file first,
+    so that a failed run never leaves a partial file behind under its name."""
+    started = time.perf_counter()
+    rows = batches = 0
+    reader = read_record_batches(input_path, batch_size, row_groups)
+    schema = _with_fee_field(reader.schema, fee_column)
+
+    output_path = Path(output_path)
+    temporary_path = output_path.with_name(output_path.name + ".tmp")
+    try:
+        with pq.ParquetWriter(temporary_path, schema) as writer:
+            for batch in reader:
+                try:
+                    fees = price_record_batch(batch, calculator)
+                except ValueError as error:
+                    raise ValueError(f"invalid orders in rows {rows}-"
+                                     f"{rows + batch.num_rows - 1}: {error}") from error
+                writer.write_batch(_with_fees(batch, schema, fee_column, fees))
+                rows += batch.num_rows
+                batches += 1
+        os.replace(temporary_path, output_path)
+    finally:
+        # Only left behind if the pricing failed.
+        temporary_path.unlink(missing_ok=True)
+
+    return BatchPricingReport(rows=rows, batches=batches,
+                              seconds=time.perf_counter() - started)
+
+
+def read_record_batches(path: str | Path, batch_size: int = DEFAULT_BATCH_SIZE,
+                        row_groups: range | None = None) -> pa.RecordBatchReader:
+    """Returns a reader of the record batches of a memory mapped Parquet or Arrow
+    IPC file or a CSV file. Parquet files are read `batch_size` rows at a time,
+    optionally only the given row groups. Arrow IPC files are read in the record
+    batches they were written in and CSV files in blocks of `CSV_BLOCK_SIZE`."""
+    file_format = file_format_of(path)
+    if file_format == "parquet":
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        return pa.RecordBatchReader.from_batches(parquet_file.schema_arrow, (
+            parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups)))
+    if file_format == "csv":
+        # The time strings are parsed the same way as `OrderInfo` parses them.
+        csv_reader = pyarrow.csv.open_csv(
+            path, read_options=pyarrow.csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+            convert_options=pyarrow.csv.ConvertOptions(column_types={"time": pa.string()}))
+        return pa.RecordBatchReader.from_batches(csv_reader.schema, csv_reader)
+
+    source = pa.memory_map(str(path), "r")
+    if file_format == "arrow_file":
+        file_reader = pa.ipc.open_file(source)
+        return pa.RecordBatchReader.from_batches(file_reader.schema, (
+            file_reader.get_batch(index) for index in range(file_reader.num_record_batches)))
+    return pa.ipc.open_stream(source)
+
+
+def file_format_of(path: str | Path) -> str:
+    """Returns "parquet", "arrow_file", "arrow_stream" or "csv". CSV files are
+    recognized by the .csv suffix, the other formats by their content."""
+    if Path(path).suffix.lower() == ".csv":
+        return "csv"
+    with open(path, "rb") as file:
+        magic = file.read(len(_ARROW_FILE_MAGIC))
+    if magic.startswith(_PARQUET_MAGIC):
+        return "parquet"
+    if magic == _ARROW_FILE_MAGIC:
+        return "arrow_file"
+    return "arrow_stream"
+
+
+def price_record_batch(batch: pa.RecordBatch,
+                       calculator: DeliveryFeeCalculator = DELIVERY_FEE_CALCULATOR) -> np.ndarray:
+    """Returns the delivery fees of the orders of the record batch as an int64
+    array. Raises `ValueError` if the orders are invalid."""
+    return calculator.calculate_columns(order_columns_of(batch))
+
+
+def order_columns_of(batch: pa.RecordBatch) -> OrderInfoColumns:
+    """Returns the orders of the record batch as validated order columns.
+    Raises `ValueError` if the orders are invalid."""
+    missing_columns = [name for name in ORDER_COLUMNS if name not in batch.schema.names]
+    if missing_columns:
+        raise ValueError(f"missing columns: {', '.join(missing_columns)}")
+    for name in ORDER_COLUMNS:
+        if batch.column(name).null_count:
+            raise ValueError(f"{name} must not contain nulls")
+
+    return OrderInfoColumns.from_arrays(
+        batch.column("cart_value").to_numpy(),
+        batch.column("delivery_distance").to_numpy(),
+        batch.column("number_of_items").to_numpy(),
+        *_wall_clock_times(batch.column("time")))
+
+
+def _wall_clock_times(times: pa.Array) -> tuple[np.ndarray, np.ndarray | None]:
+    # Returns the times and, for timezone aware timestamps, their UTC offsets.
+    if pa.types.is_timestamp(times.type):
+        # datetime only has microseconds, same as OrderInfo.
+        utc_times = pc.cast(times, pa.timestamp("us", times.type.tz), safe=False)
+        if times.type.tz is None:
+            return utc_times.to_numpy(), None
+        # Same as `OrderInfo.time`, the fees depend on the wall clock time of the
+        # order. Timezone aware timestamps are stored in UTC, so convert them back.
+        wall_clock_times = pc.local_timestamp(utc_times)
+        utc_offsets = (pc.cast(wall_clock_times, pa.int64()).to_numpy() -
+                       pc.cast(utc_times, pa.int64()).to_numpy())
+        return wall_clock_times.to_numpy(), utc_offsets
+    # Strings are parsed the same way as `OrderInfo` parses them.
+    return times.to_numpy(zero_copy_only=False), None
+
+
+def _with_fee_field(schema: pa.Schema, fee_column: str) -> pa.Schema:
+    fee_field = pa.field(fee_column, pa.int64(), nullable=False)
+    if fee_column in schema.names:
+        return schema.set(schema.get_field_index(fee_column), fee_field)
+    return schema.append(fee_field)
+
+
+def _with_fees(batch: pa.RecordBatch, schema: pa.Schema, fee_column: str,
+               fees: np.ndarray) -> pa.RecordBatch:
+    columns = dict(zip(batch.schema.names, batch.columns))
+    columns[fee_column] = pa.array(fees, type=pa.int64())
+    return pa.RecordBatch.from_arrays([columns[name] for name in schema.names], schema=schema)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Price the orders of a Parquet, Arrow IPC or CSV file and write them "
+                    "with a delivery fee column to a Parquet file.")
+    parser.add_argument("input", help="Parquet, Arrow IPC or CSV file of orders")
+    parser.add_argument("output", help="Parquet file to write the priced orders to")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows per record batch of Parquet input "
+                             f"(default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--fee-column", default=DEFAULT_FEE_COLUMN,
+                        help=f"name of the fee column (default: {DEFAULT_FEE_COLUMN})")
+    args = parser.parse_args(argv)
+
+    try:
+        report = price_file(args.input, args.output, args.batch_size, args.fee_column)
+    except ValueError as error:
+        parser.exit(1, f"{parser.prog}: error: {error}\n")
+
+    print(f"Priced {report.rows:,} orders in {report.batches:,} batches in "
+          f"{report.seconds:.2f} s ({report.rows_per_second:,.0f} orders/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Multi-process batch pricing of large order data sets, for example a directory
+of Parquet or CSV files (see `app.batch_pricing` for the supported formats).
+
+The input is split into shards, one per file or, for Parquet files, one per
+`row_groups_per_shard` row groups. The shards are priced in a pool of worker
+processes. Every worker builds its own calculator once when it starts, with the
+steps and transformers of the calculator of the main process (by default
+`DELIVERY_FEE_CALCULATOR`, the same as `app.batch_pricing`), so the tasks only
+carry the location of the shard. Each worker writes the priced orders of each
+shard to its own Parquet file in the output directory.
+
+Every completed shard is recorded in a checkpoint file in the output directory.
+When the same run is started again after it was interrupted or failed, the
+shards which were already completed are skipped. A shard is only skipped if its
+input file has not changed since it was priced and the pricing configuration
+version is still the same.
+
+Run with: python -m app.batch_runner orders/ priced_orders/ --workers 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_EXCEPTION, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+import pyarrow.parquet as pq
+from app.batch_pricing import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_FEE_COLUMN,
+    file_format_of,
+    price_file,
+)
+from app.delivery_fee.fee_calculation_steps import DeliveryFeeCalculationStep
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, DeliveryFeeCalculator
+from app.delivery_fee.fee_transformers import DeliveryFeeTransformer
+
+
+INPUT_SUFFIXES = (".parquet", ".arrow", ".feather", ".ipc", ".arrows", ".csv")
+DEFAULT_ROW_GROUPS_PER_SHARD = 8
+CHECKPOINT_FILE_NAME = "_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class Shard:
+    """Part of the input that is priced by one task: a whole file or a range of
+    the row groups of a Parquet file."""
+    path: Path
+    # Relative to the input directory, used for the shard id.
+    name: str
+    row_groups: range | None = None
+
+    @property
+    def id(self) -> str:
+        if self.row_groups is None:
+            return self.name
+        return f"{self.name}#{self.row_groups.start}-{self.row_groups.stop - 1}"
+
+    @property
+    def output_file_name(self) -> str:
+        return _output_file_name(self.id)
+
+    def fingerprint(self) -> dict[str, Any]:
+        """Identifies the input of the shard, a changed input file changes it."""
+        stat = self.path.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+@dataclass(frozen=True)
+class BatchRunReport:
+    shards: int
+    skipped_shards: int
+    # Rows priced by this run, the rows of the skipped shards are not included.
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def plan_shards(input_path: str | Path,
+                row_groups_per_shard: int = DEFAULT_ROW_GROUPS_PER_SHARD) -> list[Shard]:
+    """Splits the input file or the files of the input directory (recursively)
+    into shards, in the order of the file paths."""
+    input_path = Path(input_path)
+    if input_path.is_dir():
+        paths = sorted(path for path in input_path.rglob("*")
+                       if path.is_file() and path.suffix.lower() in INPUT_SUFFIXES)
+        base_path = input_path
+    else:
+        paths = [input_path]
+        base_path = input_path.parent
+
+    shards = []
+    for path in paths:
+        name = path.relative_to(base_path).as_posix()
+        if file_format_of(path) != "parquet":
+            shards.append(Shard(path, name))
+            continue
+        num_row_groups = pq.ParquetFile(path, memory_map=True).num_row_groups
+        if num_row_groups <= row_groups_per_shard:
+            shards.append(Shard(path, name))
+            continue
+        for start in range(0, num_row_groups, row_groups_per_shard):
+            shards.append(Shard(path, name, range(
+                start, min(start + row_groups_per_shard, num_row_groups))))
+    return shards
+
+
+def run(input_path: str | Path, output_dir: str | Path, workers: int | None = None,
+        row_groups_per_shard: int = DEFAULT_ROW_GROUPS_PER_SHARD,
+        batch_size: int = DEFAULT_BATCH_SIZE, fee_column: str = DEFAULT_FEE_COLUMN,
+        resume: bool = True,
+        calculator: DeliveryFeeCalculator = DELIVERY_FEE_CALCULATOR) -> BatchRunReport:
+    """Prices the shards of the input in `workers` processes (by default one per
+    CPU) with the pipeline of the calculator and writes them to the output
+    directory. With `resume`, shards completed by an earlier run with the same
+    options and pricing configuration version are skipped. Raises `ValueError`
+    with the shard id if the orders of a shard are invalid. The shards completed
+    before that, and the ones that were still running and finish, are still
+    recorded in the checkpoint."""
+    started = time.perf_counter()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pipeline = calculator.pipeline
+    checkpoint = _Checkpoint(output_dir / CHECKPOINT_FILE_NAME, {
+        "row_groups_per_shard": row_groups_per_shard, "batch_size": batch_size,
+        "fee_column": fee_column, "pricing_version": pipeline.version})
+    checkpoint.load(resume)
+
+    shards = plan_shards(input_path, row_groups_per_shard)
+    # Outputs of an earlier run which are not shards of this run would
+    # duplicate the orders in the output directory.
+    for shard_id in checkpoint.previous_shard_ids - {shard.id for shard in shards}:
+        (output_dir / _output_file_name(shard_id)).unlink(missing_ok=True)
+    pending_shards = [shard for shard in shards
+                      if not checkpoint.is_completed(shard, output_dir / shard.output_file_name)]
+    rows = 0
+
+    if pending_shards:
+        # Spawned workers do not inherit the threads of pyarrow or the state of
+        # the calculator of this process.
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1,
+                                                 len(pending_shards)),
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(pipeline.calculation_steps, pipeline.transformers,
+                                           pipeline.version)) as executor:
+            futures: dict[Future, Shard] = {
+                executor.submit(_price_shard, shard, output_dir, batch_size, fee_column): shard
+                for shard in pending_shards}
+            not_done = set(futures)
+            while not_done:
+                done, not_done = wait(not_done, return_when=FIRST_EXCEPTION)
+                failed = [future for future in done if future.exception() is not None]
+                for future in done:
+                    if future.exception() is None:
+                        checkpoint.complete(futures[future], future.result())
+                        rows += future.result()
+                if failed:
+                    executor.shutdown(cancel_futures=True)
+                    # The shards which were still running finished during the
+                    # shutdown, and their outputs are in place.
+                    for future in not_done:
+                        if not future.cancelled() and future.exception() is None:
+                            checkpoint.complete(futures[future], future.result())
+                    error = failed[0].exception()
+                    raise ValueError(f"shard {futures[failed[0]].id} failed: {error}") from error
+
+    return BatchRunReport(shards=len(shards), skipped_shards=len(shards) - len(pending_shards),
+                          rows=rows, seconds=time.perf_counter() - started)
+
+
+# The calculator of the worker process, built once by `_init_worker`.
+_worker_calculator: DeliveryFeeCalculator | None = None
+
+
+def _init_worker(calculation_steps: list[DeliveryFeeCalculationStep],
+                 transformers: list[DeliveryFeeTransformer], version: str) -> None:
+    global _worker_calculator
+
+    # The calculator is a singleton, which already has the pipeline of the
+    # settings or of the pricing config file of this process. The run uses the
+    # pipeline of the main process instead, whatever it was configured from.
+    _worker_calculator = DeliveryFeeCalculator(calculation_steps, transformers)
+    _worker_calculator.configure(calculation_steps, transformers, version)
+
+
+def _output_file_name(shard_id: str) -> str:
+    return shard_id.replace("/", "__").replace("#", ".row_groups_") + ".parquet"
+
+
+def _price_shard(shard: Shard, output_dir: Path, batch_size: int, fee_column: str) -> int:
+    # `price_file` writes to a temporary file first, so that an interrupted
+    # shard never leaves a partial output file behind under the final name.
+    report = price_file(shard.path, output_dir / shard.output_file_name, batch_size,
+                        fee_column, row_groups=shard.row_groups,
+                        calculator=_worker_calculator)
+    return report.rows
+
+
+class _Checkpoint:
+    """The completed shards of a run, saved as JSON after every completed shard."""
+
+    def __init__(self, path: Path, options: dict[str, Any]) -> None:
+        self.path = path
+        self.options = options
+        self.completed_shards: dict[str, dict[str, Any]] = {}
+        # Shards recorded by the earlier run, whether they are reused or not.
+        self.previous_shard_ids: set[str] = set()
+
+    def load(self, resume: bool) -> None:
+        if not self.path.exists():
+            return
+        checkpoint = json.loads(self.path.read_text())
+        self.previous_shard_ids = set(checkpoint.get("completed_shards", ()))
+        # Shards priced with other options are not valid for this run.
+        if (resume and checkpoint.get("version") == CHECKPOINT_VERSION and
+                checkpoint.get("options") == self.options):
+            self.completed_shards = checkpoint["completed_shards"]
+
+    def is_completed(self, shard: Shard, output_path: Path) -> bool:
+        completed_shard = self.completed_shards.get(shard.id)
+        return (completed_shard is not None and output_path.exists() and
+                completed_shard["input"] == shard.fingerprint())
+
+    def complete(self, shard: Shard, rows: int) -> None:
+        self.completed_shards[shard.id] = {"input": shard.fingerprint(), "rows": rows}
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        temporary_path.write_text(json.dumps({
+            "version": CHECKPOINT_VERSION,
+            "options": self.options,
+            "completed_shards": self.completed_shards,
+        }, indent=2))
+        os.replace(temporary_path, self.path)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Price the orders of a directory of Parquet, Arrow IPC or CSV files "
+                    "in parallel and write them with a delivery fee column to Parquet files, "
+                    "one per shard. An interrupted run continues where it stopped.")
+    parser.add_argument("input", help="file or directory of order files")
+    parser.add_argument("output", help="directory to write the priced shards to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--row-groups-per-shard", type=int, default=DEFAULT_ROW_GROUPS_PER_SHARD,
+                        help="Parquet row groups per shard "
+                             f"(default: {DEFAULT_ROW_GROUPS_PER_SHARD})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows per record batch of Parquet input "
+                             f"(default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--fee-column", default=DEFAULT_FEE_COLUMN,
+                        help=f"name of the fee column (default: {DEFAULT_FEE_COLUMN})")
+    parser.add_argument("--restart", action="store_true",
+                        help="price all the shards again instead of resuming")
+    args = parser.parse_args(argv)
+
+    try:
+        report = run(args.input, args.output, args.workers, args.row_groups_per_shard,
+                     args.batch_size, args.fee_column, resume=not args.restart)
+    except ValueError as error:
+        parser.exit(1, f"{parser.prog}: error: {error}\n")
+
+    print(f"Priced {report.rows:,} orders in {report.shards - report.skipped_shards:,} "
+          f"shards ({report.skipped_shards:,} already done) in {report.seconds:.2f} s "
+          f"({report.rows_per_second:,.0f} orders/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
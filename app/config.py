@@ -0,0 +1,86 @@
+"""
+This module contains the configuration of the app that can be changed with
+environment variables. The variables are read once when the module is imported.
+
+Environment variables:
+    DELIVERY_FEE_STARTUP_MODE: "standard" (default) serves the FastAPI app with
+        the docs. "lean" serves only the delivery fee routes on plain Starlette,
+        which starts several times faster because FastAPI is never imported.
+    DELIVERY_FEE_QUOTE_FAST_PATH: "1" (default) serves the single quote endpoint
+        of the FastAPI app by validating the raw request body with pydantic-core
+        and serializing the response with orjson, skipping FastAPI's request
+        handling. The responses are the same. "0" uses the plain FastAPI route.
+    DELIVERY_FEE_CACHE_SIZE: Number of different orders whose delivery fees are
+        cached by the delivery fee calculator. Not set (default) or 0 disables
+        the cache. Worth enabling when custom steps or transformers prevent
+        compiling the pipeline, the compiled pipeline is faster than a lookup.
+    DELIVERY_FEE_METRICS: "1" (default) records the request latency of the
+        delivery fee routes and the time of the calculation steps and
+        transformers, served at /metrics in the Prometheus text format. "0"
+        records nothing.
+    DELIVERY_FEE_METRICS_SAMPLE_EVERY: The steps and transformers are timed in
+        one of every this many calculations (default 100). Their calls are
+        always counted.
+    DELIVERY_FEE_SERVER_TIMING: "1" lets the quote requests with the
+        `X-Server-Timing: 1` header get the time of every phase and every step
+        and transformer in a `Server-Timing` response header. Needs the quote
+        fast path. "0" (default) serves the quote requests without timing.
+    DELIVERY_FEE_SERVER_TIMING_SAMPLE_RATE: Fraction of the quote requests
+        without the header which are timed when the server timing is on
+        (default 0, 0.01 = 1%).
+    DELIVERY_FEE_PRICING_CONFIG: Path of a JSON or YAML pricing configuration file
+        (see `app.delivery_fee.pricing_config`) used instead of the steps and
+        transformers of `app/delivery_fee/settings.py`. Not set by default.
+    DELIVERY_FEE_PRICING_CONFIG_WATCH: "1" (default) reloads the pricing
+        configuration file while the app is running whenever it changes. "0"
+        reads it only at startup.
+    DELIVERY_FEE_CITY_PRICING: Path of a city pricing table (see
+        `app.delivery_fee.city_pricing`) whose cities are quoted at
+        /api/delivery/calculate_delivery_fee/cities/{city}/. Not set by default.
+    DELIVERY_FEE_CITY_PRICING_MAX_CITIES: Number of cities whose pipelines are
+        kept in memory by every worker (default 1024). The least recently
+        quoted city is dropped first and built again from the table when needed.
+    DELIVERY_FEE_SURFACE_DIR: Directory of precomputed fee surfaces (see
+        `app.delivery_fee.fee_surface`). When it is set, the fees of the orders
+        in the range of the surface are looked up from a table shared by the
+        workers instead of calculated. Not set by default.
+    DELIVERY_FEE_SURFACE_MAX_DISTANCE: Longest delivery distance in meters in
+        the fee surface (default 20000). Longer deliveries are calculated.
+    DELIVERY_FEE_SURFACE_MAX_ITEMS: Largest number of items in the fee surface
+        (default 50). Larger orders are calculated.
+"""
+import os
+
+
+STARTUP_MODES = ("standard", "lean")
+
+STARTUP_MODE = os.environ.get("DELIVERY_FEE_STARTUP_MODE", "standard")
+if STARTUP_MODE not in STARTUP_MODES:
+    raise ValueError(f"DELIVERY_FEE_STARTUP_MODE must be one of {STARTUP_MODES}, "
+                     f"got {STARTUP_MODE!r}")
+
+QUOTE_FAST_PATH = os.environ.get("DELIVERY_FEE_QUOTE_FAST_PATH", "1") != "0"
+
+CACHE_SIZE = int(os.environ.get("DELIVERY_FEE_CACHE_SIZE", "0")) or None
+
+METRICS = os.environ.get("DELIVERY_FEE_METRICS", "1") != "0"
+
+METRICS_SAMPLE_EVERY = int(os.environ.get("DELIVERY_FEE_METRICS_SAMPLE_EVERY", "100"))
+
+SERVER_TIMING = os.environ.get("DELIVERY_FEE_SERVER_TIMING", "0") != "0"
+
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get("DELIVERY_FEE_SERVER_TIMING_SAMPLE_RATE", "0"))
+
+PRICING_CONFIG = os.environ.get("DELIVERY_FEE_PRICING_CONFIG") or None
+
+PRICING_CONFIG_WATCH = os.environ.get("DELIVERY_FEE_PRICING_CONFIG_WATCH", "1") != "0"
+
+CITY_PRICING = os.environ.get("DELIVERY_FEE_CITY_PRICING") or None
+
+CITY_PRICING_MAX_CITIES = int(os.environ.get("DELIVERY_FEE_CITY_PRICING_MAX_CITIES", "1024"))
+
+FEE_SURFACE_DIR = os.environ.get("DELIVERY_FEE_SURFACE_DIR") or None
+
+FEE_SURFACE_MAX_DISTANCE = int(os.environ.get("DELIVERY_FEE_SURFACE_MAX_DISTANCE", "20000"))
+
+FEE_SURFACE_MAX_ITEMS = int(os.environ.get("DELIVERY_FEE_SURFACE_MAX_ITEMS", "50"))
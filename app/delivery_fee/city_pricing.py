@@ -0,0 +1,279 @@
+"""
+Pricing of thousands of cities from a compact, memory-mapped table instead of
+pydantic `ConfigOptions` objects in every worker.
+
+The table file has a header and one fixed size record per city, sorted by the
+city name. A record holds the configuration options of the standard steps and
+transformers (`COMPONENT_TYPES`, in that order) as little-endian binary
+numbers, and the timezone of the rush hour as a string. The record layout is
+derived from the fields of their `ConfigOptions`, and a fingerprint of it in
+the header makes sure a table is only read with the layout it was written with.
+
+`CityPricingStore` memory-maps the table read-only, so all the workers on a
+machine share the same pages of the page cache, and finds a city by a binary
+search over the records. The `PricingPipeline` of a city is built only when the
+city is first priced and kept in a bounded LRU cache, so the memory of a worker
+stays flat however many cities the table has.
+
+Build a table from a JSON file of {city: {"calculation_steps": [...],
+"transformers": [...]}} in the format of `app.delivery_fee.pricing_config`:
+    python -m app.delivery_fee.city_pricing cities.json cities.bin
+"""
+import argparse
+import json
+import mmap
+import struct
+from datetime import time
+from hashlib import sha256
+from pathlib import Path
+from typing import Any, Iterator, Mapping
+from app.delivery_fee.fee_cache import CacheStats, LRUCache
+from app.delivery_fee.fee_calculation_steps import (
+    CartValueFee,
+    DeliveryDistanceFee,
+    NumberOfItemsFee,
+)
+from app.delivery_fee.fee_calculator import PricingPipeline
+from app.delivery_fee.fee_transformers import (
+    LimitFeeTransformer,
+    ReduceFeeTransformer,
+    RushHourFeeTransformer,
+)
+from app.delivery_fee.markets import MarketComponents
+from app.delivery_fee.pricing_config import PricingConfigError, parse_pricing_config
+from app.delivery_fee.time_index import WEEKDAY_NAMES, microsecond_of_day
+from app import config
+
+
+# The steps and transformers of every city, in the order they are applied.
+CALCULATION_STEP_TYPES = (CartValueFee, DeliveryDistanceFee, NumberOfItemsFee)
+TRANSFORMER_TYPES = (RushHourFeeTransformer, ReduceFeeTransformer, LimitFeeTransformer)
+COMPONENT_TYPES = (*CALCULATION_STEP_TYPES, *TRANSFORMER_TYPES)
+
+MAGIC = b"DFCITIES"
+MAX_CITY_NAME_BYTES = 32
+MAX_TIMEZONE_BYTES = 40
+
+# Magic, layout fingerprint, record size and number of records.
+_HEADER = struct.Struct("<8s8sIQ")
+# Struct format of the options by their annotation. Times are stored as the
+# microsecond of the day and weekday names as the index of the weekday.
+_FIELD_FORMATS = {int: "q", float: "d", time: "q", str: "b"}
+# Except timezone names, which are stored as null padded strings.
+_TIMEZONE_FIELD = "timezone"
+_TIMEZONE_FORMAT = f"{MAX_TIMEZONE_BYTES}s"
+
+
+def _option_fields() -> list[tuple[int, str, type]]:
+    # (index of the component, option name, annotation) of every stored option.
+    return [(index, name, field.annotation)
+            for index, component_type in enumerate(COMPONENT_TYPES)
+            for name, field in component_type.ConfigOptions.model_fields.items()]
+
+
+def _field_format(name: str, annotation: type) -> str:
+    return _TIMEZONE_FORMAT if name == _TIMEZONE_FIELD else _FIELD_FORMATS[annotation]
+
+
+_OPTION_FIELDS = _option_fields()
+_RECORD = struct.Struct(f"<{MAX_CITY_NAME_BYTES}s" + "".join(
+    _field_format(name, annotation) for _, name, annotation in _OPTION_FIELDS))
+_LAYOUT_FINGERPRINT = sha256(json.dumps(
+    [[COMPONENT_TYPES[index].__name__, name, _field_format(name, annotation)]
+     for index, name, annotation in _OPTION_FIELDS]).encode()).digest()[:8]
+
+
+def _encode_option(value: Any, name: str, annotation: type) -> int | float | bytes:
+    if name == _TIMEZONE_FIELD:
+        timezone = value.encode()
+        if len(timezone) > MAX_TIMEZONE_BYTES or b"\0" in timezone:
+            raise ValueError(f"timezone {value!r} must have at most {MAX_TIMEZONE_BYTES} "
+                             "bytes and no null characters")
+        return timezone
+    if annotation is time:
+        return microsecond_of_day(value)
+    if annotation is str:
+        if value not in WEEKDAY_NAMES:
+            raise ValueError(f"{value!r} is not a weekday name")
+        return WEEKDAY_NAMES.index(value)
+    if annotation is int:
+        # Some defaults of the options are integral floats, such as 10e2.
+        if value != int(value):
+            raise ValueError(f"{value!r} is not an integer")
+        return int(value)
+    return value
+
+
+def _decode_option(value: int | float | bytes, name: str, annotation: type) -> Any:
+    if name == _TIMEZONE_FIELD:
+        return value.rstrip(b"\0").decode()
+    if annotation is time:
+        seconds, microsecond = divmod(value, 1_000_000)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        return time(hour, minute, second, microsecond)
+    if annotation is str:
+        return WEEKDAY_NAMES[value]
+    return value
+
+
+def _encode_record(city: str, components: MarketComponents) -> bytes:
+    calculation_steps, transformers = components
+    components = [*calculation_steps, *transformers]
+    if tuple(map(type, components)) != COMPONENT_TYPES:
+        names = ", ".join(component_type.__name__ for component_type in COMPONENT_TYPES)
+        raise ValueError(f"city {city!r} must have the steps and transformers {names}")
+    return _RECORD.pack(
+        _encode_city_name(city),
+        *(_encode_option(getattr(components[index].config_options, name), name,
+                         annotation)
+          for index, name, annotation in _OPTION_FIELDS))
+
+
+def _encode_city_name(city: str) -> bytes:
+    name = city.encode()
+    if not name or len(name) > MAX_CITY_NAME_BYTES or b"\0" in name:
+        raise ValueError(f"city name {city!r} must have 1 to {MAX_CITY_NAME_BYTES} bytes "
+                         "and no null characters")
+    return name
+
+
+def write_city_table(path: str | Path, cities: Mapping[str, MarketComponents]) -> None:
+    """Writes the (calculation steps, transformers) of every city to a table
+    file. The steps and transformers must be `COMPONENT_TYPES`."""
+    records = sorted(_encode_record(city, components)
+                     for city, components in cities.items())
+    names = [record[:MAX_CITY_NAME_BYTES] for record in records]
+    if len(set(names)) != len(names):
+        raise ValueError("the city names must be unique")
+    with open(path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, _LAYOUT_FINGERPRINT, _RECORD.size, len(records)))
+        file.writelines(records)
+
+
+class CityPricingStore:
+    """Read-only pricing of the cities of a table file written by
+    `write_city_table`. At most `max_cities` city pipelines are kept in memory,
+    each with a result cache of `cache_size` orders if it is given."""
+
+    def __init__(self, path: str | Path, max_cities: int = config.CITY_PRICING_MAX_CITIES,
+                 cache_size: int | None = None) -> None:
+        self.path = Path(path)
+        self.cache_size = cache_size
+        with open(self.path, "rb") as file:
+            self._table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._count = self._read_header()
+        except ValueError:
+            self._table.close()
+            raise
+        self._pipelines = LRUCache(max_cities)
+
+    def _read_header(self) -> int:
+        if len(self._table) < _HEADER.size:
+            raise ValueError(f"{self.path} is not a city pricing table")
+        magic, fingerprint, record_size, count = _HEADER.unpack_from(self._table)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a city pricing table")
+        if fingerprint != _LAYOUT_FINGERPRINT or record_size != _RECORD.size:
+            raise ValueError(f"{self.path} was written with other configuration options, "
+                             "write the table again")
+        if len(self._table) != _HEADER.size + count * record_size:
+            raise ValueError(f"{self.path} is truncated")
+        return count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, city: object) -> bool:
+        return isinstance(city, str) and self._find(city) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(self._count):
+            yield self._name_at(position).rstrip(b"\0").decode()
+
+    def pipeline(self, city: str) -> PricingPipeline:
+        """Returns the pipeline of the city. Raises `KeyError` if the city is
+        not in the table."""
+        pipeline = self._pipelines.get(city)
+        if pipeline is None:
+            # Two threads may build the same city at the same time, both
+            # pipelines are the same, so it does not matter which one is kept.
+            pipeline = self._build_pipeline(city)
+            self._pipelines.put(city, pipeline)
+        return pipeline
+
+    def pipeline_stats(self) -> CacheStats:
+        """Statistics of the cache of the built pipelines."""
+        return self._pipelines.stats()
+
+    def close(self) -> None:
+        self._table.close()
+
+    def _build_pipeline(self, city: str) -> PricingPipeline:
+        position = self._find(city)
+        if position is None:
+            raise KeyError(city)
+        offset = _HEADER.size + position * _RECORD.size
+        values = _RECORD.unpack_from(self._table, offset)[1:]
+        options: list[dict[str, Any]] = [{} for _ in COMPONENT_TYPES]
+        for (index, name, annotation), value in zip(_OPTION_FIELDS, values):
+            options[index][name] = _decode_option(value, name, annotation)
+        components = [
+            component_type(component_type.ConfigOptions(**component_options))
+            for component_type, component_options in zip(COMPONENT_TYPES, options)]
+        return PricingPipeline.build(components[:len(CALCULATION_STEP_TYPES)],
+                                     components[len(CALCULATION_STEP_TYPES):],
+                                     cache_size=self.cache_size)
+
+    def _find(self, city: str) -> int | None:
+        # Binary search over the sorted names, straight from the mapped table.
+        name = city.encode().ljust(MAX_CITY_NAME_BYTES, b"\0")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name_at(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._name_at(low) == name:
+            return low
+        return None
+
+    def _name_at(self, position: int) -> bytes:
+        offset = _HEADER.size + position * _RECORD.size
+        return self._table[offset:offset + MAX_CITY_NAME_BYTES]
+
+
+# The city pricing table of `config.CITY_PRICING`, if the app is configured with one.
+CITY_PRICING_STORE = (CityPricingStore(config.CITY_PRICING, cache_size=config.CACHE_SIZE)
+                      if config.CITY_PRICING is not None else None)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Build a city pricing table from a JSON file of city configurations.")
+    parser.add_argument("input", help="JSON file of {city: pricing configuration}")
+    parser.add_argument("output", help="city pricing table to write")
+    args = parser.parse_args(argv)
+
+    try:
+        cities = json.loads(Path(args.input).read_bytes())
+        if not isinstance(cities, dict):
+            raise PricingConfigError("the file must be an object of cities")
+        components = {}
+        for city, data in cities.items():
+            try:
+                pricing_config = parse_pricing_config(data)
+            except PricingConfigError as error:
+                raise PricingConfigError(f"{city}: {error}") from error
+            components[city] = (pricing_config.calculation_steps,
+                                pricing_config.transformers)
+        write_city_table(args.output, components)
+    except (OSError, ValueError) as error:
+        parser.exit(1, f"{error}\n")
+    print(f"Wrote {len(components)} cities to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+This module contains the result cache of `DeliveryFeeCalculator`.
+
+Most orders share the few properties of the order that the fee actually
+depends on, for example every cart value above the surcharge threshold gives
+the same cart value fee. So instead of the raw order, the cache is keyed on a
+normalized key built from the parts that each step and transformer reports
+(see `cache_key_source` and `app.delivery_fee.pipeline_compiler.compile_cache_key`).
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Hashable
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class LRUCache:
+    """Thread safe cache of at most `max_size` items. When the cache is full,
+    the least recently used item is evicted."""
+
+    def __init__(self, max_size: int) -> None:
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+        self.max_size = max_size
+        self._items: OrderedDict[Hashable, object] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> object | None:
+        """Returns the cached value or None if the key is not in the cache."""
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: object) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(max_size=self.max_size, size=len(self._items), hits=self.hits,
+                              misses=self.misses, evictions=self.evictions)
@@ -1,21 +1,75 @@
 from abc import ABC, abstractmethod
-from app.delivery_fee.models import OrderInfo, DeliveryFee
-from pydantic import BaseModel
+from app.delivery_fee.models import OrderInfo, OrderInfoLike, DeliveryFee
+from app.delivery_fee.pipeline_compiler import as_int_constant
+from pydantic import BaseModel, ConfigDict
+from bisect import bisect_left
 from math import ceil
+from typing import Literal, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # NumPy is imported only when the vectorized methods are used.
+    import numpy as np
+    from app.delivery_fee.order_columns import OrderInfoColumns
 
 
 class DeliveryFeeCalculationStep(ABC):
     """Abstract class for all the calculation steps. 
     These steps are used to calculate the delivery fee. 
     Any subclass of this class is essentially one of the rules 
-    to calculate surcharge for the total delivery fee."""
+    to calculate surcharge for the total delivery fee.
+
+    Subclasses implement `calculate_fee`, which works on plain integers so that
+    the calculator can add up the fees without building any models. Overriding
+    `calculate` instead is also supported."""
 
     class ConfigOptions(BaseModel):
         """Configuration options for DeliveryFeeTransformer."""
+        model_config = ConfigDict(frozen=True)
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        # Steps which only override the model based `calculate` still work.
+        if (getattr(cls.calculate_fee, "__isabstractmethod__", False) and
+                cls.calculate is not DeliveryFeeCalculationStep.calculate):
+            cls.calculate_fee = _calculate_fee_with_model
 
     @abstractmethod
-    def calculate(cls, order_info: OrderInfo, delivery_fee_configs) -> DeliveryFee:
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        """Calculate the delivery fee in cents for the given order info."""
+
+    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
         """Calculate the delivery fee for the given order info."""
+        return DeliveryFee(delivery_fee=self.calculate_fee(order_info))
+
+    def calculate_many(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        """Calculate the delivery fees for many orders at once. Returns an int64
+        array of fees in the same order as the orders. Subclasses should override
+        this with a vectorized version, by default `calculate` is called per order."""
+        import numpy as np
+
+        return np.fromiter(
+            (self.calculate_fee(order_columns.order_record(index))
+             for index in range(len(order_columns))),
+            dtype=np.int64, count=len(order_columns))
+
+    def compiled_source(self) -> list[str] | None:
+        """Returns Python source lines which add the fee of this step to the local
+        `delivery_fee` with the configuration options folded in as constants.
+        See `app.delivery_fee.pipeline_compiler`. By default the step can't be
+        compiled and None is returned."""
+        return None
+
+    def cache_key_source(self) -> list[str] | None:
+        """Returns Python expressions of the order variables that the fee of this
+        step depends on, orders with the same values have the same fee. Used as a
+        part of the calculator's cache key. By default the step can't be cached
+        and None is returned."""
+        return None
+
+
+def _calculate_fee_with_model(self: DeliveryFeeCalculationStep,
+                              order_info: OrderInfoLike) -> int:
+    return self.calculate(order_info).delivery_fee
 
 
 class CartValueFee(DeliveryFeeCalculationStep):
@@ -30,6 +84,8 @@ class CartValueFee(DeliveryFeeCalculationStep):
         Default for surcharge threshold is 10€.
         >>> cart_value_surcharge_threshold: int = 10e2  # 10€ (inclusive)
         """
+        model_config = ConfigDict(frozen=True)
+
         cart_value_surcharge_threshold: int = 10e2
 
     def __init__(self, config_options: ConfigOptions | None = None) -> None:
@@ -38,16 +94,43 @@ class CartValueFee(DeliveryFeeCalculationStep):
         if config_options is None:
             self.config_options = self.ConfigOptions()
 
-    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
-        delivery_fee = DeliveryFee(delivery_fee=0)
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        delivery_fee = 0
 
         # Apply surcharge if cart value is less than 10€.
         if (order_info.cart_value < self.config_options.cart_value_surcharge_threshold):
-            delivery_fee += (self.config_options.cart_value_surcharge_threshold -
-                             order_info.cart_value)
+            surcharge = self.config_options.cart_value_surcharge_threshold - order_info.cart_value
+            delivery_fee = max(delivery_fee + surcharge, 0)
 
         return delivery_fee
 
+    def calculate_many(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        import numpy as np
+
+        threshold = self.config_options.cart_value_surcharge_threshold
+        cart_value = order_columns.cart_value
+
+        surcharge = np.maximum(threshold - cart_value, 0)
+        return np.where(cart_value < threshold, surcharge, 0).astype(np.int64)
+
+    def compiled_source(self) -> list[str] | None:
+        threshold = as_int_constant(self.config_options.cart_value_surcharge_threshold)
+        if threshold is None:
+            return None
+
+        return [
+            f"if cart_value < {threshold}:",
+            f"    delivery_fee += {threshold} - cart_value",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        threshold = as_int_constant(self.config_options.cart_value_surcharge_threshold)
+        if threshold is None:
+            return None
+
+        # All the cart values at or above the threshold have no surcharge.
+        return [f"min(cart_value, {threshold})"]
+
 
 class DeliveryDistanceFee(DeliveryFeeCalculationStep):
     """Calculates delivery fee on the delivery distance using the following rule:
@@ -75,6 +158,8 @@ class DeliveryDistanceFee(DeliveryFeeCalculationStep):
         >>> additional_fee = 1e2  # 1€
         >>> additional_fee_applied_per_meters_traveled = 500  # 500m (inclusive)
         """
+        model_config = ConfigDict(frozen=True)
+
         delivery_distance_low_threshold: int = 1e3
         delivery_distance_surcharge_for_low_threshold: int = 2e2
         additional_fee: int = 1e2
@@ -86,12 +171,13 @@ class DeliveryDistanceFee(DeliveryFeeCalculationStep):
         if config_options is None:
             self.config_options = self.ConfigOptions()
 
-    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
-        delivery_fee = DeliveryFee(delivery_fee=0)
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        delivery_fee = 0
 
         # Apply surcharge for first 1km.
         if order_info.delivery_distance > 0:
-            delivery_fee += self.config_options.delivery_distance_surcharge_for_low_threshold
+            delivery_fee = max(
+                delivery_fee + self.config_options.delivery_distance_surcharge_for_low_threshold, 0)
 
         # Apply additional fee for every 500m traveled.
         if order_info.delivery_distance > self.config_options.delivery_distance_low_threshold:
@@ -100,11 +186,70 @@ class DeliveryDistanceFee(DeliveryFeeCalculationStep):
             additional_fee_multiplier = ceil(
                 additional_distance_to_travel / self.config_options.additional_fee_applied_per_meters_traveled)
 
-            delivery_fee += (additional_fee_multiplier *
-                             self.config_options.additional_fee)
+            delivery_fee = max(delivery_fee + additional_fee_multiplier *
+                               self.config_options.additional_fee, 0)
 
         return delivery_fee
 
+    def calculate_many(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        import numpy as np
+
+        delivery_distance = order_columns.delivery_distance
+        low_threshold = self.config_options.delivery_distance_low_threshold
+
+        delivery_fee = np.where(
+            delivery_distance > 0,
+            max(self.config_options.delivery_distance_surcharge_for_low_threshold, 0),
+            0).astype(np.int64)
+
+        # Same float division and ceil as the scalar version.
+        additional_fee_multiplier = np.ceil(
+            (delivery_distance - low_threshold) /
+            self.config_options.additional_fee_applied_per_meters_traveled).astype(np.int64)
+        with_additional_fee = np.maximum(
+            delivery_fee + additional_fee_multiplier * int(self.config_options.additional_fee), 0)
+
+        return np.where(delivery_distance > low_threshold,
+                        with_additional_fee, delivery_fee).astype(np.int64)
+
+    def compiled_source(self) -> list[str] | None:
+        low_threshold = as_int_constant(self.config_options.delivery_distance_low_threshold)
+        surcharge_for_low_threshold = as_int_constant(
+            self.config_options.delivery_distance_surcharge_for_low_threshold)
+        additional_fee = as_int_constant(self.config_options.additional_fee)
+        meters_per_additional_fee = as_int_constant(
+            self.config_options.additional_fee_applied_per_meters_traveled, minimum=1)
+        if None in (low_threshold, surcharge_for_low_threshold,
+                    additional_fee, meters_per_additional_fee):
+            return None
+
+        # The integer ceil division `-(-a // b)` equals `ceil(a / b)` for all the
+        # distances that a float can represent exactly, without the float division.
+        return [
+            "if delivery_distance > 0:",
+            f"    delivery_fee += {surcharge_for_low_threshold}",
+            f"    if delivery_distance > {low_threshold}:",
+            f"        delivery_fee += ({low_threshold} - delivery_distance) "
+            f"// {meters_per_additional_fee} * {-additional_fee}",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        low_threshold = as_int_constant(self.config_options.delivery_distance_low_threshold)
+        meters_per_additional_fee = as_int_constant(
+            self.config_options.additional_fee_applied_per_meters_traveled, minimum=1)
+        if low_threshold is None or meters_per_additional_fee is None:
+            return None
+
+        # The fee only depends on the number of started additional distance steps.
+        # Longer distances than floats represent exactly are not grouped, as the
+        # float division of `calculate` might round them differently.
+        return [
+            "0 if delivery_distance <= 0 else "
+            f"1 if delivery_distance <= {low_threshold} else "
+            f"delivery_distance if delivery_distance > {2**53} else "
+            f"({low_threshold} - delivery_distance) // {meters_per_additional_fee} - 1",
+        ]
+
 
 class NumberOfItemsFee(DeliveryFeeCalculationStep):
     """Calculates delivery fee on number of items using the following rule:
@@ -133,6 +278,8 @@ class NumberOfItemsFee(DeliveryFeeCalculationStep):
         >>> bulk_charge = 1.2e2  # 1.20€
         >>> bulk_charge_threshold = 12 (exclusive)
         """
+        model_config = ConfigDict(frozen=True)
+
         number_of_items_surcharge_threshold: int = 4
         surcharge_per_item_over_threshold: int = 50
         bulk_charge: int = 1.2e2
@@ -144,8 +291,8 @@ class NumberOfItemsFee(DeliveryFeeCalculationStep):
         if config_options is None:
             self.config_options = self.ConfigOptions()
 
-    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
-        delivery_fee = DeliveryFee(delivery_fee=0)
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        delivery_fee = 0
 
         # Apply surcharge if number of items is more than the threshold.
         if order_info.number_of_items > self.config_options.number_of_items_surcharge_threshold:
@@ -153,10 +300,194 @@ class NumberOfItemsFee(DeliveryFeeCalculationStep):
                 self.config_options.number_of_items_surcharge_threshold
 
             surcharge = items_over_threshold * self.config_options.surcharge_per_item_over_threshold
-            delivery_fee += surcharge
+            delivery_fee = max(delivery_fee + surcharge, 0)
 
         # Apply bulk charge for items.
         if order_info.number_of_items > self.config_options.bulk_charge_threshold:
-            delivery_fee += self.config_options.bulk_charge
+            delivery_fee = max(delivery_fee + self.config_options.bulk_charge, 0)
 
         return delivery_fee
+
+    def calculate_many(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        import numpy as np
+
+        number_of_items = order_columns.number_of_items
+        surcharge_threshold = self.config_options.number_of_items_surcharge_threshold
+        bulk_charge_threshold = self.config_options.bulk_charge_threshold
+
+        surcharge = np.maximum(
+            (number_of_items - surcharge_threshold) *
+            int(self.config_options.surcharge_per_item_over_threshold), 0)
+        delivery_fee = np.where(number_of_items > surcharge_threshold, surcharge, 0)
+
+        with_bulk_charge = np.maximum(
+            delivery_fee + int(self.config_options.bulk_charge), 0)
+        return np.where(number_of_items > bulk_charge_threshold,
+                        with_bulk_charge, delivery_fee).astype(np.int64)
+
+    def compiled_source(self) -> list[str] | None:
+        surcharge_threshold = as_int_constant(
+            self.config_options.number_of_items_surcharge_threshold)
+        surcharge_per_item = as_int_constant(
+            self.config_options.surcharge_per_item_over_threshold)
+        bulk_charge = as_int_constant(self.config_options.bulk_charge)
+        bulk_charge_threshold = as_int_constant(self.config_options.bulk_charge_threshold)
+        if None in (surcharge_threshold, surcharge_per_item,
+                    bulk_charge, bulk_charge_threshold):
+            return None
+
+        return [
+            f"if number_of_items > {surcharge_threshold}:",
+            f"    delivery_fee += (number_of_items - {surcharge_threshold}) * {surcharge_per_item}",
+            f"if number_of_items > {bulk_charge_threshold}:",
+            f"    delivery_fee += {bulk_charge}",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        surcharge_threshold = as_int_constant(
+            self.config_options.number_of_items_surcharge_threshold)
+        surcharge_per_item = as_int_constant(
+            self.config_options.surcharge_per_item_over_threshold)
+        bulk_charge_threshold = as_int_constant(self.config_options.bulk_charge_threshold)
+        if None in (surcharge_threshold, surcharge_per_item, bulk_charge_threshold):
+            return None
+
+        # Item counts up to the lower threshold have no surcharge. Above both of the
+        # thresholds the fee still grows with every item, unless there is no
+        # surcharge per item.
+        number_of_items = f"max(number_of_items, {min(surcharge_threshold, bulk_charge_threshold)})"
+        if surcharge_per_item == 0:
+            number_of_items = (f"min({number_of_items}, "
+                               f"{max(surcharge_threshold, bulk_charge_threshold) + 1})")
+        return [number_of_items]
+
+
+class FeeBand(BaseModel):
+    """One band of `TieredFee`. Values above `above` (exclusive) get the base
+    fee and the fee per unit for every started `unit` above `above`."""
+    model_config = ConfigDict(frozen=True)
+
+    above: int
+    base_fee: int = 0
+    fee_per_unit: int = 0
+    unit: int = 1
+
+
+class TieredFee(DeliveryFeeCalculationStep):
+    """Calculates delivery fee on one property of the order using bands:
+    A value above the start of a band, up to and including the start of the next
+    band, gets the base fee of the band and the fee per unit for every started
+    unit above the start of the band. Values at or below the start of the first
+    band have no fee.
+
+        Example: With the bands
+            above 0: 2€
+            above 1000 m: 2€ + 1€ for every started 500 m above 1000 m
+        the fee of 1501 meters is 2€ + 2 * 1€ => 4€, the same as the fee of
+        `DeliveryDistanceFee` with the default options.
+
+    The band of a value is found by a binary search over the starts of the
+    bands, so hundreds of bands take a few comparisons. The compiled pipeline
+    looks the fees up from a precomputed table instead when the last band
+    starts at most at `DENSE_TABLE_MAX_VALUE`."""
+
+    # Largest start of the last band for which the fees are precomputed.
+    DENSE_TABLE_MAX_VALUE = 4096
+
+    class ConfigOptions(BaseModel):
+        """Configuration options for TieredFee.
+
+        The bands must be sorted by their starts. By default there are no bands
+        and no fee.
+        >>> order_field = "delivery_distance"  # or "cart_value", "number_of_items"
+        >>> bands = (FeeBand(above=0, base_fee=2e2),
+        ...          FeeBand(above=1e3, base_fee=2e2, fee_per_unit=1e2, unit=500))
+        """
+        model_config = ConfigDict(frozen=True)
+
+        order_field: Literal["cart_value", "delivery_distance",
+                             "number_of_items"] = "delivery_distance"
+        bands: tuple[FeeBand, ...] = ()
+
+    def __init__(self, config_options: ConfigOptions | None = None) -> None:
+        super().__init__()
+        self.config_options = config_options
+        if config_options is None:
+            self.config_options = self.ConfigOptions()
+
+        bands = self.config_options.bands
+        for band, next_band in zip(bands, bands[1:]):
+            if band.above >= next_band.above:
+                raise ValueError("the bands must be sorted by their starts, "
+                                 f"{band.above} is not below {next_band.above}")
+        for band in bands:
+            if band.unit < 1 or band.base_fee < 0 or band.fee_per_unit < 0:
+                raise ValueError(f"the band above {band.above} must have a unit of at "
+                                 "least 1 and non-negative fees")
+
+        self._order_field = self.config_options.order_field
+        # The bands as parallel tuples, for the binary search and the compiled source.
+        self._starts = tuple(band.above for band in bands)
+        self._base_fees = tuple(band.base_fee for band in bands)
+        self._units = tuple(band.unit for band in bands)
+        self._fees_per_unit = tuple(band.fee_per_unit for band in bands)
+
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        return self._fee_of(getattr(order_info, self._order_field))
+
+    def _fee_of(self, value: int) -> int:
+        band = bisect_left(self._starts, value) - 1
+        if band < 0:
+            return 0
+        # The integer ceil division `-(-a // b)` of the started units.
+        return (self._base_fees[band] -
+                (self._starts[band] - value) // self._units[band] * self._fees_per_unit[band])
+
+    def calculate_many(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        import numpy as np
+
+        values = getattr(order_columns, self._order_field)
+        if not self._starts:
+            return np.zeros(len(values), dtype=np.int64)
+
+        starts = np.array(self._starts, dtype=np.int64)
+        bands = np.searchsorted(starts, values, side="left") - 1
+        band = np.maximum(bands, 0)
+        delivery_fee = (np.array(self._base_fees, dtype=np.int64)[band] -
+                        (starts[band] - values) // np.array(self._units, dtype=np.int64)[band] *
+                        np.array(self._fees_per_unit, dtype=np.int64)[band])
+        return np.where(bands >= 0, delivery_fee, 0).astype(np.int64)
+
+    def compiled_source(self) -> list[str] | None:
+        if not self._starts:
+            return []
+
+        field = self._order_field
+        last_start = self._starts[-1]
+        last_band_fee = (f"{self._base_fees[-1]} + ({last_start} - {field}) "
+                         f"// {self._units[-1]} * {-self._fees_per_unit[-1]}")
+        if last_start <= self.DENSE_TABLE_MAX_VALUE:
+            # The order values are non-negative, so they index the table directly.
+            dense_fees = tuple(self._fee_of(value) for value in range(last_start + 1))
+            return [
+                f"if {field} <= {last_start}:",
+                f"    delivery_fee += {dense_fees!r}[{field}]",
+                "else:",
+                f"    delivery_fee += {last_band_fee}",
+            ]
+
+        return [
+            f"tier = bisect_left({self._starts!r}, {field}) - 1",
+            "if tier >= 0:",
+            f"    delivery_fee += ({self._base_fees!r}[tier] - "
+            f"({self._starts!r}[tier] - {field}) // {self._units!r}[tier] * "
+            f"{self._fees_per_unit!r}[tier])",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        if not self._starts:
+            return []
+
+        # All the values at or below the start of the first band have no fee.
+        return [f"max({self._order_field}, {self._starts[0]})"]
+
@@ -1,24 +1,246 @@
 from app.delivery_fee.fee_calculation_steps import DeliveryFeeCalculationStep
 from app.delivery_fee.fee_transformers import DeliveryFeeTransformer
-from app.delivery_fee.models import OrderInfo, DeliveryFee
+from app.delivery_fee.fee_cache import CacheStats, LRUCache
+from app.delivery_fee.models import OrderInfo, OrderInfoLike, DeliveryFee
+from app.delivery_fee.pipeline_compiler import (
+    CacheKeyFunction,
+    CompiledPipeline,
+    compile_cache_key,
+    compile_pipeline,
+)
 from app.delivery_fee.utility_meta_classes import ThreadSafeSingletonMeta
+from app.metrics import StageMetrics
+from app import config
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+from pydantic import BaseModel
+from time import perf_counter
+from typing import Iterable, Iterator, TYPE_CHECKING
+import json
 import app.delivery_fee.settings as settings
 
+if TYPE_CHECKING:
+    # NumPy is imported only when the vectorized methods are used.
+    import numpy as np
+    from app.delivery_fee.fee_surface import FeeSurface
+    from app.delivery_fee.order_columns import OrderInfoColumns
+
+
+def configuration_version(calculation_steps: Iterable[DeliveryFeeCalculationStep],
+                          transformers: Iterable[DeliveryFeeTransformer]) -> str:
+    """Short hash of the classes and configuration options of the steps and
+    transformers. Equal configurations have the same version in every process."""
+    components = []
+    for component in [*calculation_steps, *transformers]:
+        config_options = getattr(component, "config_options", None)
+        components.append([type(component).__qualname__,
+                           config_options.model_dump(mode="json", warnings=False)
+                           if isinstance(config_options, BaseModel) else repr(config_options)])
+    return sha256(json.dumps(_integral_floats_as_ints(components),
+                             sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _integral_floats_as_ints(value: object) -> object:
+    # The defaults of the options are not validated, so 10e2 and 1000 are the same option.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [_integral_floats_as_ints(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _integral_floats_as_ints(item) for key, item in value.items()}
+    return value
+
+
+def stage_names(calculation_steps: Iterable[DeliveryFeeCalculationStep],
+                transformers: Iterable[DeliveryFeeTransformer]) -> list[tuple[str, str]]:
+    """The kind ("step" or "transformer") and class name of the calculation
+    steps and transformers in the order they are applied."""
+    return [*(("step", type(step).__name__) for step in calculation_steps),
+            *(("transformer", type(transformer).__name__) for transformer in transformers)]
+
+
+@dataclass(frozen=True, slots=True)
+class PricingPipeline:
+    """One configuration of `DeliveryFeeCalculator`: the steps and transformers,
+    their compiled pipeline, the result cache and the stage metrics, which all
+    belong together. It is never changed, a new configuration is a new pipeline,
+    so a calculation that started with a pipeline finishes with it even if the
+    calculator is reconfigured meanwhile."""
+    version: str
+    calculation_steps: list[DeliveryFeeCalculationStep]
+    transformers: list[DeliveryFeeTransformer]
+    compiled_pipeline: CompiledPipeline | None
+    cache: tuple[CacheKeyFunction, LRUCache] | None
+    stage_metrics: StageMetrics | None
+    fee_surface: "FeeSurface | None" = None
+
+    @classmethod
+    def build(cls, calculation_steps: Iterable[DeliveryFeeCalculationStep],
+              transformers: Iterable[DeliveryFeeTransformer], version: str | None = None,
+              cache_size: int | None = None,
+              metrics_sample_every: int | None = None,
+              fee_surface_dir: str | Path | None = None) -> "PricingPipeline":
+        """Compiles the steps and transformers into a new pipeline, with a new
+        cache of `cache_size` orders and new stage metrics if they are given.
+        `version` names the configuration, by default it is the
+        `configuration_version` of the steps and transformers. With
+        `fee_surface_dir` the fees are looked up from a precomputed fee surface
+        of the directory if one can be built for the steps and transformers (see
+        `app.delivery_fee.fee_surface`)."""
+        calculation_steps = list(calculation_steps)
+        transformers = list(transformers)
+        if version is None:
+            version = configuration_version(calculation_steps, transformers)
+        cache = None
+        if cache_size is not None:
+            cache_key = compile_cache_key([*calculation_steps, *transformers])
+            if cache_key is not None:
+                cache = cache_key, LRUCache(cache_size)
+        stage_metrics = None
+        if metrics_sample_every is not None:
+            stage_metrics = StageMetrics(stage_names(calculation_steps, transformers),
+                                         metrics_sample_every)
+        compiled_pipeline = compile_pipeline(calculation_steps, transformers)
+        fee_surface = None
+        if fee_surface_dir is not None and compiled_pipeline is not None:
+            # Imported here, the fee surfaces are only needed when they are used.
+            from app.delivery_fee.fee_surface import load_fee_surface
+            fee_surface = load_fee_surface(calculation_steps, transformers, fee_surface_dir)
+            if fee_surface is not None:
+                compiled_pipeline = fee_surface.compile(transformers[0], compiled_pipeline)
+        return cls(version, calculation_steps, transformers, compiled_pipeline, cache,
+                   stage_metrics, fee_surface)
+
+    @property
+    def stages(self) -> list[tuple[str, str]]:
+        return stage_names(self.calculation_steps, self.transformers)
+
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        cache = self.cache
+        if cache is None:
+            return self._calculate_fee(order_info)
+
+        cache_key, lru_cache = cache
+        key = cache_key(order_info.cart_value, order_info.delivery_distance,
+                        order_info.number_of_items, order_info.time)
+        delivery_fee = lru_cache.get(key)
+        if delivery_fee is None:
+            delivery_fee = self._calculate_fee(order_info)
+            lru_cache.put(key, delivery_fee)
+        return delivery_fee
+
+    def _calculate_fee(self, order_info: OrderInfoLike) -> int:
+        stage_metrics = self.stage_metrics
+        if stage_metrics is not None and stage_metrics.count_calculation():
+            calculated_fee, stage_seconds = self.calculate_fee_timed(order_info)
+            stage_metrics.record_timed_calculation(stage_seconds)
+            return calculated_fee
+        if self.compiled_pipeline is not None:
+            return self.compiled_pipeline(
+                order_info.cart_value, order_info.delivery_distance,
+                order_info.number_of_items, order_info.time)
+        return self._calculate_step_by_step(order_info)
+
+    def _calculate_step_by_step(self, order_info: OrderInfoLike) -> int:
+        # The fee is passed through the steps and transformers as a plain integer.
+        calculated_fee = 0
+
+        # Follow all the steps to calculate the delivery fee.
+        for step in self.calculation_steps:
+            calculated_fee = max(calculated_fee + step.calculate_fee(order_info), 0)
+
+        # Apply all the transformations to the calculated delivery fee.
+        for transformer in self.transformers:
+            calculated_fee = transformer.transform_fee(order_info, calculated_fee)
+
+        return calculated_fee
+
+    def calculate_fee_timed(self, order_info: OrderInfoLike) -> tuple[int, list[float]]:
+        """Same as `calculate_fee`, but applies the steps and transformers one by
+        one, without the cache, and also returns the seconds each of them took
+        in the order of `stages`."""
+        calculated_fee = 0
+        stage_seconds = []
+
+        for step in self.calculation_steps:
+            started = perf_counter()
+            calculated_fee = max(calculated_fee + step.calculate_fee(order_info), 0)
+            stage_seconds.append(perf_counter() - started)
+
+        for transformer in self.transformers:
+            started = perf_counter()
+            calculated_fee = transformer.transform_fee(order_info, calculated_fee)
+            stage_seconds.append(perf_counter() - started)
+
+        return calculated_fee, stage_seconds
+
+    def calculate_columns(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        for calculated_fees in self.calculate_columns_by_stage(order_columns):
+            pass
+        return calculated_fees
+
+    def calculate_columns_by_stage(self, order_columns: "OrderInfoColumns"
+                                   ) -> Iterator["np.ndarray"]:
+        """Same as `calculate_columns`, but yields the delivery fees before the
+        first step and after every step and transformer, in the order of
+        `stages`, so that the effect of every stage can be seen."""
+        import numpy as np
+
+        calculated_fees = np.zeros(len(order_columns), dtype=np.int64)
+        yield calculated_fees
+
+        # Follow all the steps to calculate the delivery fees.
+        for step in self.calculation_steps:
+            calculated_fees = np.maximum(
+                calculated_fees + step.calculate_many(order_columns), 0)
+            yield calculated_fees
+
+        # Apply all the transformations to the calculated delivery fees.
+        for transformer in self.transformers:
+            calculated_fees = transformer.transform_many(order_columns, calculated_fees)
+            yield calculated_fees
+
 
 class DeliveryFeeCalculator(metaclass=ThreadSafeSingletonMeta):
     """Calculates delivery fee. This is singleton class. This means only the first
-    instance of this class will be used throughout the application."""
+    instance of this class will be used throughout the application, the
+    arguments of the later constructor calls are ignored. Use `configure` to
+    change the steps and transformers of the instance.
+
+    The current configuration is an immutable `PricingPipeline`, which
+    `configure` builds completely before replacing the old one with a single
+    assignment. So reading the configuration never takes a lock, and a
+    calculation never mixes two configurations. `pipeline` gives the current
+    one to callers which need several calculations or the `version` to agree.
+
+    The calculation steps and transformers are compiled into a single function
+    when they are set (see `app.delivery_fee.pipeline_compiler`). If any of them
+    can't be compiled, they are called one by one instead.
+
+    Optionally the results of `calculate` are kept in a size bounded LRU cache
+    (see `app.delivery_fee.fee_cache`). The cache is emptied whenever the steps
+    or transformers are changed. If any of them can't be cached, the cache is
+    not used.
+
+    Optionally the calls and time of the steps and transformers are recorded
+    (see `app.metrics.StageMetrics`). The sampled calculations are timed step
+    by step, all the others use the compiled pipeline as usual."""
 
     def __init__(self, calculation_steps: list[DeliveryFeeCalculationStep] | None = None,
                  transformers: list[DeliveryFeeTransformer] | None = None,
-                 calculation_configurations: None = None):
-        self.calculation_steps = calculation_steps
+                 calculation_configurations: None = None,
+                 cache_size: int | None = None,
+                 metrics_sample_every: int | None = None,
+                 fee_surface_dir: str | Path | None = None):
         if calculation_steps is None:
-            self.calculation_steps = settings.ALL_CALCULATION_STEPS
-
-        self.transformers = transformers
+            calculation_steps = settings.ALL_CALCULATION_STEPS
         if transformers is None:
-            self.transformers = settings.ALL_FEE_TRANSFORMERS
+            transformers = settings.ALL_FEE_TRANSFORMERS
+        self._cache_size = cache_size
+        self._metrics_sample_every = metrics_sample_every
+        self._fee_surface_dir = fee_surface_dir
+        self.configure(calculation_steps, transformers)
 
         # This is a plan for future, so that parameters can be changed easily.
         # And may be in the future we can have different configurations for
@@ -27,20 +249,141 @@ class DeliveryFeeCalculator(metaclass=ThreadSafeSingletonMeta):
         if calculation_configurations is None:
             self.calculation_configurations = None
 
+    @property
+    def pipeline(self) -> PricingPipeline:
+        return self._pipeline
+
+    @property
+    def version(self) -> str:
+        """Version of the current configuration, see `configure`."""
+        return self._pipeline.version
+
+    @property
+    def calculation_steps(self) -> list[DeliveryFeeCalculationStep]:
+        return self._pipeline.calculation_steps
+
+    @calculation_steps.setter
+    def calculation_steps(self, calculation_steps: list[DeliveryFeeCalculationStep]):
+        self.configure(calculation_steps, self._pipeline.transformers)
+
+    @property
+    def transformers(self) -> list[DeliveryFeeTransformer]:
+        return self._pipeline.transformers
+
+    @transformers.setter
+    def transformers(self, transformers: list[DeliveryFeeTransformer]):
+        self.configure(self._pipeline.calculation_steps, transformers)
+
+    def configure(self, calculation_steps: list[DeliveryFeeCalculationStep],
+                  transformers: list[DeliveryFeeTransformer],
+                  version: str | None = None) -> None:
+        """Replace the calculation steps and transformers and compile them again.
+        The lists are copied, so changing the given lists afterwards has no effect.
+        `version` names the configuration, by default it is the
+        `configuration_version` of the steps and transformers."""
+        self._pipeline = PricingPipeline.build(calculation_steps, transformers, version,
+                                               self._cache_size, self._metrics_sample_every,
+                                               self._fee_surface_dir)
+
+    def _recreate_pipeline(self) -> None:
+        pipeline = self._pipeline
+        self._pipeline = PricingPipeline.build(
+            pipeline.calculation_steps, pipeline.transformers, pipeline.version,
+            self._cache_size, self._metrics_sample_every, self._fee_surface_dir)
+
+    def enable_cache(self, cache_size: int) -> None:
+        """Cache the results of at most `cache_size` different orders."""
+        self._cache_size = cache_size
+        self._recreate_pipeline()
+
+    def disable_cache(self) -> None:
+        self._cache_size = None
+        self._recreate_pipeline()
+
+    @property
+    def cache_stats(self) -> CacheStats | None:
+        """Statistics of the cache since the last configuration change or None
+        if the results are not cached."""
+        cache = self._pipeline.cache
+        if cache is None:
+            return None
+        return cache[1].stats()
+
+    @property
+    def stages(self) -> list[tuple[str, str]]:
+        """The kind ("step" or "transformer") and class name of the calculation
+        steps and transformers in the order they are applied."""
+        return self._pipeline.stages
+
+    def enable_metrics(self, sample_every: int) -> None:
+        """Record the calls of the steps and transformers and time them in one of
+        every `sample_every` calculations."""
+        self._metrics_sample_every = sample_every
+        self._recreate_pipeline()
+
+    def disable_metrics(self) -> None:
+        self._metrics_sample_every = None
+        self._recreate_pipeline()
+
+    @property
+    def stage_metrics(self) -> StageMetrics | None:
+        """Metrics of the steps and transformers since the last configuration
+        change or None if they are not recorded."""
+        return self._pipeline.stage_metrics
+
     def calculate(self, order_info: OrderInfo) -> DeliveryFee:
-        calculated_fee = DeliveryFee(delivery_fee=0)
+        return DeliveryFee(delivery_fee=self._pipeline.calculate_fee(order_info))
 
-        # Follow all the steps to calculate the delivery fee.
-        for step in self.calculation_steps:
-            calculated_fee += step.calculate(order_info)
+    def calculate_fee(self, order_info: OrderInfoLike) -> int:
+        """Calculate the delivery fee in cents. Takes a validated `OrderInfo` or a
+        lightweight `OrderRecord`, so library callers can skip the models."""
+        return self._pipeline.calculate_fee(order_info)
 
-        # Apply all the transformations to the calculated delivery fee.
-        for transformer in self.transformers:
-            calculated_fee = transformer.transform(order_info, calculated_fee)
+    def _calculate_step_by_step(self, order_info: OrderInfoLike) -> int:
+        return self._pipeline._calculate_step_by_step(order_info)
 
-        return calculated_fee
+    def calculate_fee_timed(self, order_info: OrderInfoLike) -> tuple[int, list[float]]:
+        """Same as `calculate_fee`, but applies the steps and transformers one by
+        one, without the cache, and also returns the seconds each of them took
+        in the order of `stages`."""
+        return self._pipeline.calculate_fee_timed(order_info)
+
+    def calculate_batch(self, order_infos: list[OrderInfo]) -> list[DeliveryFee]:
+        """Calculate the delivery fee for each of the given order infos.
+        The fees are returned in the same order as the order infos."""
+        calculate_fee = self._pipeline.calculate_fee
+        return [DeliveryFee(delivery_fee=calculate_fee(order_info))
+                for order_info in order_infos]
+
+    def calculate_fees(self, order_infos: Iterable[OrderInfoLike]) -> list[int]:
+        """Same as `calculate_batch` but returns the fees in cents, without models."""
+        calculate_fee = self._pipeline.calculate_fee
+        return [calculate_fee(order_info) for order_info in order_infos]
+
+    def calculate_many(self, cart_value: Iterable, delivery_distance: Iterable,
+                       number_of_items: Iterable, time: Iterable) -> "np.ndarray":
+        """Calculate the delivery fees for many orders given as columns, where the
+        n-th element of every column belongs to the n-th order. Returns an int64
+        array with the same fees as `calculate` would give for each order.
+        Raises `ValueError` if the columns are invalid."""
+        from app.delivery_fee.order_columns import OrderInfoColumns
+
+        order_columns = OrderInfoColumns.from_arrays(
+            cart_value, delivery_distance, number_of_items, time)
+        return self.calculate_columns(order_columns)
+
+    def calculate_columns(self, order_columns: "OrderInfoColumns") -> "np.ndarray":
+        """Vectorized version of `calculate` for already built order columns."""
+        return self._pipeline.calculate_columns(order_columns)
 
 
 # Delivery calculator singleton.
 DELIVERY_FEE_CALCULATOR = DeliveryFeeCalculator(
-    settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS)
+    settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS,
+    cache_size=config.CACHE_SIZE,
+    metrics_sample_every=config.METRICS_SAMPLE_EVERY if config.METRICS else None,
+    fee_surface_dir=config.FEE_SURFACE_DIR)
+if config.PRICING_CONFIG is not None:
+    # Imported here, the configuration file format is only needed when it is used.
+    from app.delivery_fee.pricing_config import load_pricing_config
+    load_pricing_config(config.PRICING_CONFIG).apply_to(DELIVERY_FEE_CALCULATOR)
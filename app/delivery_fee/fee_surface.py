@@ -0,0 +1,273 @@
+"""
+Precomputed fee surfaces: the delivery fees of all the orders in a range,
+looked up from a table instead of calculated.
+
+With the standard steps and transformers (`CALCULATION_STEP_TYPES` and
+`TRANSFORMER_TYPES`) the fee of an order only depends on
+    - the cart value up to the small order surcharge threshold, or whether it
+      is over the free delivery threshold,
+    - the number of started additional distance steps,
+    - the number of items over the item surcharge threshold,
+    - whether it is the rush hour,
+the same properties the cache keys of the steps and transformers are made of.
+Up to `max_distance` and `max_items` those are few enough to calculate the fee
+of every combination once, with a single vectorized pass over one
+representative order of each. The fees are stored in a file named after the
+`configuration_version` of the steps and transformers, and memory-mapped, so
+all the workers on a machine share one copy, and later starts with the same
+configuration only map the file.
+
+The lookup is compiled into a function with the arguments of the compiled
+pipeline (see `pipeline_compiler.compile_table_lookup`), which indexes the
+table with a few integer operations and falls back to the compiled pipeline
+for the orders outside the range.
+"""
+import logging
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from datetime import datetime, time
+from pathlib import Path
+from typing import Self
+import numpy as np
+from app.delivery_fee.fee_calculation_steps import (
+    CartValueFee,
+    DeliveryDistanceFee,
+    DeliveryFeeCalculationStep,
+    NumberOfItemsFee,
+)
+from app.delivery_fee.fee_calculator import PricingPipeline, configuration_version
+from app.delivery_fee.fee_transformers import (
+    DeliveryFeeTransformer,
+    LimitFeeTransformer,
+    ReduceFeeTransformer,
+    RushHourFeeTransformer,
+)
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee.pipeline_compiler import (
+    CompiledPipeline,
+    as_int_constant,
+    compile_table_lookup,
+)
+from app.delivery_fee.time_index import WEEKDAY_NAMES
+from app.delivery_fee.time_zones import UTC
+from app import config
+
+
+logger = logging.getLogger(__name__)
+
+# The steps and transformers a surface can be built for, in the order they are applied.
+CALCULATION_STEP_TYPES = (CartValueFee, DeliveryDistanceFee, NumberOfItemsFee)
+TRANSFORMER_TYPES = (RushHourFeeTransformer, ReduceFeeTransformer, LimitFeeTransformer)
+
+MAGIC = b"DFSURFAC"
+# Changed whenever the way the surfaces are built or laid out changes.
+FORMAT_VERSION = 1
+
+# Magic, format version, configuration version, the range of the surface and
+# the sizes of its cart value, distance and number of items axes.
+_HEADER = struct.Struct("<8sI12sqqqqq")
+# Native int32, the files are a cache of the machine they are built on.
+_FEE_TYPE = "i"
+_FEE_DTYPE = np.dtype(np.int32)
+
+# The representative orders are all made at this time. The rush hour
+# transformer is moved to cover it, or not, for the two halves of the surface.
+_REPRESENTATIVE_TIME = datetime(2024, 1, 1, 12)
+_ALL_DAY = (time(0), time(23, 59, 59, 999999))
+
+
+@dataclass(frozen=True)
+class SurfaceAxes:
+    """The range of a fee surface and how an order is turned into its index."""
+    cart_value_threshold: int  # Smaller cart values have a surcharge.
+    free_delivery_threshold: int  # Larger or equal cart values are reduced.
+    distance_threshold: int  # Longer distances have additional fees...
+    meters_per_additional_fee: int  # ...per started this many meters.
+    number_of_items_threshold: int  # More items than this have surcharges or bulk charges.
+    max_distance: int
+    max_items: int
+
+    @classmethod
+    def of(cls, calculation_steps: list[DeliveryFeeCalculationStep],
+           transformers: list[DeliveryFeeTransformer], max_distance: int,
+           max_items: int) -> Self | None:
+        """The axes of the surface of the steps and transformers or None if a
+        surface can't be built for them."""
+        if (tuple(map(type, calculation_steps)) != CALCULATION_STEP_TYPES or
+                tuple(map(type, transformers)) != TRANSFORMER_TYPES):
+            return None
+        cart_value_fee, distance_fee, items_fee = calculation_steps
+        rush_hour, reduce_fee, _ = transformers
+        if rush_hour.cache_key_source() is None:
+            return None
+        values = (as_int_constant(cart_value_fee.config_options.cart_value_surcharge_threshold),
+                  as_int_constant(reduce_fee.config_options.exclusion_cart_value_threshold),
+                  as_int_constant(distance_fee.config_options.delivery_distance_low_threshold),
+                  as_int_constant(
+                      distance_fee.config_options.additional_fee_applied_per_meters_traveled,
+                      minimum=1),
+                  as_int_constant(
+                      items_fee.config_options.number_of_items_surcharge_threshold),
+                  as_int_constant(items_fee.config_options.bulk_charge_threshold))
+        if None in values or max_distance < 0 or max_items < 0:
+            return None
+        # Item counts up to the lower of the surcharge and bulk charge thresholds
+        # have the same fee, as in the cache key of `NumberOfItemsFee`.
+        *values, surcharge_threshold, bulk_charge_threshold = values
+        axes = cls(*values, min(surcharge_threshold, bulk_charge_threshold),
+                   max_distance, max_items)
+        # Cart values from the surcharge threshold up to the free delivery
+        # threshold are one column of the surface, so there must be no surcharge
+        # on free deliveries.
+        if axes.cart_value_threshold > axes.free_delivery_threshold:
+            return None
+        return axes
+
+    @property
+    def distance_steps(self) -> int:
+        # Number of started additional distance steps up to `max_distance`.
+        return max(-((self.distance_threshold - self.max_distance) //
+                     self.meters_per_additional_fee), 0)
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        """Sizes of the cart value, distance and number of items axes."""
+        return (self.cart_value_threshold + 2, self.distance_steps + 2,
+                max(self.max_items - self.number_of_items_threshold, 0) + 1)
+
+    def representative_orders(self) -> OrderInfoColumns:
+        """One order of every cart value, distance and number of items index,
+        in the order of the surface."""
+        cart_values = [*range(self.cart_value_threshold + 1), self.free_delivery_threshold]
+        distances = [0, self.distance_threshold, *(
+            self.distance_threshold + step * self.meters_per_additional_fee
+            for step in range(1, self.distance_steps + 1))]
+        numbers_of_items = range(self.number_of_items_threshold,
+                                 self.number_of_items_threshold + self.shape[2])
+        grid = np.meshgrid(cart_values, distances, numbers_of_items, indexing="ij")
+        return OrderInfoColumns.from_arrays(
+            *(axis.ravel() for axis in grid),
+            np.full(grid[0].size, np.datetime64(_REPRESENTATIVE_TIME, "us")))
+
+    def in_range_source(self) -> str:
+        max_distance = self.max_distance
+        if self.distance_steps:
+            max_distance = (self.distance_threshold +
+                            self.distance_steps * self.meters_per_additional_fee)
+        return (f"delivery_distance <= {max_distance} and "
+                f"number_of_items <= {self.max_items}")
+
+    def index_source(self, rush_hour_source: str) -> str:
+        _, distance_size, items_size = self.shape
+        cart_value_index = (
+            f"({self.cart_value_threshold + 1} if cart_value >= {self.free_delivery_threshold} "
+            f"else cart_value if cart_value < {self.cart_value_threshold} "
+            f"else {self.cart_value_threshold})")
+        distance_index = (
+            f"(0 if delivery_distance <= 0 else 1 if delivery_distance <= "
+            f"{self.distance_threshold} else 1 - ({self.distance_threshold} - "
+            f"delivery_distance) // {self.meters_per_additional_fee})")
+        items_index = (f"(0 if number_of_items <= {self.number_of_items_threshold} "
+                       f"else number_of_items - {self.number_of_items_threshold})")
+        return (f"(({cart_value_index} * {distance_size} + {distance_index}) * {items_size} "
+                f"+ {items_index}) * 2 + ({rush_hour_source})")
+
+
+class FeeSurface:
+    """A memory-mapped fee surface file written by `write_fee_surface`."""
+
+    def __init__(self, path: str | Path, axes: SurfaceAxes, header: bytes) -> None:
+        self.path = Path(path)
+        self.axes = axes
+        with open(self.path, "rb") as file:
+            surface = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if (surface[:_HEADER.size] != header or
+                len(surface) != _HEADER.size + _surface_size(axes) * _FEE_DTYPE.itemsize):
+            surface.close()
+            raise ValueError(f"{self.path} is not the fee surface of the configuration")
+        # The table keeps the mapping open for as long as it is used.
+        self.table = memoryview(surface)[_HEADER.size:].cast(_FEE_TYPE)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def compile(self, rush_hour: RushHourFeeTransformer,
+                fallback: CompiledPipeline) -> CompiledPipeline:
+        """The lookup of the fees, with `fallback` for the orders out of range."""
+        rush_hour_source = rush_hour.cache_key_source()
+        return compile_table_lookup(
+            self.axes.in_range_source(),
+            self.axes.index_source(rush_hour_source[0] if rush_hour_source else "0"),
+            self.table, fallback)
+
+
+def load_fee_surface(calculation_steps: list[DeliveryFeeCalculationStep],
+                     transformers: list[DeliveryFeeTransformer], directory: str | Path,
+                     max_distance: int = config.FEE_SURFACE_MAX_DISTANCE,
+                     max_items: int = config.FEE_SURFACE_MAX_ITEMS) -> FeeSurface | None:
+    """Maps the fee surface of the steps and transformers from the directory,
+    building it first if it is not there yet. Returns None if a surface can't be
+    built for them or the directory can't be written to."""
+    axes = SurfaceAxes.of(calculation_steps, transformers, max_distance, max_items)
+    if axes is None:
+        return None
+    version = configuration_version(calculation_steps, transformers)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, version.encode(), max_distance, max_items,
+                          *axes.shape)
+    path = Path(directory) / (f"fee_surface-{version}-{max_distance}-{max_items}-"
+                              f"{FORMAT_VERSION}.bin")
+    try:
+        return FeeSurface(path, axes, header)
+    except (OSError, ValueError):
+        pass
+    try:
+        write_fee_surface(path, header, calculate_fee_surface(
+            calculation_steps, transformers, axes))
+        return FeeSurface(path, axes, header)
+    except (OSError, ValueError) as error:
+        logger.warning("Fee surface not used: %s", error)
+        return None
+
+
+def calculate_fee_surface(calculation_steps: list[DeliveryFeeCalculationStep],
+                          transformers: list[DeliveryFeeTransformer],
+                          axes: SurfaceAxes) -> np.ndarray:
+    """The fees of the surface in the order of its index."""
+    order_columns = axes.representative_orders()
+    rush_hour, *other_transformers = transformers
+    halves = []
+    # Without and with the rush hour, with the rush hour moved to the day after
+    # the representative orders or to all of their day.
+    representative_weekday = _REPRESENTATIVE_TIME.weekday()
+    for rush_weekday in (representative_weekday + 1, representative_weekday):
+        moved_rush_hour = RushHourFeeTransformer(rush_hour.config_options.model_copy(update={
+            "rush_day": WEEKDAY_NAMES[rush_weekday % 7], "rush_hour_start": _ALL_DAY[0],
+            "rush_hour_end": _ALL_DAY[1], "timezone": UTC}))
+        pipeline = PricingPipeline.build(calculation_steps,
+                                         [moved_rush_hour, *other_transformers])
+        halves.append(pipeline.calculate_columns(order_columns))
+    fees = np.stack(halves, axis=-1).ravel()
+    if fees.size and fees.max() > np.iinfo(_FEE_DTYPE).max:
+        raise ValueError("the fees are too large for a fee surface")
+    return fees.astype(_FEE_DTYPE)
+
+
+def write_fee_surface(path: Path, header: bytes, fees: np.ndarray) -> None:
+    # Written to a temporary file first, so that workers starting at the same
+    # time never map a partly written surface.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temporary_path, "wb") as file:
+            file.write(header)
+            file.write(fees.tobytes())
+        os.replace(temporary_path, path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+
+
+def _surface_size(axes: SurfaceAxes) -> int:
+    cart_value_size, distance_size, items_size = axes.shape
+    return cart_value_size * distance_size * items_size * 2
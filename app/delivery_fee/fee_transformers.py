@@ -1,31 +1,117 @@
 from abc import ABC, abstractmethod
-from app.delivery_fee.models import OrderInfo, DeliveryFee
-from copy import deepcopy
-from pandas import Timestamp
-from datetime import time
-from pydantic import BaseModel
-from typing import Self
+from app.delivery_fee.models import OrderInfo, OrderInfoLike, DeliveryFee
+from app.delivery_fee.pipeline_compiler import as_int_constant, as_factor_constant
+from app.delivery_fee.time_index import (
+    MICROSECONDS_IN_DAY,
+    MICROSECONDS_IN_WEEK,
+    WEEKDAY_NAMES,
+    FactorIntervalIndex,
+    WeeklyIntervalIndex,
+    calendar_microsecond,
+    calendar_microsecond_many,
+    calendar_microsecond_of_week,
+    calendar_microsecond_of_week_many,
+    microsecond_of_day,
+    microsecond_of_week,
+    microsecond_of_week_many,
+    utc_calendar_microsecond,
+)
+from app.delivery_fee.time_zones import UTC, zone_offsets
+from datetime import datetime, time
+from math import ceil, isfinite
+from pydantic import BaseModel, ConfigDict
+from typing import Literal, Self, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # NumPy is imported only when the vectorized methods are used.
+    import numpy as np
+    from app.delivery_fee.order_columns import OrderInfoColumns
+
+
+# Microsecond of the day of the local `time` in the compiled source.
+_MICROSECOND_OF_DAY_SOURCE = ("(((time.hour * 60 + time.minute) * 60 + time.second) "
+                              "* 1000000 + time.microsecond)")
+# UTC offset of `time` in microseconds, naive times are UTC. Fixed offsets are
+# read without the datetime, which is a lot faster with the timezones pydantic
+# parses, and no datetime is built, for the same reason.
+_UTC_OFFSET_SOURCE = ("(0 if (time_zone := time.tzinfo) is None else "
+                      "(utc_offset.days * 86400 + utc_offset.seconds) * 1000000 + "
+                      "utc_offset.microseconds if "
+                      "(utc_offset := time_zone.utcoffset(None)) is not None or "
+                      "(utc_offset := time.utcoffset()) is not None else 0)")
 
 
 class DeliveryFeeTransformer(ABC):
     """Abstract class for all the fee transformers. 
     This class is used to transform the delivery fee after 
     the delivery fee has been calculated. So any subclass of this class
-    is essentially one of the rules to transform the delivery fee."""
+    is essentially one of the rules to transform the delivery fee.
+
+    Subclasses implement `transform_fee`, which works on plain integers so that
+    the calculator can pass the fee through the transformers without building
+    or copying any models. Overriding `transform` instead is also supported."""
 
     class ConfigOptions(BaseModel):
         """Configuration options for DeliveryFeeTransformer."""
+        model_config = ConfigDict(frozen=True)
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        # Transformers which only override the model based `transform` still work.
+        if (getattr(cls.transform_fee, "__isabstractmethod__", False) and
+                cls.transform is not DeliveryFeeTransformer.transform):
+            cls.transform_fee = _transform_fee_with_model
 
     @abstractmethod
+    def transform_fee(self, delivery_info: OrderInfoLike, delivery_fee: int) -> int:
+        """Transform the delivery fee in cents."""
+
     def transform(self, delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
-        """Transform the delivery fee."""
+        """Transform the delivery fee. The given delivery fee is not changed."""
+        return DeliveryFee(delivery_fee=self.transform_fee(delivery_info,
+                                                           delivery_fee.delivery_fee))
+
+    def transform_many(self, order_columns: "OrderInfoColumns",
+                       delivery_fees: "np.ndarray") -> "np.ndarray":
+        """Transform the delivery fees of many orders at once. Returns a new int64
+        array of fees. Subclasses should override this with a vectorized version,
+        by default `transform` is called per order."""
+        import numpy as np
+
+        return np.fromiter(
+            (self.transform_fee(order_columns.order_record(index), delivery_fee)
+             for index, delivery_fee in enumerate(delivery_fees.tolist())),
+            dtype=np.int64, count=len(order_columns))
+
+    def compiled_source(self) -> list[str] | None:
+        """Returns Python source lines which transform the local `delivery_fee`
+        with the configuration options folded in as constants.
+        See `app.delivery_fee.pipeline_compiler`. By default the transformer
+        can't be compiled and None is returned."""
+        return None
+
+    def cache_key_source(self) -> list[str] | None:
+        """Returns Python expressions of the order variables that this transformer
+        depends on, orders with the same values are transformed the same way. Used
+        as a part of the calculator's cache key. By default the transformer can't
+        be cached and None is returned."""
+        return None
+
+
+def _transform_fee_with_model(self: DeliveryFeeTransformer, delivery_info: OrderInfoLike,
+                              delivery_fee: int) -> int:
+    return self.transform(delivery_info, DeliveryFee(delivery_fee=delivery_fee)).delivery_fee
 
 
 class RushHourFeeTransformer(DeliveryFeeTransformer):
     """Transforms the delivery fee base don the following:
     During the Friday rush, 3 - 7 PM, the delivery fee (the 
     total fee including possible surcharges) will be multiplied 
-    by 1.2x. Friday rush is 3 - 7 PM UTC."""
+    by 1.2x. Friday rush is 3 - 7 PM UTC.
+
+    With the `timezone` option the rush hour is in the local time of that
+    timezone instead, following its daylight saving time. The order times are
+    then converted to it from their UTC offset, naive times are UTC."""
 
     class ConfigOptions(BaseModel):
         """Configuration options for RushHourFeeTransformer.
@@ -37,12 +123,16 @@ class RushHourFeeTransformer(DeliveryFeeTransformer):
         >>> # 7:59:59.999999 PM (inclusive)
         >>> rush_hour_end: time = time(hour=12+7, minute=59, second=59, microsecond=999999)
         >>> rush_hour_fee_factor: float = 1.2  # 20% increase
+        >>> timezone: str = "UTC"  # IANA timezone of the rush hour, e.g. "Europe/Helsinki"
         """
+        model_config = ConfigDict(frozen=True)
+
         rush_day: str = "Friday"
         rush_hour_start: time = time(hour=12+3, minute=0)  # 3:00:00 PM
         # 7:59:59.999999 PM
         rush_hour_end: time = time(hour=12+7, minute=59, second=59, microsecond=999999)
         rush_hour_fee_factor: float = 1.2  # 20% increase
+        timezone: str = UTC
 
     def __init__(self, config_options: ConfigOptions | None = None) -> None:
         super().__init__()
@@ -50,15 +140,117 @@ class RushHourFeeTransformer(DeliveryFeeTransformer):
         if config_options is None:
             self.config_options = self.ConfigOptions()
 
-    def transform(self, delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
-        timestamp = Timestamp(delivery_info.time)
-        transformed_delivery_fee = deepcopy(delivery_fee)
+        # Rush hour as microseconds of the week, so that checking if an order is
+        # made during the rush hour is just a couple of integer comparisons.
+        self._rush_hours = WeeklyIntervalIndex.for_weekday(
+            self.config_options.rush_day,
+            self.config_options.rush_hour_start,
+            self.config_options.rush_hour_end)
+        # UTC offsets of the local timezone, read once per process and zone, so
+        # that the local time of an order is a bisect and an addition.
+        self._zone_offsets = (None if self.config_options.timezone == UTC
+                              else zone_offsets(self.config_options.timezone))
+
+    def transform_fee(self, delivery_info: OrderInfoLike, delivery_fee: int) -> int:
+        if self._zone_offsets is None:
+            rush_microsecond = microsecond_of_week(delivery_info.time)
+        else:
+            rush_microsecond = calendar_microsecond_of_week(
+                self._zone_offsets.local_calendar_microsecond(
+                    utc_calendar_microsecond(delivery_info.time)))
+        if rush_microsecond in self._rush_hours:
+            delivery_fee = max(ceil(delivery_fee * self.config_options.rush_hour_fee_factor), 0)
+
+        return delivery_fee
+
+    def transform_many(self, order_columns: "OrderInfoColumns",
+                       delivery_fees: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        if self._zone_offsets is None:
+            rush_microseconds = microsecond_of_week_many(order_columns.time)
+        else:
+            utc_calendar_microseconds = calendar_microsecond_many(order_columns.time)
+            if order_columns.utc_offset is not None:
+                utc_calendar_microseconds = utc_calendar_microseconds - order_columns.utc_offset
+            rush_microseconds = calendar_microsecond_of_week_many(
+                self._zone_offsets.local_calendar_microsecond_many(utc_calendar_microseconds))
+        is_rush_hour = self._rush_hours.contains_many(rush_microseconds)
+
+        # Same float multiplication and ceil as `DeliveryFee.__mul__`.
+        rush_hour_fees = np.maximum(
+            np.ceil(delivery_fees * self.config_options.rush_hour_fee_factor), 0)
+        return np.where(is_rush_hour, rush_hour_fees, delivery_fees).astype(np.int64)
 
-        if (timestamp.day_name() == self.config_options.rush_day and
-                (self.config_options.rush_hour_start <= timestamp.time() <= self.config_options.rush_hour_end)):
-            transformed_delivery_fee *= self.config_options.rush_hour_fee_factor
+    def compiled_source(self) -> list[str] | None:
+        rush_hour_fee_factor = as_factor_constant(self.config_options.rush_hour_fee_factor)
+        if rush_hour_fee_factor is None:
+            return None
+        if not self._rush_hours:
+            # It can never be rush hour.
+            return []
+        if self._zone_offsets is not None:
+            # Same as below, the UTC and local time are only calculated on the
+            # weekdays which can be the local rush day.
+            return [
+                f"if time.weekday() in {self._rush_weekdays()!r}:",
+                f"    if {self._local_rush_hour_source()}:",
+                f"        delivery_fee = ceil(delivery_fee * {rush_hour_fee_factor})",
+            ]
 
-        return transformed_delivery_fee
+        # The rush hour is always within a single day, so the cheap weekday check
+        # is done first and the time of the day is only calculated on rush days.
+        rush_weekday, rush_hour_start, rush_hour_end = self._rush_hour_of_day()
+        return [
+            f"if time.weekday() == {rush_weekday}:",
+            f"    microsecond_of_day = {_MICROSECOND_OF_DAY_SOURCE}",
+            f"    if {rush_hour_start} <= microsecond_of_day <= {rush_hour_end}:",
+            f"        delivery_fee = ceil(delivery_fee * {rush_hour_fee_factor})",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        if not self._rush_hours:
+            return []
+        if self._zone_offsets is not None:
+            return [f"time.weekday() in {self._rush_weekdays()!r} and "
+                    f"{self._local_rush_hour_source()}"]
+
+        rush_weekday, rush_hour_start, rush_hour_end = self._rush_hour_of_day()
+        return [f"time.weekday() == {rush_weekday} and "
+                f"{rush_hour_start} <= {_MICROSECOND_OF_DAY_SOURCE} <= {rush_hour_end}"]
+
+    def _rush_hour_of_day(self) -> tuple[int, int, int]:
+        """Returns the weekday and the start and end microsecond of the day of
+        the rush hour."""
+        [(rush_hour_start, rush_hour_end)] = self._rush_hours.intervals
+        rush_weekday, rush_hour_start = divmod(rush_hour_start, MICROSECONDS_IN_DAY)
+        return rush_weekday, rush_hour_start, rush_hour_end - rush_weekday * MICROSECONDS_IN_DAY
+
+    def _rush_weekdays(self) -> tuple[int, ...]:
+        """The weekdays of the order times which can be in the local rush hour
+        with any of the offsets of the timezone. The UTC offset of an order time
+        is less than a day, so its own weekday is at most one off from UTC."""
+        [(rush_hour_start, rush_hour_end)] = self._rush_hours.intervals
+        first_day = (rush_hour_start - max(self._zone_offsets.offsets)) // MICROSECONDS_IN_DAY
+        last_day = (rush_hour_end - min(self._zone_offsets.offsets)) // MICROSECONDS_IN_DAY
+        return tuple(sorted({day % 7 for day in range(first_day - 1, last_day + 2)}))
+
+    def _local_rush_hour_source(self) -> str:
+        """Expression checking if the local time of `time` is in the rush hour,
+        with the offsets of the timezone as constants."""
+        [(rush_hour_start, rush_hour_end)] = self._rush_hours.intervals
+        utc_microsecond = (f"time.toordinal() * {MICROSECONDS_IN_DAY} + "
+                           f"{_MICROSECOND_OF_DAY_SOURCE} - {_UTC_OFFSET_SOURCE}")
+        if self._zone_offsets.is_fixed:
+            local_microsecond = f"{utc_microsecond} + {self._zone_offsets.offsets[0]}"
+        else:
+            # The walrus keeps the UTC microsecond for the bisect, the left
+            # operand of the addition is evaluated first.
+            local_microsecond = (
+                f"(utc_microsecond := {utc_microsecond}) + {self._zone_offsets.offsets!r}"
+                f"[bisect_right({self._zone_offsets.transitions!r}, utc_microsecond)]")
+        return (f"{rush_hour_start} <= ({local_microsecond} - {MICROSECONDS_IN_DAY}) "
+                f"% {MICROSECONDS_IN_WEEK} <= {rush_hour_end}")
 
 
 class LimitFeeTransformer(DeliveryFeeTransformer):
@@ -71,6 +263,8 @@ class LimitFeeTransformer(DeliveryFeeTransformer):
         Default options are:
         >>> highest_limit_of_delivery_fee = 15e2  # 15€ (inclusive)
         """
+        model_config = ConfigDict(frozen=True)
+
         highest_limit_of_delivery_fee: int = 15e2
 
     def __init__(self, config_options: ConfigOptions | None = None) -> None:
@@ -79,14 +273,33 @@ class LimitFeeTransformer(DeliveryFeeTransformer):
         if config_options is None:
             self.config_options = self.ConfigOptions()
 
-    def transform(self, delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
-        transformed_delivery_fee = deepcopy(delivery_fee)
+    def transform_fee(self, delivery_info: OrderInfoLike, delivery_fee: int) -> int:
+        if delivery_fee >= self.config_options.highest_limit_of_delivery_fee:
+            delivery_fee = self.config_options.highest_limit_of_delivery_fee
+
+        return delivery_fee
+
+    def transform_many(self, order_columns: "OrderInfoColumns",
+                       delivery_fees: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        highest_limit = self.config_options.highest_limit_of_delivery_fee
+        return np.where(delivery_fees >= highest_limit,
+                        highest_limit, delivery_fees).astype(np.int64)
 
-        if transformed_delivery_fee >= self.config_options.highest_limit_of_delivery_fee:
-            transformed_delivery_fee = DeliveryFee(
-                delivery_fee=self.config_options.highest_limit_of_delivery_fee)
+    def compiled_source(self) -> list[str] | None:
+        highest_limit = as_int_constant(self.config_options.highest_limit_of_delivery_fee)
+        if highest_limit is None:
+            return None
 
-        return transformed_delivery_fee
+        return [
+            f"if delivery_fee >= {highest_limit}:",
+            f"    delivery_fee = {highest_limit}",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        # Depends only on the delivery fee, not on the order.
+        return []
 
 
 class ReduceFeeTransformer(DeliveryFeeTransformer):
@@ -100,6 +313,8 @@ class ReduceFeeTransformer(DeliveryFeeTransformer):
         >>> exclusion_cart_value_threshold = 200e2  # 200€ (inclusive)
         >>> exclusion_delivery_fee_factor = 1  # 100% decrease
         """
+        model_config = ConfigDict(frozen=True)
+
         exclusion_cart_value_threshold: int = 200e2
         exclusion_delivery_fee_factor: float = 1
 
@@ -109,14 +324,232 @@ class ReduceFeeTransformer(DeliveryFeeTransformer):
         if config_options is None:
             self.config_options = self.ConfigOptions()
 
-    def transform(self, delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
-        transformed_delivery_fee = deepcopy(delivery_fee)
-
+    def transform_fee(self, delivery_info: OrderInfoLike, delivery_fee: int) -> int:
         if delivery_info.cart_value >= self.config_options.exclusion_cart_value_threshold:
-            transformed_delivery_fee -= (transformed_delivery_fee *
-                                         self.config_options.exclusion_delivery_fee_factor)
+            excluded_fee = max(
+                ceil(delivery_fee * self.config_options.exclusion_delivery_fee_factor), 0)
+            delivery_fee = max(delivery_fee - excluded_fee, 0)
+
+        return delivery_fee
+
+    def transform_many(self, order_columns: "OrderInfoColumns",
+                       delivery_fees: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        # Same float multiplication and ceil as `DeliveryFee.__mul__`.
+        excluded_fees = np.maximum(
+            np.ceil(delivery_fees * self.config_options.exclusion_delivery_fee_factor), 0)
+        reduced_fees = np.maximum(delivery_fees - excluded_fees, 0)
+
+        is_excluded = (order_columns.cart_value >=
+                       self.config_options.exclusion_cart_value_threshold)
+        return np.where(is_excluded, reduced_fees, delivery_fees).astype(np.int64)
+
+    def compiled_source(self) -> list[str] | None:
+        threshold = as_int_constant(self.config_options.exclusion_cart_value_threshold)
+        exclusion_factor = as_factor_constant(
+            self.config_options.exclusion_delivery_fee_factor)
+        if threshold is None or exclusion_factor is None:
+            return None
+
+        return [
+            f"if cart_value >= {threshold}:",
+            f"    delivery_fee = max(delivery_fee - ceil(delivery_fee * {exclusion_factor}), 0)",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        threshold = as_int_constant(self.config_options.exclusion_cart_value_threshold)
+        if threshold is None:
+            return None
+
+        return [f"cart_value >= {threshold}"]
+
+
+# Decimals of the product of overlapping factors, so that 1.1 * 1.5 is 1.65 and
+# not 1.6500000000000001, which would round the fees up by a cent.
+_FACTOR_PRODUCT_DECIMALS = 9
+
+
+def _multiply_factors(first: float, second: float) -> float:
+    return round(first * second, _FACTOR_PRODUCT_DECIMALS)
+
+
+class WeeklySurchargeWindow(BaseModel):
+    """Window of `CalendarSurchargeTransformer` on the given weekday every
+    week, from start to end (both inclusive). A window which ends before it
+    starts goes past midnight into the next day, like 22:00 - 02:00."""
+    model_config = ConfigDict(frozen=True)
+
+    day: str
+    start: time
+    end: time
+    factor: float
+
+
+class DatedSurchargeWindow(BaseModel):
+    """One-off window of `CalendarSurchargeTransformer`, like a holiday or an
+    event, from start to end (both inclusive). The end must not be before the
+    start."""
+    model_config = ConfigDict(frozen=True)
+
+    start: datetime
+    end: datetime
+    factor: float
+
+
+def _weekly_window_intervals(window: WeeklySurchargeWindow) -> list[tuple[int, int, float]]:
+    # Microseconds of the week of the window. One going past the end of the week
+    # is split in two at the end of the week.
+    start_of_day = WEEKDAY_NAMES.index(window.day) * MICROSECONDS_IN_DAY
+    start = start_of_day + microsecond_of_day(window.start)
+    end = start_of_day + microsecond_of_day(window.end)
+    if end < start:
+        end += MICROSECONDS_IN_DAY
+    if end < MICROSECONDS_IN_WEEK:
+        return [(start, end, window.factor)]
+    return [(start, MICROSECONDS_IN_WEEK - 1, window.factor),
+            (0, end - MICROSECONDS_IN_WEEK, window.factor)]
+
+
+class CalendarSurchargeTransformer(DeliveryFeeTransformer):
+    """Transforms the delivery fee based on a calendar of surcharge windows:
+    During a window the delivery fee (the total fee including possible
+    surcharges) is multiplied by the factor of the window. There can be any
+    number of weekly windows (e.g. weekend evenings) and dated windows (e.g.
+    holidays), compared to the wall clock time of the order like the rush hour.
+
+    When windows overlap, their factors are combined by the `overlap` option:
+    "max" uses the largest factor and "multiply" the product of the factors,
+    rounded to 9 decimals.
+    The combined factors are precomputed into sorted segments of the week and
+    of the calendar when the transformer is created, so an order is priced with
+    one bisect in each, however many windows there are."""
+
+    class ConfigOptions(BaseModel):
+        """Configuration options for CalendarSurchargeTransformer.
+
+        By default there are no windows.
+        >>> from datetime import datetime, time
+        >>> weekly_windows = (WeeklySurchargeWindow(
+        ...     day="Saturday", start=time(18), end=time(21), factor=1.1),)
+        >>> dated_windows = (DatedSurchargeWindow(
+        ...     start=datetime(2024, 12, 24), end=datetime(2024, 12, 26, 23, 59, 59),
+        ...     factor=1.5),)
+        >>> overlap = "max"  # or "multiply"
+        """
+        model_config = ConfigDict(frozen=True)
+
+        weekly_windows: tuple[WeeklySurchargeWindow, ...] = ()
+        dated_windows: tuple[DatedSurchargeWindow, ...] = ()
+        overlap: Literal["max", "multiply"] = "max"
+
+    def __init__(self, config_options: ConfigOptions | None = None) -> None:
+        super().__init__()
+        self.config_options = config_options
+        if config_options is None:
+            self.config_options = self.ConfigOptions()
+
+        windows = [*self.config_options.weekly_windows, *self.config_options.dated_windows]
+        for window in windows:
+            if not (isfinite(window.factor) and window.factor >= 0):
+                raise ValueError(f"the factor of a window must be non-negative, "
+                                 f"got {window.factor}")
+        for window in self.config_options.weekly_windows:
+            if window.day not in WEEKDAY_NAMES:
+                raise ValueError(f"{window.day!r} is not a weekday name")
+        for window in self.config_options.dated_windows:
+            if calendar_microsecond(window.end) < calendar_microsecond(window.start):
+                raise ValueError(f"the end of a window must not be before its start, "
+                                 f"got {window.start} - {window.end}")
+
+        # The factors are non-negative, so -1 is below all of them for max. For
+        # multiply, 1 is the factor that changes nothing.
+        if self.config_options.overlap == "max":
+            self._combine, identity = max, -1.0
+        else:
+            self._combine, identity = _multiply_factors, 1.0
+        self._weekly_factors = FactorIntervalIndex(
+            (interval for window in self.config_options.weekly_windows
+             for interval in _weekly_window_intervals(window)),
+            self._combine, identity)
+        # Timezone aware windows are compared by their wall clock time, like the orders.
+        self._dated_factors = FactorIntervalIndex(
+            ((calendar_microsecond(window.start), calendar_microsecond(window.end),
+              window.factor)
+             for window in self.config_options.dated_windows),
+            self._combine, identity)
+        self._identity = identity
+
+    def factor_at(self, timestamp: datetime) -> float | None:
+        """Returns the combined factor of the windows at the wall clock time of
+        the timestamp, or None outside of all the windows."""
+        factor = self._combine(self._weekly_factors.factor_at(microsecond_of_week(timestamp)),
+                               self._dated_factors.factor_at(calendar_microsecond(timestamp)))
+        return None if factor == self._identity else factor
+
+    def transform_fee(self, delivery_info: OrderInfoLike, delivery_fee: int) -> int:
+        factor = self.factor_at(delivery_info.time)
+        if factor is not None:
+            delivery_fee = max(ceil(delivery_fee * factor), 0)
+
+        return delivery_fee
+
+    def transform_many(self, order_columns: "OrderInfoColumns",
+                       delivery_fees: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        weekly_factors = self._weekly_factors.factors_many(
+            microsecond_of_week_many(order_columns.time))
+        dated_factors = self._dated_factors.factors_many(
+            calendar_microsecond_many(order_columns.time))
+        # There are only a few different pairs of factors, which are combined
+        # like in `factor_at` to get exactly the same factors.
+        factor_pairs, pair_positions = np.unique(
+            np.stack([weekly_factors, dated_factors], axis=1), axis=0, return_inverse=True)
+        factors = np.array([self._combine(weekly_factor, dated_factor)
+                            for weekly_factor, dated_factor in factor_pairs.tolist()],
+                           dtype=np.float64)[pair_positions.reshape(-1)]
+
+        # Same float multiplication and ceil as `transform_fee`.
+        surcharged_fees = np.maximum(np.ceil(delivery_fees * factors), 0)
+        return np.where(factors != self._identity,
+                        surcharged_fees, delivery_fees).astype(np.int64)
+
+    def compiled_source(self) -> list[str] | None:
+        if not self._weekly_factors and not self._dated_factors:
+            # It can never be in a window.
+            return []
+
+        return [
+            f"microsecond_of_day = {_MICROSECOND_OF_DAY_SOURCE}",
+            f"calendar_factor = {self._factor_source('microsecond_of_day')}",
+            f"if calendar_factor != {self._identity!r}:",
+            "    delivery_fee = ceil(delivery_fee * calendar_factor)",
+        ]
+
+    def cache_key_source(self) -> list[str] | None:
+        if not self._weekly_factors and not self._dated_factors:
+            return []
+
+        return [self._factor_source(_MICROSECOND_OF_DAY_SOURCE)]
 
-        return transformed_delivery_fee
+    def _factor_source(self, microsecond_of_day: str) -> str:
+        # Only the kinds of windows that there are, looked up from constant tuples.
+        factor_sources = []
+        if self._weekly_factors:
+            factor_sources.append(
+                f"{self._weekly_factors.factors!r}[bisect_right({self._weekly_factors.starts!r}, "
+                f"time.weekday() * {MICROSECONDS_IN_DAY} + {microsecond_of_day})]")
+        if self._dated_factors:
+            factor_sources.append(
+                f"{self._dated_factors.factors!r}[bisect_right({self._dated_factors.starts!r}, "
+                f"time.toordinal() * {MICROSECONDS_IN_DAY} + {microsecond_of_day})]")
+        if len(factor_sources) == 1:
+            return factor_sources[0]
+        if self.config_options.overlap == "max":
+            return f"max({factor_sources[0]}, {factor_sources[1]})"
+        return (f"round({factor_sources[0]} * {factor_sources[1]}, "
+                f"{_FACTOR_PRODUCT_DECIMALS})")
 
 
 """
@@ -0,0 +1,48 @@
+"""
+Delivery fee calculation of several markets (countries, cities) in the same
+process. Every market has its own steps, transformers and configuration
+options, compiled once into an immutable `PricingPipeline` when the registry is
+built. The routes of a market are bound to its pipeline when they are created,
+so a request is dispatched to its market by the routing alone, without building
+anything or taking a lock per request.
+"""
+from types import MappingProxyType
+from typing import Iterator, Mapping
+from app.delivery_fee.fee_calculation_steps import DeliveryFeeCalculationStep
+from app.delivery_fee.fee_calculator import PricingPipeline
+from app.delivery_fee.fee_transformers import DeliveryFeeTransformer
+from app import config
+import app.delivery_fee.settings as settings
+
+
+MarketComponents = tuple[list[DeliveryFeeCalculationStep], list[DeliveryFeeTransformer]]
+
+
+class MarketRegistry(Mapping[str, PricingPipeline]):
+    """Immutable mapping of market names to their pipelines."""
+
+    def __init__(self, pipelines: Mapping[str, PricingPipeline]) -> None:
+        self._pipelines = MappingProxyType(dict(pipelines))
+
+    @classmethod
+    def build(cls, markets: Mapping[str, MarketComponents],
+              cache_size: int | None = None) -> "MarketRegistry":
+        """Compiles the (calculation steps, transformers) of every market. The
+        version of a market's pipeline is the hash of its configuration, so
+        markets with the same rules have the same version."""
+        return cls({market: PricingPipeline.build(calculation_steps, transformers,
+                                                  cache_size=cache_size)
+                    for market, (calculation_steps, transformers) in markets.items()})
+
+    def __getitem__(self, market: str) -> PricingPipeline:
+        return self._pipelines[market]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._pipelines)
+
+    def __len__(self) -> int:
+        return len(self._pipelines)
+
+
+# The markets of `settings.MARKETS`.
+MARKET_REGISTRY = MarketRegistry.build(settings.MARKETS, cache_size=config.CACHE_SIZE)
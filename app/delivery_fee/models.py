@@ -1,63 +1,122 @@
-from typing import Self
-from pydantic import BaseModel, field_validator, Field
+from typing import Annotated, Any, NamedTuple, Self
+from pydantic import BaseModel, Field, GetCoreSchemaHandler, GetJsonSchemaHandler
+from pydantic.json_schema import JsonSchemaValue
+from pydantic_core import CoreSchema, core_schema
 from datetime import datetime
 from math import ceil
 
 
+class NonNegative:
+    """Annotation which checks in pydantic-core that an integer is not negative.
+    The error is the same value error, with the same message, that a Python
+    validator raising `ValueError(message)` gives, except that `ctx.error` is
+    the message instead of the exception (an empty object in JSON), as the
+    context of a core error can only hold plain values.
+
+    The integer is parsed in lax mode on purpose, so that "5" and 5.0 are still
+    accepted as before and clients sending them keep working."""
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __get_pydantic_core_schema__(self, source_type: Any,
+                                     handler: GetCoreSchemaHandler) -> CoreSchema:
+        return core_schema.chain_schema([
+            handler(source_type),
+            core_schema.custom_error_schema(
+                core_schema.int_schema(ge=0), custom_error_type="value_error",
+                custom_error_context={"error": self.message}),
+        ])
+
+    def __get_pydantic_json_schema__(self, schema: CoreSchema,
+                                     handler: GetJsonSchemaHandler) -> JsonSchemaValue:
+        # Same schema as before, the check is not part of the OpenAPI docs.
+        return handler(core_schema.int_schema())
+
+
+class IsoFormatDatetime:
+    """Annotation which parses a datetime from an ISO format string, accepting the
+    same strings as `datetime.fromisoformat`. RFC 3339 timestamps, which is what
+    clients send, are parsed natively by pydantic-core. Only other ISO formats
+    fall back to `datetime.fromisoformat`. Anything else is a value error with
+    the given message."""
+
+    # Seconds, hours and offsets are limited to the ranges that both parsers
+    # accept, so that both give the same datetime for every matching string.
+    RFC_3339_PATTERN = (r"^[0-9]{4}-[0-9]{2}-[0-9]{2}T([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]"
+                        r"(\.[0-9]{1,6})?(Z|[+-]([01][0-9]|2[0-3]):[0-5][0-9])?$")
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __get_pydantic_core_schema__(self, source_type: Any,
+                                     handler: GetCoreSchemaHandler) -> CoreSchema:
+        return core_schema.custom_error_schema(
+            core_schema.union_schema([
+                core_schema.chain_schema([
+                    core_schema.str_schema(strict=True, pattern=self.RFC_3339_PATTERN),
+                    core_schema.datetime_schema(),
+                ]),
+                core_schema.chain_schema([
+                    core_schema.str_schema(strict=True),
+                    core_schema.no_info_plain_validator_function(datetime.fromisoformat),
+                ]),
+            ], mode="left_to_right"),
+            custom_error_type="value_error",
+            custom_error_context={"error": self.message})
+
+    def __get_pydantic_json_schema__(self, schema: CoreSchema,
+                                     handler: GetJsonSchemaHandler) -> JsonSchemaValue:
+        return handler(core_schema.datetime_schema())
+
+
 class OrderInfo(BaseModel):
+    # All the validation runs in pydantic-core (see `NonNegative`, `IsoFormatDatetime`).
+
     # in cents (e.g. €1.00 = 100 = 1e2)
-    cart_value: int = Field(description=("Value of the shopping cart in cents. "
-                                         "Example: 790 (790 cents = 7.90€)"))
+    cart_value: Annotated[int, NonNegative('cart_value must be non-negative')] = Field(
+        description=("Value of the shopping cart in cents. "
+                     "Example: 790 (790 cents = 7.90€)"))
     # in meters (e.g. 1km = 1000 = 1e3)
-    delivery_distance: int = Field(description=("The distance between the store and customer’s "
-                                                "location in meters. Example: 2235 (2235 meters "
-                                                "= 2.235 km)"))
-
-    number_of_items: int = Field(description=("The number of items in the customer's shopping cart. "
-                                              "Example: 4 (customer has 4 items in the cart)"))
+    delivery_distance: Annotated[int, NonNegative('delivery_distance must be non-negative')] = Field(
+        description=("The distance between the store and customer’s "
+                     "location in meters. Example: 2235 (2235 meters "
+                     "= 2.235 km)"))
+
+    number_of_items: Annotated[int, NonNegative('number_of_items must be non-negative')] = Field(
+        description=("The number of items in the customer's shopping cart. "
+                     "Example: 4 (customer has 4 items in the cart)"))
     # timestamp in UTC ISO format (e.g. 2024-01-15T13:00:00Z)
-    time: datetime = Field(description=("Order time in UTC in ISO format. "
-                                        "Example: 2024-01-15T13:00:00Z"))
-
-    @field_validator('cart_value')
-    def cart_value__must_be_non_negative(cls, value):
-        if value < 0:
-            raise ValueError('cart_value must be non-negative')
-        return value
-
-    @field_validator('delivery_distance')
-    def delivery_distance__must_be_non_negative(cls, value):
-        if value < 0:
-            raise ValueError('delivery_distance must be non-negative')
-        return value
-
-    @field_validator('number_of_items', mode='after')
-    def number_of_items__must_be_non_negative(cls, value):
-        if value < 0:
-            raise ValueError('number_of_items must be non-negative')
-        return value
-
-    @field_validator('time', mode='before')
-    def delivery_time__parser(cls, value):
-        try:
-            if isinstance(value, str):
-                return datetime.fromisoformat(value)
-            raise ValueError()
-        except ValueError:
-            raise ValueError(
-                'time must be in UTC ISO format (e.g. 2024-01-15T13:00:00Z)')
+    time: Annotated[datetime, IsoFormatDatetime(
+        'time must be in UTC ISO format (e.g. 2024-01-15T13:00:00Z)')] = Field(
+        description=("Order time in UTC in ISO format. "
+                     "Example: 2024-01-15T13:00:00Z"))
+
+
+class OrderRecord(NamedTuple):
+    """Lightweight internal version of `OrderInfo` for calling the calculator
+    directly, for example in batch jobs. Unlike `OrderInfo` it is not validated,
+    so the values must already be valid: non-negative integers and a datetime."""
+    cart_value: int
+    delivery_distance: int
+    number_of_items: int
+    time: datetime
+
+    @classmethod
+    def from_order_info(cls, order_info: OrderInfo) -> Self:
+        return cls(order_info.cart_value, order_info.delivery_distance,
+                   order_info.number_of_items, order_info.time)
+
+
+# Anything with the fields of `OrderInfo`, the calculator only reads the fields.
+OrderInfoLike = OrderInfo | OrderRecord
 
 
 class DeliveryFee(BaseModel):
     # in cents (e.g. €1.00 = 100 = 1e2)
-    delivery_fee: int = Field(description=("Calculated delivery fee in cents. "
-                                           "Example: 710 (710 cents = 7.10€)"))
-
-    @field_validator('delivery_fee')
-    def delivery_fee__must_be_non_negative(cls, value):
-        if value < 0:
-            raise ValueError('delivery_fee must be non-negative')
-        return value
+    delivery_fee: Annotated[int, NonNegative('delivery_fee must be non-negative')] = Field(
+        description=("Calculated delivery fee in cents. "
+                     "Example: 710 (710 cents = 7.10€)"))
 
     def __sub__(self, other: Self | int | float) -> Self:
         if isinstance(other, (int, float)):
@@ -129,3 +188,14 @@ class DeliveryFee(BaseModel):
         else:
             raise TypeError(
                 f"Unsupported operand type(s) for ==: '{type(self)}' and '{type(other)}'")
+
+
+class DeliveryFeeBatchItem(BaseModel):
+    # Exactly one of the fields is set for each order in the batch.
+    delivery_fee: int | None = Field(default=None,
+                                     description=("Calculated delivery fee in cents or null "
+                                                  "if the order info was invalid. "
+                                                  "Example: 710 (710 cents = 7.10€)"))
+    errors: list[dict[str, Any]] | None = Field(default=None,
+                                                description=("Validation errors of the order "
+                                                             "info or null if it was valid."))
@@ -0,0 +1,114 @@
+"""
+Quoting of newline delimited JSON (NDJSON) order streams. Every line of the
+request body is one order info, and every non-blank line gets one result line
+in the same order, in the same format as the items of the batch endpoint.
+
+The body is never held in memory as a whole. Lines are split from the body
+chunks as they are received and quoted a chunk of lines at a time, so the
+memory use depends only on `MAX_LINE_BYTES` and `MAX_CHUNK_LINES`.
+"""
+import json
+from typing import Any, AsyncIterable, AsyncIterator
+import orjson
+from pydantic import TypeAdapter, ValidationError
+from app.delivery_fee.models import OrderInfo
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, PricingPipeline
+from app.delivery_fee.request_parsing import json_invalid_error, jsonable_validation_errors
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Longer lines are not buffered, they get a `too_long` error record instead.
+MAX_LINE_BYTES = 64 * 1024
+# Most lines quoted in one call to the calculator.
+MAX_CHUNK_LINES = 1000
+
+ORDER_INFO_ADAPTER = TypeAdapter(OrderInfo)
+
+
+async def split_lines(chunks: AsyncIterable[bytes],
+                      max_line_bytes: int) -> AsyncIterator[list[bytes | None]]:
+    """Splits the byte chunks into lines and yields the lines completed by each
+    chunk. The last line does not need a trailing newline. A line longer than
+    `max_line_bytes` is yielded as None as soon as it is too long, and the rest
+    of it is skipped."""
+    line_start = bytearray()
+    skipping_line = False
+
+    async for chunk in chunks:
+        lines: list[bytes | None] = []
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            if skipping_line:
+                skipping_line = False
+            elif len(line_start) + end - start > max_line_bytes:
+                lines.append(None)
+            else:
+                lines.append(bytes(line_start + chunk[start:end]) if line_start
+                             else chunk[start:end])
+            line_start.clear()
+            start = end + 1
+
+        if not skipping_line:
+            line_start += chunk[start:]
+            if len(line_start) > max_line_bytes:
+                lines.append(None)
+                line_start.clear()
+                skipping_line = True
+        if lines:
+            yield lines
+
+    if line_start and not skipping_line:
+        yield [bytes(line_start)]
+
+
+def quote_lines(lines: list[bytes | None], pipeline: PricingPipeline | None = None) -> bytes:
+    """Quotes the order infos of the lines and returns one NDJSON result line
+    for each non-blank line. None is a line that was too long. The fees are
+    calculated with `pipeline`, by default the current pipeline of the calculator."""
+    if pipeline is None:
+        pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+    results: list[dict[str, Any] | None] = []
+    valid_order_infos: list[OrderInfo] = []
+    valid_positions: list[int] = []
+
+    for line in lines:
+        if line is None:
+            results.append({"delivery_fee": None, "errors": [
+                {"type": "too_long", "loc": [], "msg": f"Line should have at most "
+                 f"{MAX_LINE_BYTES} bytes", "input": {}, "ctx": {"max_length": MAX_LINE_BYTES}},
+            ]})
+            continue
+        if not line.strip():
+            continue
+        order_info, errors = _validate_line(line)
+        if order_info is None:
+            results.append({"delivery_fee": None, "errors": errors})
+        else:
+            valid_order_infos.append(order_info)
+            valid_positions.append(len(results))
+            results.append(None)
+
+    calculate_fee = pipeline.calculate_fee
+    for position, order_info in zip(valid_positions, valid_order_infos):
+        results[position] = {"delivery_fee": calculate_fee(order_info), "errors": None}
+
+    return b"".join(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE) for result in results)
+
+
+def _validate_line(line: bytes) -> tuple[OrderInfo | None, list[dict[str, Any]] | None]:
+    try:
+        return ORDER_INFO_ADAPTER.validate_json(line), None
+    except ValidationError:
+        pass
+
+    # Same errors as the batch endpoint gives for the same order.
+    try:
+        order = json.loads(line.decode())
+    except UnicodeDecodeError as error:
+        return None, [json_invalid_error(json.JSONDecodeError("Invalid UTF-8", "", error.start))]
+    except json.JSONDecodeError as error:
+        return None, [json_invalid_error(error)]
+    try:
+        return OrderInfo.model_validate(order), None
+    except ValidationError as error:
+        return None, jsonable_validation_errors(error)
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Self
+import numpy as np
+from app.delivery_fee.models import OrderInfo, OrderRecord
+
+
+@dataclass(frozen=True)
+class OrderInfoColumns:
+    """Columnar representation of many order infos. This is used to calculate
+    the delivery fees of many orders at once with NumPy instead of one
+    `OrderInfo` at a time.
+
+    All the columns have the same length. `time` holds the wall clock time
+    of the orders as given (the same way `OrderInfo.time` is interpreted by the
+    transformers), so timezone aware times are not converted to UTC. Their UTC
+    offsets are kept in `utc_offset` for the transformers which need the UTC
+    time, it is None if all the times are naive or in UTC."""
+    cart_value: np.ndarray  # int64, in cents
+    delivery_distance: np.ndarray  # int64, in meters
+    number_of_items: np.ndarray  # int64
+    time: np.ndarray  # datetime64[us]
+    utc_offset: np.ndarray | None = None  # int64, in microseconds
+
+    @classmethod
+    def from_arrays(cls, cart_value: Iterable, delivery_distance: Iterable,
+                    number_of_items: Iterable, time: Iterable,
+                    utc_offset: Iterable | None = None) -> Self:
+        """Create the columns from array likes. The same constraints as in
+        `OrderInfo` apply, otherwise `ValueError` is raised. The UTC offsets of
+        timezone aware strings and datetimes are read from them, `utc_offset`
+        (in microseconds) gives the offsets of wall clock datetime64 times."""
+        wall_clock_times, parsed_utc_offset = _to_datetime64(time)
+        if utc_offset is not None:
+            parsed_utc_offset = _to_utc_offset(np.asarray(utc_offset, dtype=np.int64))
+        order_columns = cls(
+            cart_value=_to_non_negative_int64("cart_value", cart_value),
+            delivery_distance=_to_non_negative_int64("delivery_distance", delivery_distance),
+            number_of_items=_to_non_negative_int64("number_of_items", number_of_items),
+            time=wall_clock_times,
+            utc_offset=parsed_utc_offset,
+        )
+
+        lengths = {len(order_columns.cart_value), len(order_columns.delivery_distance),
+                   len(order_columns.number_of_items), len(order_columns.time)}
+        if order_columns.utc_offset is not None:
+            lengths.add(len(order_columns.utc_offset))
+        if len(lengths) != 1:
+            raise ValueError('all the columns must have the same length')
+        return order_columns
+
+    def __len__(self) -> int:
+        return len(self.cart_value)
+
+    def order_info(self, index: int) -> OrderInfo:
+        """Returns the order info at the given index without validating it again."""
+        return OrderInfo.model_construct(
+            cart_value=int(self.cart_value[index]),
+            delivery_distance=int(self.delivery_distance[index]),
+            number_of_items=int(self.number_of_items[index]),
+            time=self._time(index),
+        )
+
+    def order_record(self, index: int) -> OrderRecord:
+        """Same as `order_info` but returns a lightweight `OrderRecord`."""
+        return OrderRecord(int(self.cart_value[index]), int(self.delivery_distance[index]),
+                           int(self.number_of_items[index]), self._time(index))
+
+    def _time(self, index: int) -> datetime:
+        order_time = self.time[index].item()
+        if self.utc_offset is None:
+            return order_time
+        return order_time.replace(tzinfo=timezone(
+            timedelta(microseconds=int(self.utc_offset[index]))))
+
+
+def _to_non_negative_int64(name: str, values: Iterable) -> np.ndarray:
+    array = np.asarray(values)
+    if array.ndim != 1:
+        raise ValueError(f'{name} must be one dimensional')
+    if array.dtype.kind == 'f' and not np.all(np.mod(array, 1) == 0):
+        raise ValueError(f'{name} must contain only integers')
+    if array.dtype.kind not in 'biuf':
+        raise ValueError(f'{name} must contain only integers')
+
+    array = array.astype(np.int64)
+    if np.any(array < 0):
+        raise ValueError(f'{name} must be non-negative')
+    return array
+
+
+def _to_datetime64(values: Iterable) -> tuple[np.ndarray, np.ndarray | None]:
+    # Returns the wall clock times and their UTC offsets.
+    array = np.asarray(values)
+    if array.dtype.kind == 'M':
+        return array.astype('datetime64[us]'), None
+
+    # Strings and datetime objects are parsed in the same way as `OrderInfo`
+    # parses them and the timezone is dropped to keep the wall clock time.
+    wall_clock_times = []
+    utc_offsets = []
+    for value in array.tolist():
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if not isinstance(value, datetime):
+            raise ValueError(
+                'time must be in UTC ISO format (e.g. 2024-01-15T13:00:00Z)')
+        wall_clock_times.append(value.replace(tzinfo=None))
+        utc_offset = value.utcoffset()
+        utc_offsets.append(utc_offset // timedelta(microseconds=1) if utc_offset else 0)
+    return (np.array(wall_clock_times, dtype='datetime64[us]'),
+            _to_utc_offset(np.array(utc_offsets, dtype=np.int64)))
+
+
+def _to_utc_offset(utc_offsets: np.ndarray) -> np.ndarray | None:
+    # None when there is nothing to convert.
+    return utc_offsets if np.any(utc_offsets) else None
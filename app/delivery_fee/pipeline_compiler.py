@@ -0,0 +1,127 @@
+"""
+This module compiles the configured calculation steps and transformers into a
+single specialized Python function.
+
+Every step and transformer can describe its rule as Python source lines with
+its configuration options folded in as constants (see `compiled_source`). The
+lines work on the local variables `cart_value`, `delivery_distance`,
+`number_of_items`, `time` and `delivery_fee`, where `delivery_fee` is the fee
+calculated so far as an integer, and can call `ceil`, `bisect_left` and
+`bisect_right`. The compiled function is then equivalent to
+`DeliveryFeeCalculator` walking all the steps and transformers, but without any
+per call attribute lookups, method calls or model allocations.
+
+The same way every step and transformer can describe which properties of the
+order its rule depends on as Python expressions (see `cache_key_source`), which
+are compiled into the key function of the calculator's result cache, and
+into the index of precomputed fee tables (see `compile_table_lookup`).
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from math import ceil, isfinite
+from typing import Callable, Hashable, Iterable, Protocol, Sequence
+
+CompiledPipeline = Callable[[int, int, int, datetime], int]
+CacheKeyFunction = Callable[[int, int, int, datetime], Hashable]
+
+_COMPILED_PIPELINE_NAME = "compiled_delivery_fee_pipeline"
+_COMPILED_CACHE_KEY_NAME = "compiled_delivery_fee_cache_key"
+_COMPILED_TABLE_LOOKUP_NAME = "compiled_delivery_fee_table_lookup"
+
+
+class CompilablePipelineComponent(Protocol):
+    def compiled_source(self) -> list[str] | None:
+        """Returns the source lines of the rule or None if it can't be compiled."""
+
+
+class CacheableComponent(Protocol):
+    def cache_key_source(self) -> list[str] | None:
+        """Returns the expressions of the cache key or None if it can't be cached."""
+
+
+def compile_pipeline(calculation_steps: Iterable[CompilablePipelineComponent],
+                     transformers: Iterable[CompilablePipelineComponent]
+                     ) -> CompiledPipeline | None:
+    """Compiles the calculation steps and transformers into one function taking
+    `(cart_value, delivery_distance, number_of_items, time)` and returning the
+    delivery fee in cents. Returns None if any of them can't be compiled, in that
+    case the steps and transformers have to be called one by one."""
+    body = ["delivery_fee = 0"]
+
+    # Steps first and then transformers in their order, same as the calculator.
+    for component in [*calculation_steps, *transformers]:
+        source_lines = component.compiled_source()
+        if source_lines is None:
+            return None
+        body.append(f"# {type(component).__name__}")
+        body.extend(source_lines)
+    body.append("return delivery_fee")
+
+    return _compile_function(_COMPILED_PIPELINE_NAME, body)
+
+
+def compile_cache_key(components: Iterable[CacheableComponent]) -> CacheKeyFunction | None:
+    """Compiles the cache key expressions of the steps and transformers into one
+    function taking `(cart_value, delivery_distance, number_of_items, time)` and
+    returning a tuple. Two orders with the same key have the same delivery fee.
+    Returns None if any of the components can't be cached."""
+    expressions = []
+    for component in components:
+        component_expressions = component.cache_key_source()
+        if component_expressions is None:
+            return None
+        expressions.extend(component_expressions)
+
+    return _compile_function(_COMPILED_CACHE_KEY_NAME,
+                             [f"return ({''.join(f'{expression}, ' for expression in expressions)})"])
+
+
+def compile_table_lookup(in_range_source: str, index_source: str, table: Sequence[int],
+                         fallback: CompiledPipeline) -> CompiledPipeline:
+    """Compiles a function with the arguments and result of the compiled pipeline
+    which returns `table[index]` for the orders in range and calls `fallback`
+    for the others. The expressions work on the same local variables as the
+    cache key expressions."""
+    return _compile_function(_COMPILED_TABLE_LOOKUP_NAME, [
+        f"if {in_range_source}:",
+        f"    return table[{index_source}]",
+        "return fallback(cart_value, delivery_distance, number_of_items, time)",
+    ], {"table": table, "fallback": fallback})
+
+
+def _compile_function(name: str, body: list[str],
+                      constants: dict[str, object] | None = None) -> Callable:
+    source = "\n".join([
+        f"def {name}(cart_value, delivery_distance, number_of_items, time):",
+        *(f"    {line}" for line in body),
+    ])
+    namespace = {"ceil": ceil, "bisect_left": bisect_left, "bisect_right": bisect_right,
+                 **(constants or {})}
+    exec(compile(source, f"<{name}>", "exec"), namespace)
+
+    compiled_function = namespace[name]
+    compiled_function.__doc__ = source
+    return compiled_function
+
+
+def as_int_constant(value: int | float, minimum: int = 0) -> int | None:
+    """Returns the configuration value as an int constant that can be folded into
+    the compiled source. Returns None for non integral values or values below the
+    minimum, since the generic calculation handles them differently (for example
+    by clamping the fee to zero)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float) and not value.is_integer():
+        return None
+    if value < minimum:
+        return None
+    return int(value)
+
+
+def as_factor_constant(value: int | float) -> str | None:
+    """Returns the non-negative factor as a literal that evaluates to the same value."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if not (isfinite(value) and value >= 0):
+        return None
+    return repr(value)
@@ -0,0 +1,262 @@
+"""
+Pricing configuration read from a JSON or YAML file instead of `settings.py`,
+so that the steps, transformers and their configuration options can be changed
+without a redeploy. The file names the classes of the steps and transformers
+and their `ConfigOptions`, in the order they are applied:
+
+    {
+        "version": "2024-02-01",
+        "calculation_steps": [
+            {"type": "CartValueFee", "options": {"cart_value_surcharge_threshold": 1000}},
+            {"type": "DeliveryDistanceFee"},
+            {"type": "NumberOfItemsFee"}
+        ],
+        "transformers": [
+            {"type": "RushHourFeeTransformer", "options": {"rush_hour_fee_factor": 1.2}},
+            {"type": "ReduceFeeTransformer"},
+            {"type": "LimitFeeTransformer"}
+        ]
+    }
+
+Missing options get the defaults of the `ConfigOptions`. The version is
+optional, without it the version is the `configuration_version` hash of the
+configuration. Every response carries the version of the configuration it was
+priced with (see `app.delivery_fee.raw_endpoints.CONFIG_VERSION_HEADER`).
+
+Files ending with .yaml or .yml are read as YAML, with the same keys (see
+`pricing_rules.yaml`, the rules of `settings.py`). Like in JSON, the values
+are only strings, numbers, booleans and null: times such as 15:00:00 and dates
+such as 2024-02-01 are strings, not the sexagesimal numbers and dates of YAML
+1.1, and 10e2 is a number. Either way the configuration is validated and
+compiled into the pipeline of the calculator once, when the file is loaded.
+
+`PricingConfigWatcher` watches the file and reconfigures the calculator when
+the file changes. The new configuration is read, validated and compiled in the
+watcher's thread, and only then replaces the old one in a single assignment
+(see `DeliveryFeeCalculator.configure`). An invalid file is logged and the
+calculator keeps its current configuration.
+"""
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Any, TYPE_CHECKING
+from pydantic import ValidationError
+from app.delivery_fee.fee_calculation_steps import (
+    CartValueFee,
+    DeliveryDistanceFee,
+    DeliveryFeeCalculationStep,
+    NumberOfItemsFee,
+    TieredFee,
+)
+from app.delivery_fee.fee_transformers import (
+    CalendarSurchargeTransformer,
+    DeliveryFeeTransformer,
+    LimitFeeTransformer,
+    ReduceFeeTransformer,
+    RushHourFeeTransformer,
+)
+
+if TYPE_CHECKING:
+    from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+
+
+logger = logging.getLogger(__name__)
+
+# The steps and transformers which can be used in a configuration file, by class name.
+CALCULATION_STEP_TYPES: dict[str, type[DeliveryFeeCalculationStep]] = {
+    step_type.__name__: step_type
+    for step_type in (CartValueFee, DeliveryDistanceFee, NumberOfItemsFee, TieredFee)}
+TRANSFORMER_TYPES: dict[str, type[DeliveryFeeTransformer]] = {
+    transformer_type.__name__: transformer_type
+    for transformer_type in (RushHourFeeTransformer, ReduceFeeTransformer, LimitFeeTransformer,
+                             CalendarSurchargeTransformer)}
+
+
+YAML_SUFFIXES = (".yaml", ".yml")
+
+# How often the watcher thread wakes up without any changes.
+WATCH_TIMEOUT_MS = 100
+
+
+class PricingConfigError(ValueError):
+    """The pricing configuration is invalid."""
+
+
+@dataclass(frozen=True)
+class PricingConfig:
+    calculation_steps: list[DeliveryFeeCalculationStep]
+    transformers: list[DeliveryFeeTransformer]
+    version: str | None = None
+
+    def apply_to(self, calculator: "DeliveryFeeCalculator") -> None:
+        """Replaces the configuration of the `DeliveryFeeCalculator`."""
+        calculator.configure(self.calculation_steps, self.transformers, self.version)
+
+
+def parse_pricing_config(data: Any) -> PricingConfig:
+    """Builds the steps and transformers of the parsed configuration file.
+    Raises `PricingConfigError` if the configuration is invalid."""
+    if not isinstance(data, dict):
+        raise PricingConfigError("the configuration must be an object")
+    unknown_keys = data.keys() - {"version", "calculation_steps", "transformers"}
+    if unknown_keys:
+        raise PricingConfigError(f"unknown keys: {', '.join(sorted(unknown_keys))}")
+    version = data.get("version")
+    if version is not None and (not isinstance(version, str) or not version):
+        raise PricingConfigError("version must be a non-empty string")
+
+    return PricingConfig(
+        _build_components("calculation_steps", data.get("calculation_steps"),
+                          CALCULATION_STEP_TYPES),
+        _build_components("transformers", data.get("transformers"), TRANSFORMER_TYPES),
+        version)
+
+
+def load_pricing_config(path: str | Path) -> PricingConfig:
+    """Reads and builds the JSON or YAML configuration file. Raises
+    `PricingConfigError` if the file can't be read or the configuration is
+    invalid."""
+    path = Path(path)
+    try:
+        if path.suffix in YAML_SUFFIXES:
+            data = _load_yaml(path.read_bytes())
+        else:
+            data = json.loads(path.read_bytes())
+    except (OSError, ValueError) as error:
+        raise PricingConfigError(f"can't read {path}: {error}") from error
+    try:
+        return parse_pricing_config(data)
+    except PricingConfigError as error:
+        raise PricingConfigError(f"{path}: {error}") from error
+
+
+def _load_yaml(content: bytes) -> Any:
+    # PyYAML is only needed when the configuration is a YAML file.
+    import yaml
+
+    try:
+        return yaml.load(content, Loader=_yaml_loader())
+    except yaml.YAMLError as error:
+        raise ValueError(str(error)) from error
+
+
+@cache
+def _yaml_loader() -> type:
+    """Safe YAML loader which resolves the plain scalars like YAML 1.2: no
+    sexagesimal numbers and no dates, and numbers like 10e2 are floats."""
+    import yaml
+
+    class PricingConfigLoader(yaml.SafeLoader):
+        pass
+
+    PricingConfigLoader.yaml_implicit_resolvers = {
+        first: [(tag, regexp) for tag, regexp in resolvers
+                if tag not in ("tag:yaml.org,2002:int", "tag:yaml.org,2002:float",
+                               "tag:yaml.org,2002:timestamp")]
+        for first, resolvers in yaml.SafeLoader.yaml_implicit_resolvers.items()}
+    PricingConfigLoader.add_implicit_resolver(
+        "tag:yaml.org,2002:int", re.compile(r"^[-+]?(?:0|[1-9][0-9]*)$"), list("-+0123456789"))
+    PricingConfigLoader.add_implicit_resolver(
+        "tag:yaml.org,2002:float",
+        re.compile(r"^[-+]?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)(?:[eE][-+]?[0-9]+)?$"),
+        list("-+.0123456789"))
+    return PricingConfigLoader
+
+
+def _build_components(key: str, components: Any, types: dict[str, type]) -> list:
+    if not isinstance(components, list):
+        raise PricingConfigError(f"{key} must be a list")
+
+    built_components = []
+    for index, component in enumerate(components):
+        where = f"{key}[{index}]"
+        if not isinstance(component, dict) or component.keys() - {"type", "options"}:
+            raise PricingConfigError(f"{where} must be an object with a type and options")
+        type_name = component.get("type")
+        component_type = types.get(type_name) if isinstance(type_name, str) else None
+        if component_type is None:
+            raise PricingConfigError(f"{where}: unknown type {type_name!r}, "
+                                     f"expected one of {', '.join(types)}")
+
+        options = component.get("options", {})
+        if not isinstance(options, dict):
+            raise PricingConfigError(f"{where}: options must be an object")
+        # The options models ignore unknown fields, but in a file they are typos.
+        unknown_options = options.keys() - component_type.ConfigOptions.model_fields.keys()
+        if unknown_options:
+            raise PricingConfigError(
+                f"{where}: unknown options {', '.join(sorted(unknown_options))}")
+        try:
+            config_options = component_type.ConfigOptions.model_validate(options)
+        except ValidationError as error:
+            raise PricingConfigError(f"{where}: " + "; ".join(
+                f"{'.'.join(map(str, detail['loc']))}: {detail['msg']}"
+                for detail in error.errors())) from error
+        try:
+            built_components.append(component_type(config_options))
+        except ValueError as error:
+            raise PricingConfigError(f"{where}: {error}") from error
+    return built_components
+
+
+class PricingConfigWatcher:
+    """Reconfigures `calculator` from the configuration file whenever the file
+    changes. The directory of the file is watched, so that the file can also be
+    replaced atomically (written to another file and renamed over it)."""
+
+    def __init__(self, path: str | Path, calculator: "DeliveryFeeCalculator") -> None:
+        self.path = Path(path).resolve()
+        self.calculator = calculator
+        self.last_error: PricingConfigError | None = None
+        self._stop_event = threading.Event()
+        self._watching = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def reload(self) -> bool:
+        """Applies the configuration file to the calculator. Returns False, and
+        keeps the current configuration, if the file is invalid."""
+        try:
+            pricing_config = load_pricing_config(self.path)
+            # Compiling the new pipeline happens here, before it replaces the old one.
+            pricing_config.apply_to(self.calculator)
+        except PricingConfigError as error:
+            self.last_error = error
+            logger.error("Pricing configuration not reloaded: %s", error)
+            return False
+        self.last_error = None
+        logger.info("Pricing configuration %s loaded from %s",
+                    self.calculator.version, self.path)
+        return True
+
+    def start(self) -> None:
+        """Starts watching in a background thread. Returns once the file is
+        watched, so that no change made after this call is missed."""
+        self._stop_event.clear()
+        self._watching.clear()
+        self._thread = threading.Thread(target=self._watch, name="pricing-config-watcher",
+                                        daemon=True)
+        self._thread.start()
+        self._watching.wait(timeout=WATCH_TIMEOUT_MS / 1000 * 10)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self) -> None:
+        # watchfiles is only needed when the configuration is watched.
+        from watchfiles import watch
+
+        # The first timeout tells that the directory is watched.
+        for changes in watch(self.path.parent, stop_event=self._stop_event,
+                             watch_filter=lambda change, path: Path(path) == self.path,
+                             rust_timeout=WATCH_TIMEOUT_MS, yield_on_timeout=True):
+            self._watching.set()
+            # A deleted file keeps the current configuration until the file is back.
+            if changes and self.path.exists():
+                self.reload()
@@ -0,0 +1,245 @@
+"""
+Delivery fee endpoints on plain Starlette, without FastAPI. FastAPI builds its
+OpenAPI models when it is imported, which is most of the startup time of the
+app, so the lean startup mode serves the same routes with these endpoints.
+The FastAPI app also serves its quote endpoint with them (the quote fast path
+in `app.delivery_fee.router`), as they skip FastAPI's request handling.
+The responses, including the validation errors, are the same as the responses
+of the FastAPI routes.
+"""
+import json
+from typing import Any, AsyncIterator, Callable, Coroutine, Mapping, TYPE_CHECKING
+import orjson
+from pydantic import TypeAdapter, ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.types import Receive, Scope, Send
+from app.delivery_fee.models import OrderInfo, DeliveryFeeBatchItem
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, PricingPipeline
+from app.delivery_fee import ndjson_stream, server_timing
+from app.delivery_fee.request_parsing import (
+    RequestBodyValidationError,
+    jsonable_validation_errors,
+    parse_json_body,
+)
+from app import config
+
+if TYPE_CHECKING:
+    from app.delivery_fee.city_pricing import CityPricingStore
+
+
+# Version of the pricing configuration that the fees of the response were
+# calculated with, so that caches can tell apart the fees of different versions.
+CONFIG_VERSION_HEADER = "x-pricing-config-version"
+
+ORDER_INFO_ADAPTER = TypeAdapter(OrderInfo)
+ORDERS_ADAPTER = TypeAdapter(list[Any])
+BATCH_ITEMS_ADAPTER = TypeAdapter(list[DeliveryFeeBatchItem])
+
+
+def calculate_delivery_fees_batch(orders: list[Any], pipeline: PricingPipeline | None = None
+                                  ) -> list[DeliveryFeeBatchItem]:
+    """Validates every order of the batch separately so that one invalid order
+    does not fail the whole batch. The results are in the same order as the orders.
+    All the fees are calculated with `pipeline`, by default the current pipeline
+    of the calculator."""
+    if pipeline is None:
+        pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+    results: list[DeliveryFeeBatchItem | None] = [None] * len(orders)
+    valid_order_infos: list[OrderInfo] = []
+    valid_positions: list[int] = []
+
+    for position, order in enumerate(orders):
+        try:
+            valid_order_infos.append(OrderInfo.model_validate(order))
+            valid_positions.append(position)
+        except ValidationError as error:
+            results[position] = DeliveryFeeBatchItem(
+                errors=jsonable_validation_errors(error))
+
+    calculate_fee = pipeline.calculate_fee
+    for position, order_info in zip(valid_positions, valid_order_infos):
+        results[position] = DeliveryFeeBatchItem(delivery_fee=calculate_fee(order_info))
+
+    return results
+
+
+async def calculate_delivery_fee(request: Request) -> Response:
+    try:
+        order_info = parse_json_body(await request.body(), request.headers.get("content-type"),
+                                     ORDER_INFO_ADAPTER)
+    except RequestBodyValidationError as error:
+        return _validation_error_response(error)
+
+    return _quote_response(DELIVERY_FEE_CALCULATOR.pipeline, order_info)
+
+
+def market_quote_endpoint(pipeline: PricingPipeline
+                          ) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+    """Same as `calculate_delivery_fee`, but quotes with the pipeline of a
+    market (see `app.delivery_fee.markets`)."""
+    async def calculate_market_delivery_fee(request: Request) -> Response:
+        try:
+            order_info = parse_json_body(await request.body(),
+                                         request.headers.get("content-type"),
+                                         ORDER_INFO_ADAPTER)
+        except RequestBodyValidationError as error:
+            return _validation_error_response(error)
+
+        return _quote_response(pipeline, order_info)
+
+    return calculate_market_delivery_fee
+
+
+UNKNOWN_CITY_DETAIL = "Unknown city"
+
+
+def city_quote_endpoint(city_pricing: "CityPricingStore"
+                        ) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+    """Same as `calculate_delivery_fee`, but quotes with the pipeline of the
+    city of the path (see `app.delivery_fee.city_pricing`). Unknown cities are
+    not found."""
+    async def calculate_city_delivery_fee(request: Request) -> Response:
+        try:
+            order_info = parse_json_body(await request.body(),
+                                         request.headers.get("content-type"),
+                                         ORDER_INFO_ADAPTER)
+        except RequestBodyValidationError as error:
+            return _validation_error_response(error)
+
+        try:
+            pipeline = city_pricing.pipeline(request.path_params["city"])
+        except KeyError:
+            # Same JSON as FastAPI's response of an `HTTPException`.
+            return Response(json.dumps({"detail": UNKNOWN_CITY_DETAIL}, separators=(",", ":")),
+                            status_code=404, media_type="application/json")
+        return _quote_response(pipeline, order_info)
+
+    return calculate_city_delivery_fee
+
+
+def _quote_response(pipeline: PricingPipeline, order_info: OrderInfo) -> Response:
+    # Same JSON as the `DeliveryFee` response model, without building the model.
+    return Response(orjson.dumps({"delivery_fee": pipeline.calculate_fee(order_info)}),
+                    media_type="application/json",
+                    headers={CONFIG_VERSION_HEADER: pipeline.version})
+
+
+async def calculate_delivery_fee_with_server_timing(request: Request) -> Response:
+    """Same as `calculate_delivery_fee`, but the requests which ask for it are
+    timed phase by phase (see `app.delivery_fee.server_timing`)."""
+    if not server_timing.is_requested(request.headers, config.SERVER_TIMING_SAMPLE_RATE):
+        return await calculate_delivery_fee(request)
+
+    timing = server_timing.ServerTiming()
+    with timing.measure("body"):
+        body = await request.body()
+    try:
+        with timing.measure("validate"):
+            order_info = parse_json_body(body, request.headers.get("content-type"),
+                                         ORDER_INFO_ADAPTER)
+    except RequestBodyValidationError as error:
+        response = _validation_error_response(error)
+    else:
+        pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+        delivery_fee, stage_seconds = pipeline.calculate_fee_timed(order_info)
+        for (kind, name), seconds in zip(pipeline.stages, stage_seconds):
+            timing.add(f"{kind}.{name}", seconds)
+        with timing.measure("serialize"):
+            response = Response(orjson.dumps({"delivery_fee": delivery_fee}),
+                                media_type="application/json",
+                                headers={CONFIG_VERSION_HEADER: pipeline.version})
+
+    response.headers[server_timing.RESPONSE_HEADER] = timing.header_value()
+    return response
+
+
+async def calculate_delivery_fees(request: Request) -> Response:
+    try:
+        orders = parse_json_body(await request.body(), request.headers.get("content-type"),
+                                 ORDERS_ADAPTER)
+    except RequestBodyValidationError as error:
+        return _validation_error_response(error)
+
+    # Same as the FastAPI route, the CPU bound batch is handed to the thread pool.
+    pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+    results = await run_in_threadpool(calculate_delivery_fees_batch, orders, pipeline)
+    return Response(BATCH_ITEMS_ADAPTER.dump_json(results), media_type="application/json",
+                    headers={CONFIG_VERSION_HEADER: pipeline.version})
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """Streaming response whose body iterator reads the request body while the
+    response is streamed. `StreamingResponse` listens for the client disconnect
+    while streaming, which would consume the request body messages. Here the
+    request stream itself ends the response when the client disconnects."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def calculate_delivery_fees_stream(request: Request) -> Response:
+    """Quotes the NDJSON order infos of the request body and streams one NDJSON
+    result for every non-blank line (see `app.delivery_fee.ndjson_stream`). The
+    whole stream is priced with the configuration of the time it started."""
+    pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+
+    async def results() -> AsyncIterator[bytes]:
+        async for lines in ndjson_stream.split_lines(request.stream(),
+                                                     ndjson_stream.MAX_LINE_BYTES):
+            for start in range(0, len(lines), ndjson_stream.MAX_CHUNK_LINES):
+                chunk = lines[start:start + ndjson_stream.MAX_CHUNK_LINES]
+                if quotes := await run_in_threadpool(ndjson_stream.quote_lines, chunk,
+                                                     pipeline):
+                    yield quotes
+
+    return RequestStreamingResponse(results(), media_type=ndjson_stream.NDJSON_MEDIA_TYPE,
+                                    headers={CONFIG_VERSION_HEADER: pipeline.version})
+
+
+def _validation_error_response(error: RequestBodyValidationError) -> Response:
+    # Serialized with the same options as FastAPI's JSONResponse.
+    content = json.dumps({"detail": error.errors}, ensure_ascii=False, separators=(",", ":"))
+    return Response(content, status_code=422, media_type="application/json")
+
+
+def quote_endpoint(server_timing: bool = config.SERVER_TIMING
+                   ) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+    """Without `server_timing` the quote requests are served by the untimed
+    endpoint, so the timing costs nothing when it is off."""
+    return calculate_delivery_fee_with_server_timing if server_timing else calculate_delivery_fee
+
+
+def create_delivery_fee_routes(server_timing: bool = config.SERVER_TIMING,
+                               markets: Mapping[str, PricingPipeline] | None = None,
+                               city_pricing: "CityPricingStore | None" = None
+                               ) -> list[Route]:
+    """`markets` get their own quote routes, by default the markets of
+    `app.delivery_fee.markets.MARKET_REGISTRY`. The cities of `city_pricing`, by
+    default `app.delivery_fee.city_pricing.CITY_PRICING_STORE`, are quoted by a
+    route with the city in the path."""
+    if markets is None:
+        from app.delivery_fee.markets import MARKET_REGISTRY
+        markets = MARKET_REGISTRY
+    if city_pricing is None:
+        from app.delivery_fee.city_pricing import CITY_PRICING_STORE
+        city_pricing = CITY_PRICING_STORE
+
+    return [
+        Route("/calculate_delivery_fee/", quote_endpoint(server_timing), methods=["POST"]),
+        *([Route("/calculate_delivery_fee/cities/{city}/", city_quote_endpoint(city_pricing),
+                 methods=["POST"])] if city_pricing is not None else []),
+        *(Route(f"/calculate_delivery_fee/{market}/", market_quote_endpoint(pipeline),
+                methods=["POST"])
+          for market, pipeline in markets.items()),
+        Route("/calculate_delivery_fees/", calculate_delivery_fees, methods=["POST"]),
+        Route("/calculate_delivery_fees/stream/", calculate_delivery_fees_stream,
+              methods=["POST"]),
+    ]
+
+
+delivery_fee_routes = create_delivery_fee_routes()
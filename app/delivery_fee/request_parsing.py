@@ -0,0 +1,91 @@
+"""
+Parsing of raw JSON request bodies without FastAPI.
+
+The happy path validates the raw bytes directly with pydantic-core, without
+decoding them to Python objects first. Only when that fails the body is parsed
+again the same way FastAPI parses it, so that the validation errors are exactly
+the same as the errors of the FastAPI routes.
+"""
+import email.message
+import json
+from typing import Any
+from pydantic import TypeAdapter, ValidationError
+
+
+class RequestBodyValidationError(Exception):
+    """Raised when the request body is invalid. `errors` are JSON serializable
+    and in the same format as the `detail` of FastAPI's validation errors."""
+
+    def __init__(self, errors: list[dict[str, Any]]) -> None:
+        super().__init__(errors)
+        self.errors = errors
+
+
+def parse_json_body(body: bytes, content_type: str | None, type_adapter: TypeAdapter) -> Any:
+    """Validates the JSON request body with the type adapter and returns the
+    validated value. Raises `RequestBodyValidationError` if the body is invalid."""
+    if body and (content_type is None or content_type == "application/json"):
+        try:
+            return type_adapter.validate_json(body)
+        except ValidationError:
+            pass
+
+    # The fast path did not work, do what FastAPI would do to get the same errors.
+    value = _decode_body(body, content_type)
+    if value is None:
+        missing_error = ValidationError.from_exception_data(
+            "Field required", [{"type": "missing", "loc": ("body",), "input": None}])
+        raise RequestBodyValidationError(jsonable_validation_errors(missing_error))
+    try:
+        return type_adapter.validate_python(value, from_attributes=True)
+    except ValidationError as error:
+        raise RequestBodyValidationError(jsonable_validation_errors(error, ("body",)))
+
+
+def jsonable_validation_errors(error: ValidationError,
+                               loc_prefix: tuple[str | int, ...] = ()) -> list[dict[str, Any]]:
+    """Returns the errors of the pydantic validation error in a JSON serializable
+    form, encoded in the same way as FastAPI encodes them."""
+    return [_jsonable(dict(error_details, loc=[*loc_prefix, *error_details["loc"]]))
+            for error_details in error.errors()]
+
+
+def _decode_body(body: bytes, content_type: str | None) -> Any:
+    if not body:
+        return None
+
+    is_json = content_type is None
+    if content_type is not None:
+        message = email.message.Message()
+        message["content-type"] = content_type
+        if message.get_content_maintype() == "application":
+            subtype = message.get_content_subtype()
+            is_json = subtype == "json" or subtype.endswith("+json")
+    if not is_json:
+        return body
+
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError as error:
+        raise RequestBodyValidationError([json_invalid_error(error, ("body",))])
+
+
+def json_invalid_error(error: json.JSONDecodeError,
+                       loc_prefix: tuple[str | int, ...] = ()) -> dict[str, Any]:
+    """Returns the JSON decode error in the same form as FastAPI's error for an
+    invalid JSON body."""
+    return {"type": "json_invalid", "loc": [*loc_prefix, error.pos], "msg": "JSON decode error",
+            "input": {}, "ctx": {"error": error.msg}}
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, Exception):
+        # Exceptions in the error context have no public fields.
+        return {}
+    return value
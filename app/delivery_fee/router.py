@@ -1,23 +1,133 @@
-from fastapi import APIRouter
-from app.delivery_fee.models import OrderInfo, DeliveryFee
-from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from http import HTTPStatus
+from typing import Any, Callable, Coroutine, Mapping, TYPE_CHECKING
+from fastapi import APIRouter, Body, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from app.delivery_fee.models import OrderInfo, DeliveryFee, DeliveryFeeBatchItem
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, PricingPipeline
+from app.delivery_fee import raw_endpoints
+from app.delivery_fee.raw_endpoints import CONFIG_VERSION_HEADER, calculate_delivery_fees_batch
+from app.delivery_fee.ndjson_stream import NDJSON_MEDIA_TYPE
+from app import config
 
-delivery_fee_router = APIRouter()
+if TYPE_CHECKING:
+    from app.delivery_fee.city_pricing import CityPricingStore
 
 
-@delivery_fee_router.post("/calculate_delivery_fee/")
-async def calculate_delivery_fee(order_info: OrderInfo) -> DeliveryFee:
-    return DELIVERY_FEE_CALCULATOR.calculate(order_info)
+async def calculate_delivery_fee(order_info: OrderInfo, response: Response) -> DeliveryFee:
+    pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+    response.headers[CONFIG_VERSION_HEADER] = pipeline.version
+    return DeliveryFee(delivery_fee=pipeline.calculate_fee(order_info))
 
 
-"""
-Maybe in future we can add different rates for different countries.
-"""
-# @delivery_fee_router.post("/calculate_delivery_fee/fi/")
-# async def calculate_delivery_fee_for_finland(order_info: OrderInfo) -> DeliveryFee:
-#     return DELIVERY_FEE_CALCULATOR.calculate(order_info, locale="fi")
+async def calculate_delivery_fees(response: Response,
+                                  orders: list[Any] = Body()) -> list[DeliveryFeeBatchItem]:
+    pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+    response.headers[CONFIG_VERSION_HEADER] = pipeline.version
+    # Validating and calculating hundreds of orders is CPU bound, so the whole
+    # batch is handed to the thread pool at once instead of blocking the event loop.
+    return await run_in_threadpool(calculate_delivery_fees_batch, orders, pipeline)
 
 
-# @delivery_fee_router.post("/calculate_delivery_fee/de/")
-# async def calculate_delivery_fee_for_germany(order_info: OrderInfo) -> DeliveryFee:
-#     return DELIVERY_FEE_CALCULATOR.calculate(order_info, locale="fi")
+NDJSON_STREAM_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "description": "One order info per line.",
+        "content": {NDJSON_MEDIA_TYPE: {"schema": {"$ref": "#/components/schemas/OrderInfo"}}},
+    },
+}
+
+
+def served_by(raw_endpoint: Callable[[Request], Coroutine[Any, Any, Response]]
+              ) -> type[APIRoute]:
+    """Route class for routes which are documented by their declared endpoint,
+    but whose requests are handled by the raw Starlette endpoint. This skips the
+    dependency resolution, body decoding and response encoding of FastAPI. The
+    raw endpoint must give the same responses as the declared endpoint."""
+    class RawEndpointRoute(APIRoute):
+        def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+            return raw_endpoint
+
+    return RawEndpointRoute
+
+
+def market_calculate_delivery_fee(
+        pipeline: PricingPipeline) -> Callable[..., Coroutine[Any, Any, DeliveryFee]]:
+    async def calculate_delivery_fee(order_info: OrderInfo, response: Response) -> DeliveryFee:
+        response.headers[CONFIG_VERSION_HEADER] = pipeline.version
+        return DeliveryFee(delivery_fee=pipeline.calculate_fee(order_info))
+
+    return calculate_delivery_fee
+
+
+def city_calculate_delivery_fee(
+        city_pricing: "CityPricingStore") -> Callable[..., Coroutine[Any, Any, DeliveryFee]]:
+    async def calculate_city_delivery_fee(city: str, order_info: OrderInfo,
+                                          response: Response) -> DeliveryFee:
+        try:
+            pipeline = city_pricing.pipeline(city)
+        except KeyError:
+            raise HTTPException(HTTPStatus.NOT_FOUND, raw_endpoints.UNKNOWN_CITY_DETAIL) from None
+        response.headers[CONFIG_VERSION_HEADER] = pipeline.version
+        return DeliveryFee(delivery_fee=pipeline.calculate_fee(order_info))
+
+    return calculate_city_delivery_fee
+
+
+def create_delivery_fee_router(quote_fast_path: bool = config.QUOTE_FAST_PATH,
+                               server_timing: bool = config.SERVER_TIMING,
+                               markets: Mapping[str, PricingPipeline] | None = None,
+                               city_pricing: "CityPricingStore | None" = None
+                               ) -> APIRouter:
+    """Creates the router of the delivery fee endpoints. With `quote_fast_path`
+    the single quote endpoints validate the raw request body with pydantic-core
+    and serialize the response with orjson (see `app.delivery_fee.raw_endpoints`).
+    `server_timing` needs the quote fast path, as FastAPI's request handling
+    can't be timed phase by phase. `markets` get their own quote routes, by
+    default the markets of `app.delivery_fee.markets.MARKET_REGISTRY`. The
+    cities of `city_pricing`, by default
+    `app.delivery_fee.city_pricing.CITY_PRICING_STORE`, are quoted by a route
+    with the city in the path."""
+    if markets is None:
+        from app.delivery_fee.markets import MARKET_REGISTRY
+        markets = MARKET_REGISTRY
+    if city_pricing is None:
+        from app.delivery_fee.city_pricing import CITY_PRICING_STORE
+        city_pricing = CITY_PRICING_STORE
+    delivery_fee_router = APIRouter()
+
+    delivery_fee_router.add_api_route(
+        "/calculate_delivery_fee/", calculate_delivery_fee, methods=["POST"],
+        route_class_override=(served_by(raw_endpoints.quote_endpoint(server_timing))
+                              if quote_fast_path else None))
+    for market, pipeline in markets.items():
+        # The pipeline of the market is bound to the route, the routing is the dispatch.
+        delivery_fee_router.add_api_route(
+            f"/calculate_delivery_fee/{market}/", market_calculate_delivery_fee(pipeline),
+            methods=["POST"], name=f"calculate_delivery_fee_{market}",
+            summary=f"Calculate Delivery Fee ({market})",
+            route_class_override=(served_by(raw_endpoints.market_quote_endpoint(pipeline))
+                                  if quote_fast_path else None))
+    if city_pricing is not None:
+        delivery_fee_router.add_api_route(
+            "/calculate_delivery_fee/cities/{city}/", city_calculate_delivery_fee(city_pricing),
+            methods=["POST"], responses={404: {"description": raw_endpoints.UNKNOWN_CITY_DETAIL}},
+            route_class_override=(served_by(raw_endpoints.city_quote_endpoint(city_pricing))
+                                  if quote_fast_path else None))
+    delivery_fee_router.add_api_route(
+        "/calculate_delivery_fees/", calculate_delivery_fees, methods=["POST"])
+    # Reads the request body itself, so it is the same endpoint as in the lean app.
+    delivery_fee_router.add_api_route(
+        "/calculate_delivery_fees/stream/", raw_endpoints.calculate_delivery_fees_stream,
+        methods=["POST"], response_class=raw_endpoints.RequestStreamingResponse,
+        description=("Streams one delivery fee result for every order info line of the "
+                     "NDJSON request body, in the same order. Blank lines are skipped."),
+        openapi_extra=NDJSON_STREAM_OPENAPI,
+        responses={200: {"description": "One delivery fee batch item per order info line.",
+                         "content": {NDJSON_MEDIA_TYPE: {"schema": {
+                             "$ref": "#/components/schemas/DeliveryFeeBatchItem"}}}}})
+
+    return delivery_fee_router
+
+
+delivery_fee_router = create_delivery_fee_router()
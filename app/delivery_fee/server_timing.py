@@ -0,0 +1,55 @@
+"""
+Opt-in timing of a single quote request, returned in a `Server-Timing` response
+header, e.g.
+
+    Server-Timing: body;dur=0.012, validate;dur=0.021, step.CartValueFee;dur=0.004, ...,
+        transformer.RushHourFeeTransformer;dur=0.003, serialize;dur=0.002
+
+The durations are in milliseconds. A request is timed if it has the
+`X-Server-Timing: 1` header or if it is sampled, see `is_requested`. Timing is
+only available when the app is created with `server_timing` on
+(`DELIVERY_FEE_SERVER_TIMING=1`), otherwise the routes are served by the
+untimed endpoints and the header is ignored.
+
+The steps and transformers of a timed request are applied one by one with
+`DeliveryFeeCalculator.calculate_fee_timed`, without the cache, so the
+breakdown always shows the work of every step.
+"""
+import random
+import time
+from contextlib import contextmanager
+from typing import Iterator, Mapping
+
+
+REQUEST_HEADER = "x-server-timing"
+RESPONSE_HEADER = "server-timing"
+
+
+def is_requested(headers: Mapping[str, str], sample_rate: float) -> bool:
+    """A request is timed if it asks for it with the request header or, without
+    the header, with the probability `sample_rate` (0.01 = 1% of the requests)."""
+    requested = headers.get(REQUEST_HEADER)
+    if requested is not None:
+        return requested == "1"
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class ServerTiming:
+    """Durations of the phases of one request, in the order they were measured."""
+
+    def __init__(self) -> None:
+        self.durations: list[tuple[str, float]] = []
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations.append((name, seconds))
+
+    def header_value(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.durations)
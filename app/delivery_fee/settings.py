@@ -72,3 +72,27 @@ ALL_FEE_TRANSFORMERS = [
     ReduceFeeTransformer(EXCLUDE_FEE_CONFIG_OPTIONS),
     LimitFeeTransformer(LIMIT_FEE_CONFIG_OPTIONS),
 ]
+
+
+#########################################################################################
+# Markets
+#########################################################################################
+
+# Every market has its own steps and transformers, served at
+# /api/delivery/calculate_delivery_fee/<market>/ (see `app.delivery_fee.markets`).
+# Germany has the same rules as Finland until its own rules are decided.
+MARKETS = {
+    "fi": (ALL_CALCULATION_STEPS, ALL_FEE_TRANSFORMERS),
+    "de": (
+        [
+            CartValueFee(CART_VALUE_CONFIG_OPTIONS),
+            DeliveryDistanceFee(DELIVERY_DISTANCE_CONFIG_OPTIONS),
+            NumberOfItemsFee(NUMBER_OF_ITEMS_CONFIG_OPTIONS),
+        ],
+        [
+            RushHourFeeTransformer(FRIDAY_RUSH_HOUR_CONFIG_OPTIONS),
+            ReduceFeeTransformer(EXCLUDE_FEE_CONFIG_OPTIONS),
+            LimitFeeTransformer(LIMIT_FEE_CONFIG_OPTIONS),
+        ],
+    ),
+}
@@ -0,0 +1,180 @@
+"""
+This module contains helpers for checking if a time falls in recurring weekly
+time windows, like the Friday rush hour. Times are turned into the number of
+microseconds since the start of the week (Monday 00:00:00), so that checking
+a time against the windows is just integer comparisons. Dated windows, like
+holidays, use the number of microseconds since the start of the proleptic
+Gregorian calendar (see `calendar_microsecond`) the same way.
+"""
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from functools import reduce
+from typing import Callable, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # NumPy is imported only when the vectorized functions are used.
+    import numpy as np
+
+
+# Names of the weekdays in the order of `datetime.weekday()`.
+WEEKDAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday",
+                 "Friday", "Saturday", "Sunday")
+MICROSECONDS_IN_DAY = 24 * 60 * 60 * 1_000_000
+MICROSECONDS_IN_WEEK = 7 * MICROSECONDS_IN_DAY
+
+# 1970-01-01, the start of the datetime64 epoch, was a Thursday.
+_EPOCH_WEEKDAY = WEEKDAY_NAMES.index("Thursday")
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def microsecond_of_day(time_of_day: time) -> int:
+    """Returns the number of microseconds since midnight of the time of day."""
+    return ((time_of_day.hour * 60 + time_of_day.minute) * 60 +
+            time_of_day.second) * 1_000_000 + time_of_day.microsecond
+
+
+def microsecond_of_week(timestamp: datetime) -> int:
+    """Returns the number of microseconds since the start of the week for the wall
+    clock time of the timestamp. Timezone aware timestamps are not converted."""
+    return (timestamp.weekday() * MICROSECONDS_IN_DAY +
+            ((timestamp.hour * 60 + timestamp.minute) * 60 + timestamp.second) * 1_000_000 +
+            timestamp.microsecond)
+
+
+def microsecond_of_week_many(timestamps: "np.ndarray") -> "np.ndarray":
+    """Vectorized `microsecond_of_week` for a datetime64 array of wall clock times."""
+    import numpy as np
+
+    microseconds = timestamps.astype('datetime64[us]').astype(np.int64)
+    return (microseconds + _EPOCH_WEEKDAY * MICROSECONDS_IN_DAY) % MICROSECONDS_IN_WEEK
+
+
+def calendar_microsecond(timestamp: datetime) -> int:
+    """Returns the number of microseconds since the start of the proleptic
+    Gregorian calendar (`datetime.toordinal`) for the wall clock time of the
+    timestamp. Timezone aware timestamps are not converted."""
+    return (timestamp.toordinal() * MICROSECONDS_IN_DAY +
+            ((timestamp.hour * 60 + timestamp.minute) * 60 + timestamp.second) * 1_000_000 +
+            timestamp.microsecond)
+
+
+def utc_calendar_microsecond(timestamp: datetime) -> int:
+    """Same as `calendar_microsecond` for the UTC time of the timestamp. Naive
+    timestamps are taken as UTC."""
+    utc_offset = timestamp.utcoffset()
+    if not utc_offset:
+        return calendar_microsecond(timestamp)
+    return calendar_microsecond(timestamp) - utc_offset // timedelta(microseconds=1)
+
+
+def calendar_microsecond_many(timestamps: "np.ndarray") -> "np.ndarray":
+    """Vectorized `calendar_microsecond` for a datetime64 array of wall clock times."""
+    import numpy as np
+
+    microseconds = timestamps.astype('datetime64[us]').astype(np.int64)
+    return microseconds + _EPOCH_ORDINAL * MICROSECONDS_IN_DAY
+
+
+def calendar_microsecond_of_week(calendar_microsecond: int) -> int:
+    """Returns the microsecond of the week of a `calendar_microsecond`. The
+    first day of the calendar was a Monday."""
+    return (calendar_microsecond - MICROSECONDS_IN_DAY) % MICROSECONDS_IN_WEEK
+
+
+def calendar_microsecond_of_week_many(calendar_microseconds: "np.ndarray") -> "np.ndarray":
+    """Vectorized `calendar_microsecond_of_week`."""
+    return (calendar_microseconds - MICROSECONDS_IN_DAY) % MICROSECONDS_IN_WEEK
+
+
+class WeeklyIntervalIndex:
+    """Sorted and non-overlapping inclusive intervals of microseconds of the week.
+    Overlapping or touching intervals are merged when the index is built, so
+    checking if a time is in any of the intervals is a single bisect."""
+
+    def __init__(self, intervals: Iterable[tuple[int, int]] = ()) -> None:
+        merged_intervals: list[list[int]] = []
+        for start, end in sorted(intervals):
+            if start > end:
+                # Empty interval, same as `start <= x <= end` never being true.
+                continue
+            if merged_intervals and start <= merged_intervals[-1][1] + 1:
+                merged_intervals[-1][1] = max(merged_intervals[-1][1], end)
+            else:
+                merged_intervals.append([start, end])
+
+        self.starts = tuple(start for start, _ in merged_intervals)
+        self.ends = tuple(end for _, end in merged_intervals)
+
+    @classmethod
+    def for_weekday(cls, weekday_name: str, start: time, end: time) -> "WeeklyIntervalIndex":
+        """Index with a single window from start to end (both inclusive) on the given
+        weekday. An unknown weekday name results in an empty index."""
+        if weekday_name not in WEEKDAY_NAMES:
+            return cls()
+        start_of_day = WEEKDAY_NAMES.index(weekday_name) * MICROSECONDS_IN_DAY
+        return cls([(start_of_day + microsecond_of_day(start),
+                     start_of_day + microsecond_of_day(end))])
+
+    @property
+    def intervals(self) -> list[tuple[int, int]]:
+        return list(zip(self.starts, self.ends))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __contains__(self, microsecond: int) -> bool:
+        position = bisect_right(self.starts, microsecond) - 1
+        return position >= 0 and microsecond <= self.ends[position]
+
+    def contains_many(self, microseconds: "np.ndarray") -> "np.ndarray":
+        """Vectorized `in` check, returns a bool array."""
+        import numpy as np
+
+        if not self.starts:
+            return np.zeros(len(microseconds), dtype=bool)
+        positions = np.searchsorted(np.array(self.starts), microseconds, side='right') - 1
+        ends = np.array(self.ends)[np.maximum(positions, 0)]
+        return (positions >= 0) & (microseconds <= ends)
+
+
+class FactorIntervalIndex:
+    """Factors of possibly overlapping inclusive intervals of integers. The
+    factors of the intervals which overlap are combined with `combine` when the
+    index is built, starting from `identity`, which is also the factor outside
+    of all the intervals. The number line is split into segments with a single
+    factor each, so looking up the factor of a value is a single bisect."""
+
+    def __init__(self, intervals: Iterable[tuple[int, int, float]],
+                 combine: Callable[[float, float], float], identity: float) -> None:
+        # Empty intervals are skipped, same as `start <= x <= end` never being true.
+        intervals = [(start, end, factor) for start, end, factor in intervals if start <= end]
+        boundaries = sorted({start for start, _, _ in intervals} |
+                            {end + 1 for _, end, _ in intervals})
+
+        starts: list[int] = []
+        factors = [identity]
+        for boundary in boundaries:
+            factor = reduce(combine, (factor for start, end, factor in intervals
+                                      if start <= boundary <= end), identity)
+            if factor != factors[-1]:
+                starts.append(boundary)
+                factors.append(factor)
+
+        # `factors[i]` is the factor from `starts[i - 1]` up to `starts[i]`, so
+        # `bisect_right(starts, x)` is the position of the factor of x.
+        self.starts = tuple(starts)
+        self.factors = tuple(factors)
+        self.identity = identity
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def factor_at(self, value: int) -> float:
+        return self.factors[bisect_right(self.starts, value)]
+
+    def factors_many(self, values: "np.ndarray") -> "np.ndarray":
+        """Vectorized `factor_at`, returns a float64 array."""
+        import numpy as np
+
+        positions = np.searchsorted(np.array(self.starts, dtype=np.int64), values, side='right')
+        return np.array(self.factors, dtype=np.float64)[positions]
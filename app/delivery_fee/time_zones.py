@@ -0,0 +1,111 @@
+"""
+This module turns UTC times into the local wall clock time of a timezone
+without any timezone objects per order. The UTC offsets of a zone, and the
+UTC times at which they change (daylight saving time and rule changes), are
+read from the timezone database once, into a sorted table which is kept for
+the life of the process. The local time of an order is then a bisect over the
+table plus an integer addition.
+
+Times are counted in microseconds since the start of the proleptic Gregorian
+calendar, like `time_index.calendar_microsecond`.
+"""
+from bisect import bisect_right
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from app.delivery_fee.time_index import MICROSECONDS_IN_DAY
+
+if TYPE_CHECKING:
+    # NumPy is imported only when the vectorized methods are used.
+    import numpy as np
+
+
+UTC = "UTC"
+# The transitions of the offsets are read for these years. Before and after
+# them the first and the last offset of the table are used.
+FIRST_YEAR = 1970
+LAST_YEAR = 2100
+
+# The timezone database is sampled once a day, then every change between
+# two samples is narrowed down to the second.
+_SAMPLE_STEP_SECONDS = 24 * 60 * 60
+_EPOCH_CALENDAR_MICROSECOND = datetime(1970, 1, 1).toordinal() * MICROSECONDS_IN_DAY
+
+
+class ZoneOffsets:
+    """The UTC offsets of a timezone in microseconds. `offsets[i]` is the
+    offset from `transitions[i - 1]` up to `transitions[i]` (UTC calendar
+    microseconds), so `bisect_right(transitions, x)` is the position of the
+    offset at x."""
+
+    def __init__(self, name: str) -> None:
+        try:
+            zone = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"{name!r} is not a timezone name") from None
+        self.name = name
+
+        def offset_at(second: int) -> int:
+            return int(datetime.fromtimestamp(second, zone).utcoffset().total_seconds())
+
+        first_second = _unix_second(FIRST_YEAR)
+        transitions: list[int] = []
+        offsets = [offset_at(first_second)]
+        previous_second = first_second
+        for second in range(first_second + _SAMPLE_STEP_SECONDS, _unix_second(LAST_YEAR + 1),
+                            _SAMPLE_STEP_SECONDS):
+            while offset_at(second) != offsets[-1]:
+                # First second after the previous one with another offset.
+                low, high = previous_second, second
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if offset_at(middle) == offsets[-1]:
+                        low = middle
+                    else:
+                        high = middle
+                transitions.append(_calendar_microsecond_of_unix_second(high))
+                offsets.append(offset_at(high))
+                previous_second = high
+            previous_second = second
+
+        self.transitions = tuple(transitions)
+        self.offsets = tuple(offset * 1_000_000 for offset in offsets)
+
+    def __len__(self) -> int:
+        return len(self.transitions)
+
+    @property
+    def is_fixed(self) -> bool:
+        """True if the zone has had the same offset all along."""
+        return not self.transitions
+
+    def offset_at(self, utc_calendar_microsecond: int) -> int:
+        return self.offsets[bisect_right(self.transitions, utc_calendar_microsecond)]
+
+    def local_calendar_microsecond(self, utc_calendar_microsecond: int) -> int:
+        return utc_calendar_microsecond + self.offset_at(utc_calendar_microsecond)
+
+    def local_calendar_microsecond_many(self, utc_calendar_microseconds: "np.ndarray"
+                                        ) -> "np.ndarray":
+        """Vectorized `local_calendar_microsecond`, returns an int64 array."""
+        import numpy as np
+
+        positions = np.searchsorted(np.array(self.transitions, dtype=np.int64),
+                                    utc_calendar_microseconds, side='right')
+        return utc_calendar_microseconds + np.array(self.offsets, dtype=np.int64)[positions]
+
+
+@lru_cache(maxsize=None)
+def zone_offsets(name: str) -> ZoneOffsets:
+    """The offset table of the timezone, read only once per process. Raises
+    `ValueError` if the timezone does not exist."""
+    return ZoneOffsets(name)
+
+
+def _unix_second(year: int) -> int:
+    return int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def _calendar_microsecond_of_unix_second(second: int) -> int:
+    return _EPOCH_CALENDAR_MICROSECOND + second * 1_000_000
@@ -20,6 +20,12 @@ class ThreadSafeSingletonMeta(type):
         Possible changes to the value of the `__init__` argument do not affect
         the returned instance.
         """
+        # Once the instance exists it is never replaced (except by
+        # `clear_singleton_instance` in tests), so it is returned without the lock.
+        instance = cls._instances.get(cls)
+        if instance is not None:
+            return instance
+
         # Now, imagine that the program has just been launched. Since there's no
         # Singleton instance yet, multiple threads can simultaneously pass the
         # previous conditional and reach this point almost at the same time. The
@@ -1,33 +1,116 @@
-import uvicorn
-from fastapi import FastAPI, APIRouter
-from fastapi.responses import RedirectResponse
-from app.delivery_fee.router import delivery_fee_router
+from contextlib import asynccontextmanager
 from http import HTTPStatus
+from typing import AsyncIterator, TYPE_CHECKING
+from app import config
 
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+    from starlette.applications import Starlette
 
-app = FastAPI()
-# Namespace all the routes under /api
-api_root = APIRouter(prefix="/api")
 
+@asynccontextmanager
+async def lifespan(app: "Starlette") -> AsyncIterator[None]:
+    """Watches the pricing configuration file while the app is running, if the
+    app is configured with one (see `app.delivery_fee.pricing_config`)."""
+    if config.PRICING_CONFIG is None or not config.PRICING_CONFIG_WATCH:
+        yield
+        return
 
-# Include the delivery_fee_router under /api/delivery
-api_root.include_router(delivery_fee_router, prefix="/delivery")
+    from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+    from app.delivery_fee.pricing_config import PricingConfigWatcher
 
+    watcher = PricingConfigWatcher(config.PRICING_CONFIG, DELIVERY_FEE_CALCULATOR)
+    watcher.start()
+    try:
+        yield
+    finally:
+        watcher.stop()
 
-# include the root router
-app.include_router(api_root)
 
+def create_app(quote_fast_path: bool = config.QUOTE_FAST_PATH,
+               server_timing: bool = config.SERVER_TIMING) -> "FastAPI":
+    from fastapi import FastAPI, APIRouter
+    from fastapi.responses import RedirectResponse
+    from app.delivery_fee.router import create_delivery_fee_router
 
-# Redirect requests on root page to /docs page since there is
-# nothing to see on the root page
-@app.get("/")
-async def redirect_to_docs():
-    return RedirectResponse(url="/docs", status_code=HTTPStatus.PERMANENT_REDIRECT)
+    delivery_fee_router = create_delivery_fee_router(quote_fast_path, server_timing)
+
+    app = FastAPI(lifespan=lifespan)
+    # Namespace all the routes under /api
+    api_root = APIRouter(prefix="/api")
+
+    # Include the delivery_fee_router under /api/delivery
+    api_root.include_router(delivery_fee_router, prefix="/delivery")
+
+    # include the root router
+    app.include_router(api_root)
+
+    # Redirect requests on root page to /docs page since there is
+    # nothing to see on the root page
+    @app.get("/")
+    async def redirect_to_docs():
+        return RedirectResponse(url="/docs", status_code=HTTPStatus.PERMANENT_REDIRECT)
+
+    if config.METRICS:
+        add_metrics(app)
+    return app
+
+
+def create_lean_app(server_timing: bool = config.SERVER_TIMING) -> "Starlette":
+    """Same delivery fee routes as `create_app` but without FastAPI, so there
+    are no docs. Starts several times faster than the FastAPI app."""
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from app.delivery_fee.raw_endpoints import create_delivery_fee_routes
+
+    app = Starlette(routes=[Mount("/api/delivery",
+                                  routes=create_delivery_fee_routes(server_timing))],
+                    lifespan=lifespan)
+    if config.METRICS:
+        add_metrics(app)
+    return app
+
+
+def add_metrics(app: "Starlette") -> None:
+    """Serves the metrics of `app.metrics` at /metrics and records the requests
+    to the delivery fee routes."""
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+    from app.delivery_fee.raw_endpoints import create_delivery_fee_routes
+    from app.metrics import (PROMETHEUS_CONTENT_TYPE, REQUEST_METRICS, RequestMetricsMiddleware,
+                             render_metrics)
+
+    async def metrics(request: Request) -> Response:
+        return Response(render_metrics(REQUEST_METRICS, DELIVERY_FEE_CALCULATOR.stage_metrics),
+                        headers={"content-type": PROMETHEUS_CONTENT_TYPE})
+
+    app.add_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+    app.add_middleware(RequestMetricsMiddleware, request_metrics=REQUEST_METRICS,
+                       paths=["/api/delivery" + route.path
+                              for route in create_delivery_fee_routes()])
+
+
+app = create_lean_app() if config.STARTUP_MODE == "lean" else create_app()
 
 
 def run():
+    # uvicorn is not needed when the app is served by another server or tested.
+    import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
 
 
+def price_orders():
+    # Offline pricing of Parquet, Arrow IPC and CSV order files, see `app.batch_pricing`.
+    from app.batch_pricing import main
+    main()
+
+
+def price_orders_in_parallel():
+    # Sharded, resumable pricing of order files in worker processes, see `app.batch_runner`.
+    from app.batch_runner import main
+    main()
+
+
 if __name__ == "__main__":
     run()
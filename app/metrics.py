@@ -0,0 +1,271 @@
+"""
+In-process metrics of the app in the Prometheus text format, served at /metrics.
+
+- Request count and latency histograms of the delivery fee routes, recorded by
+  `RequestMetricsMiddleware`.
+- Calls and time of every calculation step and transformer of the delivery fee
+  calculator (see `StageMetrics`).
+
+The metrics are always on, so recording them has to be cheap. Every thread
+counts into its own counters, without locks, and the counters of all the
+threads are only summed up when the metrics are read. The time of the steps and
+transformers is measured only for every `sample_every`-th calculation, as the
+calculation itself takes about as long as reading the clock a few times.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Generic, Iterable, TypeVar
+
+
+# Upper bounds of the latency histogram buckets in seconds.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+T = TypeVar("T")
+
+
+class _ThreadValue(threading.local):
+    # `threading.local` calls `__init__` in every thread which uses the object,
+    # with the same arguments, so every thread creates its own value.
+    def __init__(self, factory: Callable[[], object], values: list,
+                 lock: threading.Lock) -> None:
+        self.value = factory()
+        with lock:
+            values.append(self.value)
+
+
+class PerThread(Generic[T]):
+    """A value per thread, created by `factory` when a thread first uses it. The
+    values of the threads which have ended are kept, so nothing is lost.
+
+    `local.value` is the value of the current thread. It is an attribute rather
+    than a method, because a method call would cost more than the counting."""
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        self._values: list[T] = []
+        self._lock = threading.Lock()
+        self.local = _ThreadValue(factory, self._values, self._lock)
+
+    def all(self) -> list[T]:
+        with self._lock:
+            return list(self._values)
+
+
+class LatencyHistogram:
+    """Histogram of durations in seconds with the `LATENCY_BUCKETS` buckets.
+    Every thread has its own bucket counts: [count of bucket 0, ..., count of
+    the +Inf bucket, sum of the durations]."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self._counts: PerThread[list[float]] = PerThread(lambda: [0] * (len(buckets) + 2))
+
+    def observe(self, seconds: float) -> None:
+        counts = self._counts.local.value
+        counts[bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def snapshot(self) -> tuple[list[int], int, float]:
+        """Returns the cumulative bucket counts (the last one is +Inf), the
+        count and the sum of all the observed durations."""
+        totals = [0] * (len(self.buckets) + 2)
+        for counts in self._counts.all():
+            for index, value in enumerate(counts):
+                totals[index] += value
+        cumulative_counts = []
+        count = 0
+        for bucket_count in totals[:-1]:
+            count += bucket_count
+            cumulative_counts.append(count)
+        return cumulative_counts, count, totals[-1]
+
+
+class RequestMetrics:
+    """Latency histograms of the requests by method, path and status code."""
+
+    def __init__(self) -> None:
+        self._histograms: dict[tuple[str, str, int], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, path: str, status: int, seconds: float) -> None:
+        key = (method, path, status)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        histogram.observe(seconds)
+
+    def render(self) -> list[str]:
+        lines = [
+            "# HELP delivery_fee_http_requests_total Requests to the delivery fee routes.",
+            "# TYPE delivery_fee_http_requests_total counter",
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        snapshots = [(_labels(method=method, path=path, status=status), histogram.snapshot())
+                     for (method, path, status), histogram in histograms]
+        for labels, (_, count, _) in snapshots:
+            lines.append(f"delivery_fee_http_requests_total{{{labels}}} {count}")
+
+        lines += [
+            "# HELP delivery_fee_http_request_duration_seconds Latency of the requests to "
+            "the delivery fee routes, until the whole response is sent.",
+            "# TYPE delivery_fee_http_request_duration_seconds histogram",
+        ]
+        for labels, (cumulative_counts, count, total) in snapshots:
+            for bound, bucket_count in zip((*LATENCY_BUCKETS, "+Inf"), cumulative_counts):
+                lines.append(f"delivery_fee_http_request_duration_seconds_bucket"
+                             f"{{{labels},le=\"{bound}\"}} {bucket_count}")
+            lines.append(f"delivery_fee_http_request_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"delivery_fee_http_request_duration_seconds_count{{{labels}}} {count}")
+        return lines
+
+
+class StageMetrics:
+    """Calls and time of the calculation steps and transformers (the stages) of
+    a calculator. Every stage runs once in every calculation, so the calls are
+    counted once per calculation. The time is measured for every
+    `sample_every`-th calculation of each thread."""
+
+    def __init__(self, stages: Iterable[tuple[str, str]], sample_every: int) -> None:
+        """`stages` are the (kind, name) pairs of the stages in the order they run."""
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be at least 1, got {sample_every}")
+        self.stages = _unique_names(list(stages))
+        self.sample_every = sample_every
+        # [calculations, timed calculations, seconds of stage 0, seconds of stage 1, ...]
+        self._counts: PerThread[list[float]] = PerThread(lambda: [0] * (len(self.stages) + 2))
+
+    def count_calculation(self) -> bool:
+        """Counts a calculation and returns True if it should be timed with
+        `record_timed_calculation`."""
+        counts = self._counts.local.value
+        counts[0] += 1
+        return counts[0] % self.sample_every == 0
+
+    def record_timed_calculation(self, stage_seconds: list[float]) -> None:
+        counts = self._counts.local.value
+        counts[1] += 1
+        for index, seconds in enumerate(stage_seconds, start=2):
+            counts[index] += seconds
+
+    def totals(self) -> tuple[int, int, list[float]]:
+        """Returns the calculations, timed calculations and the seconds of every
+        stage in the timed calculations."""
+        totals = [0] * (len(self.stages) + 2)
+        for counts in self._counts.all():
+            for index, value in enumerate(counts):
+                totals[index] += value
+        return totals[0], totals[1], totals[2:]
+
+    def render(self) -> list[str]:
+        calculations, timed_calculations, stage_seconds = self.totals()
+        labels = [_labels(kind=kind, stage=name) for kind, name in self.stages]
+        lines = [
+            "# HELP delivery_fee_stage_calls_total Calls of the calculation step or "
+            "transformer.",
+            "# TYPE delivery_fee_stage_calls_total counter",
+            *(f"delivery_fee_stage_calls_total{{{label}}} {calculations}" for label in labels),
+            "# HELP delivery_fee_stage_timed_calls_total Calls of the calculation step or "
+            f"transformer whose time was measured, one in every {self.sample_every} calls.",
+            "# TYPE delivery_fee_stage_timed_calls_total counter",
+            *(f"delivery_fee_stage_timed_calls_total{{{label}}} {timed_calculations}"
+              for label in labels),
+            "# HELP delivery_fee_stage_seconds_total Time spent in the calculation step or "
+            "transformer in the timed calls.",
+            "# TYPE delivery_fee_stage_seconds_total counter",
+        ]
+        lines += [f"delivery_fee_stage_seconds_total{{{label}}} {seconds}"
+                  for label, seconds in zip(labels, stage_seconds)]
+        return lines
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware which records the latency of the requests to the given
+    route paths into `request_metrics`. The requests are recorded by the route
+    path, with path parameters like "/cities/{city}/" matching one segment of
+    the path, so that requests to made up paths or cities can't add new series
+    to the metrics. The latency is measured until the last part of the response
+    body is sent."""
+
+    def __init__(self, app: Callable, request_metrics: RequestMetrics,
+                 paths: Iterable[str]) -> None:
+        self.app = app
+        self.request_metrics = request_metrics
+        paths = list(paths)
+        # Paths without parameters are looked up as they are, the others matched.
+        self.paths = frozenset(path for path in paths if not _PATH_PARAMETER.search(path))
+        self.path_patterns = [(_path_pattern(path), path) for path in paths
+                              if _PATH_PARAMETER.search(path)]
+
+    def route_path(self, path: str) -> str | None:
+        """The route path of a request path, or None if it is not recorded."""
+        if path in self.paths:
+            return path
+        for pattern, route_path in self.path_patterns:
+            if pattern.fullmatch(path):
+                return route_path
+        return None
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        route_path = self.route_path(scope["path"]) if scope["type"] == "http" else None
+        if route_path is None:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_and_record(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            self.request_metrics.observe(scope["method"], route_path, status,
+                                         time.perf_counter() - started)
+
+
+def render_metrics(request_metrics: RequestMetrics,
+                   stage_metrics: StageMetrics | None) -> str:
+    lines = request_metrics.render()
+    if stage_metrics is not None:
+        lines += stage_metrics.render()
+    return "\n".join(lines) + "\n"
+
+
+_PATH_PARAMETER = re.compile(r"\{[^}]*\}")
+
+
+def _path_pattern(path: str) -> re.Pattern:
+    return re.compile("[^/]+".join(map(re.escape, _PATH_PARAMETER.split(path))))
+
+
+def _labels(**labels: object) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _unique_names(stages: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    # The same step or transformer class can be configured more than once.
+    unique_stages = []
+    for kind, name in stages:
+        unique_name, number = name, 1
+        while (kind, unique_name) in unique_stages:
+            number += 1
+            unique_name = f"{name}#{number}"
+        unique_stages.append((kind, unique_name))
+    return unique_stages
+
+
+# Requests of all the apps of the process.
+REQUEST_METRICS = RequestMetrics()
@@ -0,0 +1,131 @@
+import random
+import pytest
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.fee_calculation_steps import (
+    CartValueFee,
+    DeliveryDistanceFee,
+    DeliveryFeeCalculationStep,
+    FeeBand,
+    NumberOfItemsFee,
+    TieredFee,
+)
+from app.delivery_fee.models import OrderRecord
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee.pipeline_compiler import compile_pipeline
+from app.delivery_fee.pricing_config import parse_pricing_config
+from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(2000, seed=21)
+
+# `DeliveryDistanceFee` and `NumberOfItemsFee` with the options of the settings.
+DISTANCE_TIERS = TieredFee(TieredFee.ConfigOptions(order_field="delivery_distance", bands=[
+    FeeBand(above=0, base_fee=200),
+    FeeBand(above=1000, base_fee=200, fee_per_unit=100, unit=500),
+]))
+NUMBER_OF_ITEMS_TIERS = TieredFee(TieredFee.ConfigOptions(order_field="number_of_items", bands=[
+    FeeBand(above=4, fee_per_unit=50),
+    FeeBand(above=12, base_fee=8 * 50 + 120, fee_per_unit=50),
+]))
+
+# Hundreds of distance bands, too many for the precomputed table.
+rng = random.Random(21)
+MANY_TIERS = TieredFee(TieredFee.ConfigOptions(order_field="delivery_distance", bands=[
+    FeeBand(above=above, base_fee=rng.randrange(1000), fee_per_unit=rng.randrange(100),
+            unit=rng.randrange(1, 1000))
+    for above in sorted(rng.sample(range(-1, 100_000), 500))]))
+
+
+def orders_with(order_field: str, values: range) -> list[OrderRecord]:
+    order = OrderRecord(cart_value=0, delivery_distance=0, number_of_items=0,
+                        time=ORDER_INFOS[0].time)
+    return [order._replace(**{order_field: value}) for value in values]
+
+
+def fees_every_way(step: DeliveryFeeCalculationStep, orders: list[OrderRecord]) -> list[list]:
+    compiled_pipeline = compile_pipeline([step], [])
+    order_columns = OrderInfoColumns.from_arrays(*zip(*orders))
+    return [
+        [step.calculate_fee(order) for order in orders],
+        [compiled_pipeline(*order) for order in orders],
+        step.calculate_many(order_columns).tolist(),
+    ]
+
+
+@pytest.mark.parametrize("tiered_fee, step, order_field, values", [
+    (DISTANCE_TIERS, DeliveryDistanceFee(settings.DELIVERY_DISTANCE_CONFIG_OPTIONS),
+     "delivery_distance", range(0, 20_000)),
+    (NUMBER_OF_ITEMS_TIERS, NumberOfItemsFee(settings.NUMBER_OF_ITEMS_CONFIG_OPTIONS),
+     "number_of_items", range(0, 500)),
+])
+def test__existing_steps_are_tiered_fees(tiered_fee: TieredFee, step: DeliveryFeeCalculationStep,
+                                         order_field: str, values: range):
+    orders = orders_with(order_field, values)
+    expected_fees = [step.calculate_fee(order) for order in orders]
+
+    for fees in fees_every_way(tiered_fee, orders):
+        assert fees == expected_fees
+
+
+def test__many_bands_are_looked_up_by_binary_search():
+    assert "bisect_left" in "\n".join(MANY_TIERS.compiled_source())
+    orders = orders_with("delivery_distance", range(0, 110_000, 7))
+
+    scalar_fees, compiled_fees, vectorized_fees = fees_every_way(MANY_TIERS, orders)
+    assert compiled_fees == scalar_fees and vectorized_fees == scalar_fees
+    # Spot check against a linear scan over the bands.
+    for order, fee in list(zip(orders, scalar_fees))[::100]:
+        bands = [band for band in MANY_TIERS.config_options.bands
+                 if band.above < order.delivery_distance]
+        assert fee == (0 if not bands else bands[-1].base_fee + -(
+            (bands[-1].above - order.delivery_distance) // bands[-1].unit) *
+            bands[-1].fee_per_unit)
+
+
+def test__values_at_or_below_the_first_band_have_no_fee():
+    step = TieredFee(TieredFee.ConfigOptions(order_field="cart_value",
+                                             bands=[FeeBand(above=500, base_fee=100)]))
+    assert fees_every_way(step, orders_with("cart_value", range(499, 503))) == [
+        [0, 0, 100, 100]] * 3
+    assert fees_every_way(TieredFee(), orders_with("cart_value", range(3))) == [[0, 0, 0]] * 3
+
+
+@pytest.mark.parametrize("bands, message", [
+    ([FeeBand(above=10), FeeBand(above=10)], "must be sorted"),
+    ([FeeBand(above=10), FeeBand(above=5)], "must be sorted"),
+    ([FeeBand(above=10, unit=0)], "unit of at least 1"),
+    ([FeeBand(above=10, fee_per_unit=-1)], "non-negative fees"),
+])
+def test__invalid_bands_are_rejected(bands: list[FeeBand], message: str):
+    with pytest.raises(ValueError, match=message):
+        TieredFee(TieredFee.ConfigOptions(bands=bands))
+
+
+def test__calculator_with_tiered_fees_matches_the_settings():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    try:
+        calculator = DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS,
+                                           settings.ALL_FEE_TRANSFORMERS)
+        expected_fees = calculator.calculate_fees(ORDER_INFOS)
+
+        calculator.calculation_steps = [CartValueFee(settings.CART_VALUE_CONFIG_OPTIONS),
+                                        DISTANCE_TIERS, NUMBER_OF_ITEMS_TIERS]
+        assert calculator.pipeline.compiled_pipeline is not None
+        assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+        calculator.enable_cache(1000)
+        assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+    finally:
+        DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def test__tiered_fee_in_pricing_config():
+    pricing_config = parse_pricing_config({
+        "calculation_steps": [{"type": "TieredFee", "options": {
+            "order_field": "delivery_distance",
+            "bands": [{"above": 0, "base_fee": 200},
+                      {"above": 1000, "base_fee": 200, "fee_per_unit": 100, "unit": 500}]}}],
+        "transformers": [],
+    })
+    [step] = pricing_config.calculation_steps
+    assert step.config_options == DISTANCE_TIERS.config_options
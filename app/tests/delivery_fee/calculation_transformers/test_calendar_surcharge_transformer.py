@@ -0,0 +1,183 @@
+import random
+from datetime import datetime, time, timedelta
+import numpy as np
+import pytest
+from app.delivery_fee.fee_calculation_steps import CartValueFee
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.fee_transformers import (
+    CalendarSurchargeTransformer,
+    DatedSurchargeWindow,
+    LimitFeeTransformer,
+    RushHourFeeTransformer,
+    WeeklySurchargeWindow,
+)
+from app.delivery_fee.models import OrderInfo
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee.pipeline_compiler import compile_pipeline
+from app.delivery_fee.pricing_config import parse_pricing_config
+from app.delivery_fee.time_index import WEEKDAY_NAMES
+from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(2000, seed=22)
+ORDER_COLUMNS = OrderInfoColumns.from_arrays(
+    [order_info.cart_value for order_info in ORDER_INFOS],
+    [order_info.delivery_distance for order_info in ORDER_INFOS],
+    [order_info.number_of_items for order_info in ORDER_INFOS],
+    [order_info.time for order_info in ORDER_INFOS])
+
+WEEKEND_EVENINGS = tuple(
+    WeeklySurchargeWindow(day=day, start=time(18), end=time(21, 59, 59, 999999), factor=1.1)
+    for day in ("Saturday", "Sunday"))
+CHRISTMAS = DatedSurchargeWindow(start=datetime(2024, 12, 24),
+                                 end=datetime(2024, 12, 26, 23, 59, 59, 999999), factor=1.5)
+
+
+def calendar(overlap: str = "max", weekly_windows=(), dated_windows=()
+             ) -> CalendarSurchargeTransformer:
+    return CalendarSurchargeTransformer(CalendarSurchargeTransformer.ConfigOptions(
+        weekly_windows=weekly_windows, dated_windows=dated_windows, overlap=overlap))
+
+
+def random_calendar(overlap: str, seed: int) -> CalendarSurchargeTransformer:
+    rng = random.Random(seed)
+    # Some of the weekly windows go past midnight.
+    weekly_windows = [
+        WeeklySurchargeWindow(day=rng.choice(WEEKDAY_NAMES), start=time(hour),
+                              end=time(rng.randrange(24), 59, 59, 999999),
+                              factor=rng.choice([0.5, 1.1, 1.25, 2]))
+        for hour in (rng.randrange(24) for _ in range(100))]
+    dated_windows = [
+        DatedSurchargeWindow(start=start, end=start + timedelta(hours=rng.randrange(1, 72)),
+                             factor=rng.choice([0.8, 1.3, 1.5]))
+        for start in (datetime(2024, 1, 1) + timedelta(hours=rng.randrange(366 * 24))
+                      for _ in range(100))]
+    return calendar(overlap, weekly_windows, dated_windows)
+
+
+@pytest.fixture
+def calculator():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    yield DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS)
+    DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def at(timestamp: str) -> OrderInfo:
+    return OrderInfo(cart_value=0, delivery_distance=0, number_of_items=0, time=timestamp)
+
+
+@pytest.mark.parametrize("timestamp, delivery_fee", [
+    ("2024-01-13T17:59:59.999999Z", 1000),  # Saturday
+    ("2024-01-13T18:00:00Z", 1100),
+    ("2024-01-14T21:59:59.999999Z", 1100),  # Sunday
+    ("2024-01-14T22:00:00Z", 1000),
+    ("2024-01-15T19:00:00Z", 1000),  # Monday
+    ("2024-12-24T00:00:00Z", 1500),  # Tuesday
+    ("2024-12-26T23:59:59.999999Z", 1500),
+    ("2024-12-27T00:00:00Z", 1000),
+    ("2025-12-24T12:00:00Z", 1000),
+])
+def test__weekly_and_dated_windows(timestamp: str, delivery_fee: int):
+    transformer = calendar(weekly_windows=WEEKEND_EVENINGS, dated_windows=[CHRISTMAS])
+    assert transformer.transform_fee(at(timestamp), 1000) == delivery_fee
+
+
+@pytest.mark.parametrize("day, timestamp, delivery_fee", [
+    ("Saturday", "2024-01-13T21:59:59.999999Z", 1000),
+    ("Saturday", "2024-01-13T22:00:00Z", 1200),
+    ("Saturday", "2024-01-14T01:59:59.999999Z", 1200),  # Sunday
+    ("Saturday", "2024-01-14T02:00:00Z", 1000),
+    ("Sunday", "2024-01-14T23:00:00Z", 1200),
+    ("Sunday", "2024-01-15T01:00:00Z", 1200),  # Monday, in the next week
+    ("Sunday", "2024-01-15T02:00:00Z", 1000),
+    ("Sunday", "2024-01-14T01:00:00Z", 1000),
+])
+def test__weekly_window_past_midnight(day: str, timestamp: str, delivery_fee: int):
+    transformer = calendar(weekly_windows=[WeeklySurchargeWindow(
+        day=day, start=time(22), end=time(1, 59, 59, 999999), factor=1.2)])
+    assert transformer.transform_fee(at(timestamp), 1000) == delivery_fee
+    # Same in the compiled and vectorized forms.
+    compiled_pipeline = compile_pipeline([CartValueFee()], [transformer])
+    assert compiled_pipeline(0, 0, 0, at(timestamp).time) == delivery_fee
+    order_columns = OrderInfoColumns.from_arrays([0], [0], [0], [timestamp])
+    assert transformer.transform_many(order_columns, np.array([1000])).tolist() == [
+        delivery_fee]
+
+
+@pytest.mark.parametrize("overlap, delivery_fee", [("max", 1500), ("multiply", 1650)])
+def test__overlapping_windows_are_combined_by_the_overlap_rule(overlap: str, delivery_fee: int):
+    # Christmas day 2022 was a Sunday.
+    transformer = calendar(overlap, WEEKEND_EVENINGS, [CHRISTMAS.model_copy(update={
+        "start": datetime(2022, 12, 24), "end": datetime(2022, 12, 26)})])
+    assert transformer.factor_at(datetime(2022, 12, 25, 19)) == pytest.approx(
+        delivery_fee / 1000)
+    assert transformer.transform_fee(at("2022-12-25T19:00:00Z"), 1000) == delivery_fee
+
+
+def test__without_windows_nothing_changes():
+    transformer = calendar()
+    assert transformer.compiled_source() == [] and transformer.cache_key_source() == []
+    assert transformer.transform_fee(ORDER_INFOS[0], 1234) == 1234
+
+
+def test__single_weekly_window_is_the_rush_hour(calculator: DeliveryFeeCalculator):
+    expected_fees = calculator.calculate_fees(ORDER_INFOS)
+    rush_hour = settings.FRIDAY_RUSH_HOUR_CONFIG_OPTIONS
+    calculator.transformers = [
+        calendar(weekly_windows=[WeeklySurchargeWindow(
+            day=rush_hour.rush_day, start=rush_hour.rush_hour_start,
+            end=rush_hour.rush_hour_end, factor=rush_hour.rush_hour_fee_factor)]),
+        *settings.ALL_FEE_TRANSFORMERS[1:]]
+
+    assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+
+
+@pytest.mark.parametrize("overlap", ["max", "multiply"])
+def test__compiled_and_vectorized_match_the_scalar_transformer(
+        calculator: DeliveryFeeCalculator, overlap: str):
+    # Without the limit, so that the surcharges are not hidden by it.
+    calculator.transformers = [random_calendar(overlap, seed=22), RushHourFeeTransformer()]
+    assert calculator.pipeline.compiled_pipeline is not None
+
+    expected_fees = [calculator._calculate_step_by_step(order_info)
+                     for order_info in ORDER_INFOS]
+    assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+    assert calculator.calculate_columns(ORDER_COLUMNS).tolist() == expected_fees
+    calculator.enable_cache(500)
+    assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+    assert len(set(expected_fees)) > 100
+
+
+@pytest.mark.parametrize("window, message", [
+    (WeeklySurchargeWindow(day="Caturday", start=time(18), end=time(20), factor=1.1),
+     "not a weekday name"),
+    (WeeklySurchargeWindow(day="Friday", start=time(18), end=time(20), factor=-1),
+     "must be non-negative"),
+    (DatedSurchargeWindow(start=datetime(2024, 1, 1), end=datetime(2024, 1, 2),
+                          factor=float("inf")), "must be non-negative"),
+    (DatedSurchargeWindow(start=datetime(2024, 1, 2), end=datetime(2024, 1, 1, 23),
+                          factor=1.5), "end of a window must not be before its start"),
+])
+def test__invalid_windows_are_rejected(window, message: str):
+    with pytest.raises(ValueError, match=message):
+        if isinstance(window, WeeklySurchargeWindow):
+            calendar(weekly_windows=[window])
+        else:
+            calendar(dated_windows=[window])
+
+
+def test__calendar_in_pricing_config():
+    pricing_config = parse_pricing_config({
+        "calculation_steps": [],
+        "transformers": [{"type": "CalendarSurchargeTransformer", "options": {
+            "overlap": "multiply",
+            "weekly_windows": [{"day": "Saturday", "start": "18:00",
+                                "end": "21:59:59.999999", "factor": 1.1}],
+            "dated_windows": [{"start": "2024-12-24T00:00:00", "end": "2024-12-26T23:59:59.999999",
+                               "factor": 1.5}]}}, {"type": "LimitFeeTransformer"}],
+    })
+    [transformer, limit] = pricing_config.transformers
+    assert isinstance(limit, LimitFeeTransformer)
+    assert transformer.config_options == calendar(
+        "multiply", WEEKEND_EVENINGS[:1], [CHRISTMAS]).config_options
@@ -1,9 +1,13 @@
+from datetime import time, timedelta, timezone
 import pytest
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
 from app.delivery_fee.models import DeliveryFee, OrderInfo
 from app.delivery_fee.fee_transformers import (
     RushHourFeeTransformer,
 )
+from app.delivery_fee.order_columns import OrderInfoColumns
 from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
 
 
 @pytest.fixture
@@ -147,3 +151,109 @@ def test__friday_rush_hour_fee_transformer__no_surcharge_applied_for_rush_hour_a
     # Delivery time is Friday and start of rush hour is at 3:00:00 PM,
     # so surcharge should be applied.
     assert delivery_fee == expected_fee
+
+
+def helsinki_rush_hour(**options) -> RushHourFeeTransformer:
+    return RushHourFeeTransformer(settings.FRIDAY_RUSH_HOUR_CONFIG_OPTIONS.model_copy(
+        update={"timezone": "Europe/Helsinki", **options}))
+
+
+@pytest.mark.parametrize("order_time, delivery_fee", [
+    ("2024-01-26T12:59:59.999999Z", 300),  # Friday 14:59 in Helsinki (UTC+2)
+    ("2024-01-26T13:00:00Z", 360),
+    ("2024-01-26T17:59:59.999999Z", 360),
+    ("2024-01-26T18:00:00Z", 300),
+    ("2024-06-07T12:00:00Z", 360),  # Friday 15:00 in Helsinki (UTC+3)
+    ("2024-06-07T17:00:00Z", 300),
+    ("2024-06-07T16:59:59.999999Z", 360),
+])
+def test__friday_rush_hour_fee_transformer__rush_hour_in_local_time(order_time: str,
+                                                                   delivery_fee: int):
+    order_info = OrderInfo(cart_value=0, delivery_distance=0, number_of_items=0,
+                           time=order_time)
+
+    # The rush hour is 3 - 8 PM in Helsinki, also across daylight saving time.
+    assert helsinki_rush_hour().transform_fee(order_info, 300) == delivery_fee
+
+
+def test__friday_rush_hour_fee_transformer__local_time_matches_every_way():
+    order_infos = random_order_infos(3000, seed=23)
+    order_columns = OrderInfoColumns.from_arrays(*zip(*(
+        (order_info.cart_value, order_info.delivery_distance, order_info.number_of_items,
+         order_info.time) for order_info in order_infos)))
+    # Monday from midnight in Helsinki is still Sunday in UTC, and Sunday
+    # evening in New York is already Monday in UTC.
+    transformers = [helsinki_rush_hour(rush_day="Monday", rush_hour_start=time(0),
+                                       rush_hour_end=time(4, 59, 59, 999999)),
+                    helsinki_rush_hour(rush_day="Sunday", rush_hour_start=time(20),
+                                       rush_hour_end=time(23, 59, 59, 999999),
+                                       timezone="America/New_York"),
+                    helsinki_rush_hour(timezone="Asia/Kolkata")]
+
+    DeliveryFeeCalculator.clear_singleton_instance()
+    try:
+        calculator = DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS, transformers)
+        assert calculator.pipeline.compiled_pipeline is not None
+
+        expected_fees = [calculator._calculate_step_by_step(order_info)
+                         for order_info in order_infos]
+        assert calculator.calculate_fees(order_infos) == expected_fees
+        assert calculator.calculate_columns(order_columns).tolist() == expected_fees
+        calculator.enable_cache(1000)
+        assert calculator.calculate_fees(order_infos) == expected_fees
+
+        # Some orders were in the rush hours and some not.
+        calculator.transformers = []
+        assert expected_fees != calculator.calculate_fees(order_infos)
+    finally:
+        DeliveryFeeCalculator.clear_singleton_instance()
+
+
+@pytest.mark.parametrize("order_time", [
+    "2024-01-26T17:30:00Z", "2024-01-26T20:30:00+03:00", "2024-01-26T12:30:00-05:00",
+    "2024-01-27T03:00:00+09:30",
+])
+def test__friday_rush_hour_fee_transformer__local_time_of_the_same_instant(order_time: str):
+    order_info = OrderInfo(cart_value=0, delivery_distance=0, number_of_items=0,
+                           time=order_time)
+
+    # Friday 19:30 in Helsinki, however the order time is written.
+    assert helsinki_rush_hour().transform_fee(order_info, 300) == 360
+
+
+def test__friday_rush_hour_fee_transformer__local_time_with_utc_offsets_matches_every_way():
+    utc_order_infos = random_order_infos(3000, seed=24)
+    offsets = [timedelta(hours=3), timedelta(hours=-5), timedelta(hours=5, minutes=30),
+               timedelta(hours=-11), timedelta(0)]
+    order_infos = [order_info.model_copy(update={"time": order_info.time.astimezone(
+        timezone(offsets[index % len(offsets)]))})
+        for index, order_info in enumerate(utc_order_infos)]
+    order_columns = OrderInfoColumns.from_arrays(*zip(*(
+        (order_info.cart_value, order_info.delivery_distance, order_info.number_of_items,
+         order_info.time.isoformat()) for order_info in order_infos)))
+    transformers = [helsinki_rush_hour(rush_day="Monday", rush_hour_start=time(0),
+                                       rush_hour_end=time(4, 59, 59, 999999)),
+                    helsinki_rush_hour(timezone="America/New_York")]
+
+    DeliveryFeeCalculator.clear_singleton_instance()
+    try:
+        calculator = DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS, transformers)
+        # The same instants in UTC have the same fees.
+        expected_fees = [calculator._calculate_step_by_step(order_info)
+                         for order_info in utc_order_infos]
+        assert [calculator._calculate_step_by_step(order_info)
+                for order_info in order_infos] == expected_fees
+        assert calculator.calculate_fees(order_infos) == expected_fees
+        assert calculator.calculate_columns(order_columns).tolist() == expected_fees
+        assert [calculator.calculate_fee(order_columns.order_record(index))
+                for index in range(len(order_columns))] == expected_fees
+        calculator.enable_cache(1000)
+        assert calculator.calculate_fees([*order_infos, *utc_order_infos]) == \
+            expected_fees * 2
+    finally:
+        DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def test__friday_rush_hour_fee_transformer__unknown_timezone():
+    with pytest.raises(ValueError, match="is not a timezone name"):
+        helsinki_rush_hour(timezone="Europe/Atlantis")
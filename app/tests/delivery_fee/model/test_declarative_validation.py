@@ -0,0 +1,117 @@
+import json
+import pytest
+from datetime import datetime
+from pydantic import ValidationError
+from app.delivery_fee.models import OrderInfo, DeliveryFee
+
+
+ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4}
+TIME_ERROR_MESSAGE = 'Value error, time must be in UTC ISO format (e.g. 2024-01-15T13:00:00Z)'
+
+time_strings = [
+    # RFC 3339, parsed by pydantic-core
+    "2024-01-15T13:00:00Z", "2024-01-15T13:00:00+00:00", "2024-01-15T13:00:00",
+    "2024-01-15T13:00:00.5Z", "2024-01-15T13:00:00.123456+02:30",
+    "2024-01-15T23:59:59-23:59", "2024-02-29T00:00:00Z",
+    # Other ISO formats, parsed by datetime.fromisoformat
+    "2024-01-15", "20240115", "2024-01-15 13:00:00", "2024-01-15T13:00",
+    "2024-01-15T13", "20240115T130000Z", "2024-01-15T13:00:00.1234567Z",
+    "2024-01-15T13:00:00+0200", "2024-01-15T13:00:00+02", "2024-W03-1T13:00:00",
+    "2024-01-15T13:00:00,5Z", "2024-01-15T13:00:00+02:00:30",
+    # Invalid
+    "", "invalid", "2024-13-01T00:00:00Z", "2023-02-29T00:00:00Z",
+    "2024-01-15T24:00:00Z", "2024-01-15T13:60:00Z", "2024-01-15T13:00:60Z",
+    "2024-01-15T13:00:00+24:00", "2024-01-15t13:00:00z", " 2024-01-15T13:00:00Z",
+]
+
+
+def parse_with_fromisoformat(value: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize("time", time_strings)
+def test__time__accepts_the_same_strings_as_fromisoformat(time):
+    expected = parse_with_fromisoformat(time)
+    try:
+        parsed = OrderInfo.model_validate({**ORDER, "time": time}).time
+    except ValidationError as error:
+        assert expected is None
+        [error_details] = error.errors()
+        assert error_details["type"] == "value_error"
+        assert error_details["msg"] == TIME_ERROR_MESSAGE
+        return
+
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+
+
+@pytest.mark.parametrize("time", time_strings)
+def test__time__from_json_is_the_same_as_from_python(time):
+    def validate(validate_function, value):
+        try:
+            return validate_function(value).time
+        except ValidationError as error:
+            return error.errors(include_url=False)
+
+    order = {**ORDER, "time": time}
+    json_order = json.dumps(order)
+    assert validate(OrderInfo.model_validate_json, json_order) == \
+        validate(OrderInfo.model_validate, order)
+
+
+@pytest.mark.parametrize("time", [None, 1705323600, 1705323600.0,
+                                  datetime(2024, 1, 15, 13), b"2024-01-15T13:00:00Z"])
+def test__time__must_be_a_string(time):
+    with pytest.raises(ValidationError) as error:
+        OrderInfo.model_validate({**ORDER, "time": time})
+    [error_details] = error.value.errors()
+    assert error_details["type"] == "value_error"
+    assert error_details["msg"] == TIME_ERROR_MESSAGE
+
+
+@pytest.mark.parametrize("field", ["cart_value", "delivery_distance", "number_of_items"])
+@pytest.mark.parametrize("value", [-1, "-1", -1.0])
+def test__negative_order_values__value_error(field, value):
+    with pytest.raises(ValidationError) as error:
+        OrderInfo.model_validate({**ORDER, "time": "2024-01-15T13:00:00Z", field: value})
+    [error_details] = error.value.errors()
+    assert error_details["type"] == "value_error"
+    assert error_details["loc"] == (field,)
+    assert error_details["msg"] == f"Value error, {field} must be non-negative"
+
+
+@pytest.mark.parametrize("field", ["cart_value", "delivery_distance", "number_of_items"])
+def test__negative_order_values__error_context_is_the_message(field):
+    with pytest.raises(ValidationError) as error:
+        OrderInfo.model_validate_json(json.dumps(
+            {**ORDER, "time": "2024-01-15T13:00:00Z", field: -1}))
+    [error_details] = json.loads(error.value.json())
+    assert error_details["ctx"] == {"error": f"{field} must be non-negative"}
+
+
+@pytest.mark.parametrize("field", ["cart_value", "delivery_distance", "number_of_items"])
+@pytest.mark.parametrize("value", ["5", 5.0])
+def test__order_values__lax_integers_are_accepted(field, value):
+    order_info = OrderInfo.model_validate({**ORDER, "time": "2024-01-15T13:00:00Z", field: value})
+    assert getattr(order_info, field) == 5
+
+
+@pytest.mark.parametrize("field", ["cart_value", "delivery_distance", "number_of_items"])
+@pytest.mark.parametrize("value, error_type", [(100.5, "int_from_float"), ("a", "int_parsing"),
+                                               (None, "int_type"), ([], "int_type")])
+def test__non_integer_order_values__keep_the_int_errors(field, value, error_type):
+    with pytest.raises(ValidationError) as error:
+        OrderInfo.model_validate({**ORDER, "time": "2024-01-15T13:00:00Z", field: value})
+    [error_details] = error.value.errors()
+    assert error_details["type"] == error_type
+
+
+def test__negative_delivery_fee__value_error():
+    with pytest.raises(ValidationError) as error:
+        DeliveryFee(delivery_fee=-1)
+    [error_details] = error.value.errors()
+    assert error_details["type"] == "value_error"
+    assert error_details["msg"] == "Value error, delivery_fee must be non-negative"
@@ -0,0 +1,46 @@
+import pytest
+from dataclasses import replace
+from datetime import datetime, timezone
+from app.delivery_fee.models import OrderInfo, OrderRecord
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, DeliveryFeeCalculator
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(2000, seed=8)
+ORDER_RECORDS = [OrderRecord.from_order_info(order_info) for order_info in ORDER_INFOS]
+
+
+def test__order_record_from_order_info():
+    order_info = OrderInfo(cart_value=790, delivery_distance=2235,
+                           number_of_items=4, time="2024-01-15T13:00:00Z")
+    assert OrderRecord.from_order_info(order_info) == (
+        790, 2235, 4, datetime(2024, 1, 15, 13, tzinfo=timezone.utc))
+
+
+def test__order_record_has_no_instance_dict():
+    with pytest.raises(AttributeError):
+        ORDER_RECORDS[0].extra = 1
+
+
+def test__calculate_fee_with_order_records_matches_calculate():
+    expected = [DELIVERY_FEE_CALCULATOR.calculate(order_info) for order_info in ORDER_INFOS]
+    assert [DELIVERY_FEE_CALCULATOR.calculate_fee(record) for record in ORDER_RECORDS] == expected
+    assert DELIVERY_FEE_CALCULATOR.calculate_fees(ORDER_RECORDS) == expected
+
+
+def test__order_records_step_by_step():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    calculator = DeliveryFeeCalculator()
+    DeliveryFeeCalculator.clear_singleton_instance()
+    calculator._pipeline = replace(calculator.pipeline, compiled_pipeline=None)
+
+    for order_info, record in zip(ORDER_INFOS[:300], ORDER_RECORDS):
+        assert calculator.calculate_fee(record) == calculator.calculate(order_info)
+
+
+def test__order_columns_order_record():
+    order_columns = OrderInfoColumns.from_arrays(
+        [790], [2235], [4], ["2024-01-15T13:00:00Z"])
+    assert order_columns.order_record(0) == OrderRecord(
+        790, 2235, 4, datetime(2024, 1, 15, 13))
@@ -0,0 +1,33 @@
+"""
+Helpers for generating random orders for the tests which compare different
+ways of calculating the delivery fee with each other.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from app.delivery_fee.models import OrderInfo
+from app.delivery_fee import settings as settings
+
+
+def random_order_infos(count: int, seed: int = 2024) -> list[OrderInfo]:
+    rng = random.Random(seed)
+    # Times near the rush hour boundaries are the interesting ones.
+    times_of_day = [timedelta(hours=15), timedelta(hours=20, microseconds=-1),
+                    timedelta(hours=20), timedelta(hours=15, microseconds=-1)]
+    first_day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    order_infos = []
+    for _ in range(count):
+        day = first_day + timedelta(days=rng.randrange(366))
+        if rng.random() < 0.5:
+            time = day + rng.choice(times_of_day)
+        else:
+            time = day + timedelta(microseconds=rng.randrange(24 * 60 * 60 * 10**6))
+        order_infos.append(OrderInfo(
+            cart_value=rng.choice([rng.randrange(1200), rng.randrange(25000),
+                                   settings.CART_VALUE_CONFIG_OPTIONS.cart_value_surcharge_threshold,
+                                   settings.EXCLUDE_FEE_CONFIG_OPTIONS.exclusion_cart_value_threshold]),
+            delivery_distance=rng.choice([0, rng.randrange(1, 1501), rng.randrange(20000)]),
+            number_of_items=rng.choice([0, rng.randrange(1, 15), rng.randrange(200)]),
+            time=time.isoformat(),
+        ))
+    return order_infos
@@ -0,0 +1,62 @@
+import pytest
+from fastapi.testclient import TestClient
+from http import HTTPStatus
+from app.main import app
+
+
+client = TestClient(app)
+
+
+valid_orders = [
+    {"cart_value": 790, "delivery_distance": 2235,
+        "number_of_items": 4, "time": "2024-01-15T13:00:00Z"},
+    {"cart_value": 5e2, "delivery_distance": 0,
+        "number_of_items": 0, "time": "2024-02-02T15:00:00Z"},
+    {"cart_value": 0, "delivery_distance": 0,
+        "number_of_items": 100, "time": "2024-01-15T13:00:00Z"},
+    {"cart_value": 200e2, "delivery_distance": 15000,
+        "number_of_items": 3000, "time": "2024-01-15T13:00:00Z"},
+]
+
+
+def test__batch_fees_are_same_as_single_order_fees():
+    res = client.post("/api/delivery/calculate_delivery_fees/", json=valid_orders)
+    assert res.status_code == HTTPStatus.OK
+
+    expected = []
+    for order in valid_orders:
+        single_res = client.post("/api/delivery/calculate_delivery_fee/", json=order)
+        expected.append({"delivery_fee": single_res.json()["delivery_fee"],
+                         "errors": None})
+    assert res.json() == expected
+
+
+def test__batch_with_no_orders():
+    res = client.post("/api/delivery/calculate_delivery_fees/", json=[])
+    assert res.status_code == HTTPStatus.OK
+    assert res.json() == []
+
+
+@pytest.mark.parametrize("invalid_order", [
+    {"cart_value": -1, "delivery_distance": 0,
+        "number_of_items": 0, "time": "2024-01-15T13:00:00Z"},
+    {"cart_value": 0, "delivery_distance": 0,
+        "number_of_items": 0, "time": "invalid"},
+    {"cart_value": 0},
+    "invalid",
+    None,
+])
+def test__batch_invalid_order_does_not_fail_batch(invalid_order):
+    orders = [valid_orders[0], invalid_order, valid_orders[1]]
+    res = client.post("/api/delivery/calculate_delivery_fees/", json=orders)
+    assert res.status_code == HTTPStatus.OK
+
+    first, invalid, last = res.json()
+    assert first["delivery_fee"] == 710 and first["errors"] is None
+    assert invalid["delivery_fee"] is None and len(invalid["errors"]) > 0
+    assert last["delivery_fee"] == 600 and last["errors"] is None
+
+
+def test__batch_body_must_be_list():
+    res = client.post("/api/delivery/calculate_delivery_fees/", json=valid_orders[0])
+    assert res.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
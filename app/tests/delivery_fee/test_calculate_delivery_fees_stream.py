@@ -0,0 +1,117 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+from http import HTTPStatus
+from app.main import create_app, create_lean_app
+from app.delivery_fee import ndjson_stream
+
+
+FASTAPI_CLIENT = TestClient(create_app())
+LEAN_CLIENT = TestClient(create_lean_app())
+STREAM_PATH = "/api/delivery/calculate_delivery_fees/stream/"
+BATCH_PATH = "/api/delivery/calculate_delivery_fees/"
+
+orders = [
+    {"cart_value": 790, "delivery_distance": 2235,
+        "number_of_items": 4, "time": "2024-01-15T13:00:00Z"},
+    {"cart_value": -1, "delivery_distance": 0,
+        "number_of_items": 0, "time": "2024-01-15T13:00:00Z"},
+    {"cart_value": 5e2, "delivery_distance": 0,
+        "number_of_items": 0, "time": "2024-02-02T15:00:00Z"},
+    {"cart_value": "100", "delivery_distance": 10,
+        "number_of_items": 1, "time": "invalid"},
+    {"cart_value": 0},
+    "invalid",
+    None,
+    {"cart_value": 200e2, "delivery_distance": 15000,
+        "number_of_items": 3000, "time": "2024-01-19T16:00:00+01:00"},
+]
+
+
+def ndjson(lines: list) -> bytes:
+    return b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+
+
+def read_ndjson(content: bytes) -> list:
+    assert content.endswith(b"\n") or not content
+    return [json.loads(line) for line in content.splitlines()]
+
+
+@pytest.mark.parametrize("client", [FASTAPI_CLIENT, LEAN_CLIENT], ids=["fastapi", "lean"])
+def test__stream_results_are_same_as_batch_results(client):
+    res = client.post(STREAM_PATH, content=ndjson(orders))
+    assert res.status_code == HTTPStatus.OK
+    assert res.headers["content-type"] == "application/x-ndjson"
+    assert read_ndjson(res.content) == client.post(BATCH_PATH, json=orders).json()
+
+
+def test__stream_in_small_request_chunks(monkeypatch):
+    monkeypatch.setattr(ndjson_stream, "MAX_CHUNK_LINES", 3)
+    body = ndjson(orders * 5)
+    # Chunks that split the lines at every possible place.
+    chunks = [body[start:start + 7] for start in range(0, len(body), 7)]
+
+    res = LEAN_CLIENT.post(STREAM_PATH, content=iter(chunks))
+    assert res.status_code == HTTPStatus.OK
+    assert read_ndjson(res.content) == LEAN_CLIENT.post(BATCH_PATH, json=orders * 5).json()
+
+
+def test__stream_skips_blank_lines_and_allows_missing_last_newline():
+    body = b"\n\n" + ndjson(orders[:1]) + b"  \r\n\n" + json.dumps(orders[2]).encode()
+    res = LEAN_CLIENT.post(STREAM_PATH, content=body)
+    assert read_ndjson(res.content) == [{"delivery_fee": 710, "errors": None},
+                                        {"delivery_fee": 600, "errors": None}]
+
+
+def test__stream_with_empty_body():
+    res = LEAN_CLIENT.post(STREAM_PATH, content=b"")
+    assert res.status_code == HTTPStatus.OK
+    assert res.content == b""
+
+
+@pytest.mark.parametrize("line, error_type", [
+    (b"{invalid json", "json_invalid"),
+    (b"[1, 2", "json_invalid"),
+    (b'{"cart_value": "\xff"}', "json_invalid"),
+    (b"null", "model_type"),
+])
+def test__malformed_line_gets_error_record(line, error_type):
+    body = ndjson(orders[:1]) + line + b"\n" + ndjson(orders[:1])
+    first, malformed, last = read_ndjson(LEAN_CLIENT.post(STREAM_PATH, content=body).content)
+
+    assert first == last == {"delivery_fee": 710, "errors": None}
+    assert malformed["delivery_fee"] is None
+    assert [error["type"] for error in malformed["errors"]] == [error_type]
+
+
+def test__too_long_line_gets_error_record(monkeypatch):
+    monkeypatch.setattr(ndjson_stream, "MAX_LINE_BYTES", 100)
+    long_order = {**orders[0], "padding": "x" * 200}
+    body = ndjson([orders[0], long_order, orders[0]])
+    chunks = [body[start:start + 30] for start in range(0, len(body), 30)]
+
+    res = LEAN_CLIENT.post(STREAM_PATH, content=iter(chunks))
+    first, too_long, last = read_ndjson(res.content)
+    assert first == last == {"delivery_fee": 710, "errors": None}
+    assert too_long["delivery_fee"] is None
+    assert too_long["errors"][0]["type"] == "too_long"
+
+
+def split_lines(chunks: list[bytes], max_line_bytes: int) -> list[list[bytes | None]]:
+    async def request_stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [lines async for lines in ndjson_stream.split_lines(request_stream(),
+                                                                    max_line_bytes)]
+
+    return asyncio.run(collect())
+
+
+def test__split_lines():
+    assert split_lines([b"a\nb", b"c\n", b"", b"\nd"], 10) == [[b"a"], [b"bc"], [b""], [b"d"]]
+    assert split_lines([b"123456\n12", b"34567\n"], 5) == [[None], [None]]
+    assert split_lines([b"12", b"3456", b"78\nab\n"], 5) == [[None], [b"ab"]]
+    assert split_lines([b"12345\n12345"], 5) == [[b"12345"], [b"12345"]]
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.fee_calculation_steps import DeliveryFeeCalculationStep
+from app.delivery_fee.fee_transformers import DeliveryFeeTransformer
+from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(2000)
+ORDER_COLUMNS = OrderInfoColumns.from_arrays(
+    [order_info.cart_value for order_info in ORDER_INFOS],
+    [order_info.delivery_distance for order_info in ORDER_INFOS],
+    [order_info.number_of_items for order_info in ORDER_INFOS],
+    [order_info.time for order_info in ORDER_INFOS],
+)
+
+
+@pytest.mark.parametrize("step", settings.ALL_CALCULATION_STEPS,
+                         ids=lambda step: type(step).__name__)
+def test__vectorized_step_matches_scalar_step(step: DeliveryFeeCalculationStep):
+    expected = [step.calculate(order_info).delivery_fee for order_info in ORDER_INFOS]
+    assert step.calculate_many(ORDER_COLUMNS).tolist() == expected
+
+
+@pytest.mark.parametrize("transformer", settings.ALL_FEE_TRANSFORMERS,
+                         ids=lambda transformer: type(transformer).__name__)
+def test__vectorized_transformer_matches_scalar_transformer(transformer: DeliveryFeeTransformer):
+    delivery_fees = np.arange(len(ORDER_INFOS), dtype=np.int64) * 7 % 2500
+    expected = [transformer.transform(order_info, DeliveryFee(delivery_fee=delivery_fee)).delivery_fee
+                for order_info, delivery_fee in zip(ORDER_INFOS, delivery_fees.tolist())]
+    assert transformer.transform_many(ORDER_COLUMNS, delivery_fees).tolist() == expected
+
+
+def test__calculate_many_matches_calculate():
+    expected = [DELIVERY_FEE_CALCULATOR.calculate(order_info).delivery_fee
+                for order_info in ORDER_INFOS]
+    delivery_fees = DELIVERY_FEE_CALCULATOR.calculate_many(
+        ORDER_COLUMNS.cart_value, ORDER_COLUMNS.delivery_distance,
+        ORDER_COLUMNS.number_of_items, ORDER_COLUMNS.time)
+
+    assert delivery_fees.dtype == np.int64
+    assert delivery_fees.tolist() == expected
+
+
+def test__calculate_many_with_iso_format_strings():
+    delivery_fees = DELIVERY_FEE_CALCULATOR.calculate_many(
+        [5e2, 5e2, 790], [0, 0, 2235], [0, 0, 4],
+        ["2024-02-02T15:00:00Z", "2024-02-02T20:00:00Z", "2024-01-15T13:00:00+02:00"])
+    assert delivery_fees.tolist() == [600, 500, 710]
+
+
+def test__calculate_many_falls_back_to_scalar_steps():
+    class ConstantFee(DeliveryFeeCalculationStep):
+        def calculate(self, order_info: OrderInfo) -> DeliveryFee:
+            return DeliveryFee(delivery_fee=order_info.number_of_items + 1)
+
+    class AddOneTransformer(DeliveryFeeTransformer):
+        def transform(self, delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
+            return delivery_fee + 1
+
+    order_columns = OrderInfoColumns.from_arrays(
+        [0, 0], [0, 0], [1, 2], ["2024-01-15T13:00:00Z"] * 2)
+    assert ConstantFee().calculate_many(order_columns).tolist() == [2, 3]
+    assert AddOneTransformer().transform_many(
+        order_columns, np.array([5, 6])).tolist() == [6, 7]
+
+
+@pytest.mark.parametrize("columns", [
+    ([-1], [0], [0], ["2024-01-15T13:00:00Z"]),
+    ([0], [-1], [0], ["2024-01-15T13:00:00Z"]),
+    ([0], [0], [-1], ["2024-01-15T13:00:00Z"]),
+    ([100.5], [0], [0], ["2024-01-15T13:00:00Z"]),
+    (["invalid"], [0], [0], ["2024-01-15T13:00:00Z"]),
+    ([0], [0], [0], ["invalid"]),
+    ([0], [0], [0], [5]),
+    ([0, 1], [0], [0], ["2024-01-15T13:00:00Z"]),
+])
+def test__calculate_many_with_invalid_columns(columns):
+    with pytest.raises(ValueError):
+        DELIVERY_FEE_CALCULATOR.calculate_many(*columns)
@@ -0,0 +1,177 @@
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from http import HTTPStatus
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from app.delivery_fee import settings
+from app.delivery_fee.city_pricing import CityPricingStore, main, write_city_table
+from app.delivery_fee.fee_calculation_steps import CartValueFee
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.fee_transformers import RushHourFeeTransformer
+from app.delivery_fee.models import OrderInfo
+from app.delivery_fee.raw_endpoints import CONFIG_VERSION_HEADER, create_delivery_fee_routes
+from app.delivery_fee.router import create_delivery_fee_router
+from app.tests.delivery_fee.random_orders import random_order_infos
+from app.tests.delivery_fee.test_pricing_config import SETTINGS_CONFIG
+
+
+ORDER_INFOS = random_order_infos(500, seed=19)
+ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4,
+         "time": "2024-01-15T13:00:00Z"}
+
+# A city whose small order surcharge starts at 15€ and whose rush hour is on Mondays.
+CUSTOM_CITY = ([CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=1500)),
+                *settings.ALL_CALCULATION_STEPS[1:]],
+               [RushHourFeeTransformer(RushHourFeeTransformer.ConfigOptions(
+                   rush_day="Monday", rush_hour_start="12:30", rush_hour_end="13:30")),
+                *settings.ALL_FEE_TRANSFORMERS[1:]])
+CITIES = {
+    "helsinki": (settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS),
+    "berlin": (settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS),
+    "tampere": CUSTOM_CITY,
+}
+
+
+@pytest.fixture(scope="module")
+def table_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("cities") / "cities.bin"
+    write_city_table(path, CITIES)
+    return path
+
+
+@pytest.fixture
+def store(table_path):
+    store = CityPricingStore(table_path, max_cities=2)
+    yield store
+    store.close()
+
+
+def test__cities_are_looked_up_from_the_table(store: CityPricingStore):
+    assert len(store) == 3
+    assert list(store) == ["berlin", "helsinki", "tampere"]
+    assert "tampere" in store and "oulu" not in store and "" not in store
+    with pytest.raises(KeyError):
+        store.pipeline("oulu")
+
+
+def test__city_pipeline_is_the_pipeline_of_its_configuration(store: CityPricingStore):
+    pipeline = store.pipeline("helsinki")
+
+    assert pipeline.version == DELIVERY_FEE_CALCULATOR.version
+    assert ([pipeline.calculate_fee(order_info) for order_info in ORDER_INFOS] ==
+            DELIVERY_FEE_CALCULATOR.calculate_fees(ORDER_INFOS))
+    # 7.90€ is under the 15€ threshold and Monday 13:00 is a rush hour in tampere.
+    assert store.pipeline("tampere").calculate_fee(OrderInfo.model_validate(ORDER)) == 1452
+
+
+def test__least_recently_used_cities_are_evicted(store: CityPricingStore):
+    helsinki = store.pipeline("helsinki")
+    store.pipeline("berlin")
+    assert store.pipeline("helsinki") is helsinki
+    store.pipeline("tampere")
+
+    assert store.pipeline("helsinki") is helsinki
+    stats = store.pipeline_stats()
+    assert (stats.size, stats.evictions) == (2, 1)
+    # berlin was dropped and is built again.
+    assert store.pipeline("berlin").version == helsinki.version
+
+
+@pytest.mark.parametrize("cities, message", [
+    ({"": CITIES["helsinki"]}, "must have 1 to 32 bytes"),
+    ({"x" * 33: CITIES["helsinki"]}, "must have 1 to 32 bytes"),
+    ({"oulu": (settings.ALL_CALCULATION_STEPS[:2], settings.ALL_FEE_TRANSFORMERS)},
+     "must have the steps and transformers"),
+    ({"oulu": (CUSTOM_CITY[0], [RushHourFeeTransformer(RushHourFeeTransformer.ConfigOptions(
+        rush_day="Caturday")), *settings.ALL_FEE_TRANSFORMERS[1:]])}, "not a weekday name"),
+])
+def test__invalid_cities_are_rejected(tmp_path, cities, message: str):
+    with pytest.raises(ValueError, match=message):
+        write_city_table(tmp_path / "cities.bin", cities)
+
+
+def test__rush_hour_timezone_is_stored(tmp_path):
+    helsinki_rush_hour = RushHourFeeTransformer(RushHourFeeTransformer.ConfigOptions(
+        timezone="Europe/Helsinki"))
+    write_city_table(tmp_path / "cities.bin", {"helsinki": (
+        settings.ALL_CALCULATION_STEPS, [helsinki_rush_hour, *settings.ALL_FEE_TRANSFORMERS[1:]])})
+
+    store = CityPricingStore(tmp_path / "cities.bin")
+    try:
+        [rush_hour, *_] = store.pipeline("helsinki").transformers
+        assert rush_hour.config_options == helsinki_rush_hour.config_options
+        # Friday 1 PM and 6 PM in UTC are 3 PM and 8 PM in Helsinki in the winter.
+        for order_time, delivery_fee in [("2024-01-26T13:00:00Z", 852),
+                                         ("2024-01-26T18:00:00Z", 710)]:
+            order = OrderInfo.model_validate({**ORDER, "time": order_time})
+            assert store.pipeline("helsinki").calculate_fee(order) == delivery_fee
+    finally:
+        store.close()
+
+
+def test__invalid_tables_are_rejected(tmp_path, table_path):
+    path = tmp_path / "cities.bin"
+    path.write_bytes(b"not a table")
+    with pytest.raises(ValueError, match="not a city pricing table"):
+        CityPricingStore(path)
+
+    path.write_bytes(table_path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="truncated"):
+        CityPricingStore(path)
+
+
+def test__table_is_built_from_pricing_configuration_files(tmp_path, capsys):
+    input_path, output_path = tmp_path / "cities.json", tmp_path / "cities.bin"
+    input_path.write_text(json.dumps({"helsinki": SETTINGS_CONFIG, "espoo": {
+        "calculation_steps": [{"type": type(step).__name__}
+                              for step in settings.ALL_CALCULATION_STEPS],
+        "transformers": [{"type": type(transformer).__name__}
+                         for transformer in settings.ALL_FEE_TRANSFORMERS]}}))
+    main([str(input_path), str(output_path)])
+
+    assert "Wrote 2 cities" in capsys.readouterr().out
+    store = CityPricingStore(output_path)
+    assert store.pipeline("espoo").version == store.pipeline("helsinki").version
+
+    input_path.write_text(json.dumps({"helsinki": {"calculation_steps": [{"type": "Nope"}]}}))
+    with pytest.raises(SystemExit):
+        main([str(input_path), str(output_path)])
+    assert "helsinki: calculation_steps[0]: unknown type" in capsys.readouterr().err
+
+
+def city_clients(store: CityPricingStore) -> list[TestClient]:
+    clients = [TestClient(Starlette(routes=[Mount(
+        "/api/delivery", routes=create_delivery_fee_routes(city_pricing=store))]))]
+    for quote_fast_path in (True, False):
+        app = FastAPI()
+        app.include_router(create_delivery_fee_router(quote_fast_path, city_pricing=store),
+                           prefix="/api/delivery")
+        clients.append(TestClient(app))
+    return clients
+
+
+def test__cities_are_quoted_by_their_routes(store: CityPricingStore):
+    for client in city_clients(store):
+        for city, delivery_fee in [("helsinki", 710), ("tampere", 1452)]:
+            response = client.post(f"/api/delivery/calculate_delivery_fee/cities/{city}/",
+                                   json=ORDER)
+
+            assert response.status_code == HTTPStatus.OK
+            assert response.json() == {"delivery_fee": delivery_fee}
+            assert response.headers[CONFIG_VERSION_HEADER] == store.pipeline(city).version
+
+
+def test__city_routes_validate_the_order_and_the_city(store: CityPricingStore):
+    responses = []
+    for client in city_clients(store):
+        invalid = client.post("/api/delivery/calculate_delivery_fee/cities/helsinki/",
+                              json={**ORDER, "cart_value": -1})
+        unknown = client.post("/api/delivery/calculate_delivery_fee/cities/oulu/", json=ORDER)
+
+        assert invalid.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+        assert unknown.status_code == HTTPStatus.NOT_FOUND
+        responses.append((invalid.content, unknown.content))
+    # The raw and the FastAPI endpoints give the same responses.
+    assert len(set(responses)) == 1
@@ -0,0 +1,74 @@
+import pytest
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.fee_calculation_steps import DeliveryFeeCalculationStep, CartValueFee
+from app.delivery_fee.fee_transformers import DeliveryFeeTransformer, LimitFeeTransformer
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+from app.delivery_fee import settings as settings
+
+
+ORDER_INFO = OrderInfo(cart_value=790, delivery_distance=2235,
+                       number_of_items=14, time="2024-01-19T16:00:00Z")
+
+
+class ModelBasedItemCountFee(DeliveryFeeCalculationStep):
+    """Custom step which only implements the model based `calculate`."""
+
+    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
+        return DeliveryFee(delivery_fee=order_info.number_of_items)
+
+
+class ModelBasedDoubleFeeTransformer(DeliveryFeeTransformer):
+    """Custom transformer which only implements the model based `transform`."""
+
+    def transform(self, delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
+        return delivery_fee * 2
+
+
+class NegativeFee(DeliveryFeeCalculationStep):
+    def calculate_fee(self, order_info: OrderInfo) -> int:
+        return -1000
+
+
+@pytest.fixture
+def delivery_fee_calculator():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    yield DeliveryFeeCalculator()
+    DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def test__integer_and_model_based_methods_give_same_fees():
+    for step in settings.ALL_CALCULATION_STEPS:
+        assert step.calculate(ORDER_INFO) == step.calculate_fee(ORDER_INFO)
+    for transformer in settings.ALL_FEE_TRANSFORMERS:
+        assert (transformer.transform(ORDER_INFO, DeliveryFee(delivery_fee=1400)) ==
+                transformer.transform_fee(ORDER_INFO, 1400))
+
+
+def test__transform_does_not_change_the_given_fee():
+    delivery_fee = DeliveryFee(delivery_fee=2000)
+    assert LimitFeeTransformer().transform(ORDER_INFO, delivery_fee) == 1500
+    assert delivery_fee == 2000
+
+
+def test__model_based_custom_components_still_work(
+        delivery_fee_calculator: DeliveryFeeCalculator):
+    assert ModelBasedItemCountFee().calculate_fee(ORDER_INFO) == 14
+    assert ModelBasedDoubleFeeTransformer().transform_fee(ORDER_INFO, 7) == 14
+
+    delivery_fee_calculator.configure([CartValueFee(), ModelBasedItemCountFee()],
+                                      [ModelBasedDoubleFeeTransformer()])
+    assert delivery_fee_calculator.calculate(ORDER_INFO) == (210 + 14) * 2
+
+
+def test__accumulated_fee_is_never_negative(delivery_fee_calculator: DeliveryFeeCalculator):
+    delivery_fee_calculator.configure([CartValueFee(), NegativeFee(), CartValueFee()], [])
+    assert delivery_fee_calculator.calculate(ORDER_INFO) == 210
+
+
+@pytest.mark.parametrize("base_class", [DeliveryFeeCalculationStep, DeliveryFeeTransformer])
+def test__components_without_implementation_can_not_be_created(base_class: type):
+    class Incomplete(base_class):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,126 @@
+import pytest
+from app.delivery_fee.fee_cache import CacheStats, LRUCache
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.fee_calculation_steps import (
+    DeliveryFeeCalculationStep,
+    CartValueFee,
+    NumberOfItemsFee,
+)
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+def order_info(cart_value=500, delivery_distance=1000, number_of_items=1,
+               time="2024-01-15T13:00:00Z") -> OrderInfo:
+    return OrderInfo(cart_value=cart_value, delivery_distance=delivery_distance,
+                     number_of_items=number_of_items, time=time)
+
+
+# Orders around all the thresholds of the default settings.
+BOUNDARY_ORDER_INFOS = [
+    order_info(cart_value=cart_value, delivery_distance=delivery_distance,
+               number_of_items=number_of_items, time=time)
+    for cart_value in [0, 999, 1000, 1001, 19999, 20000, 10**18]
+    for delivery_distance in [0, 1, 1000, 1001, 1500, 1501, 2**53, 2**53 + 1, 2**60]
+    for number_of_items in [0, 4, 5, 12, 13, 10**6]
+    for time in ["2024-02-02T14:59:59.999999Z", "2024-02-02T15:00:00Z",
+                 "2024-02-02T19:59:59.999999Z", "2024-02-02T20:00:00Z",
+                 "2024-02-01T16:00:00Z"]
+]
+
+
+class ItemCountFee(DeliveryFeeCalculationStep):
+    """Custom step without a cache key."""
+
+    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
+        return DeliveryFee(delivery_fee=order_info.number_of_items)
+
+
+@pytest.fixture
+def cached_calculator():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    yield DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS,
+                                settings.ALL_FEE_TRANSFORMERS, cache_size=100)
+    DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def test__lru_cache_evicts_least_recently_used_item():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == CacheStats(max_size=2, size=2, hits=3, misses=1, evictions=1)
+
+
+def test__lru_cache_size_must_be_positive():
+    with pytest.raises(ValueError):
+        LRUCache(max_size=0)
+
+
+@pytest.mark.parametrize("order_infos", [BOUNDARY_ORDER_INFOS, random_order_infos(3000)],
+                         ids=["boundaries", "random"])
+def test__cached_calculator_matches_step_by_step_calculation(
+        cached_calculator: DeliveryFeeCalculator, order_infos: list[OrderInfo]):
+    for _ in range(2):
+        for order in order_infos:
+            assert (cached_calculator.calculate(order) ==
+                    cached_calculator._calculate_step_by_step(order))
+
+    assert cached_calculator.cache_stats.hits > 0
+
+
+def test__orders_with_same_normalized_key_hit_the_cache(
+        cached_calculator: DeliveryFeeCalculator):
+    first_fee = cached_calculator.calculate(order_info(cart_value=2000, delivery_distance=1200))
+    second_fee = cached_calculator.calculate(order_info(cart_value=3000, delivery_distance=1400))
+
+    assert first_fee == second_fee == DeliveryFee(delivery_fee=300)
+    assert first_fee is not second_fee
+    assert cached_calculator.cache_stats == CacheStats(
+        max_size=100, size=1, hits=1, misses=1, evictions=0)
+
+
+def test__cache_is_invalidated_when_configuration_changes(
+        cached_calculator: DeliveryFeeCalculator):
+    order = order_info(number_of_items=20)
+    assert cached_calculator.calculate(order) == 1500
+    assert cached_calculator.calculate(order) == 1500
+
+    cached_calculator.transformers = []
+    assert cached_calculator.cache_stats.size == 0
+    assert cached_calculator.calculate(order) == 500 + 200 + 16 * 50 + 120
+
+
+def test__item_count_is_grouped_only_without_surcharge_per_item():
+    step = NumberOfItemsFee(NumberOfItemsFee.ConfigOptions(surcharge_per_item_over_threshold=0))
+    assert step.cache_key_source() == ["min(max(number_of_items, 4), 13)"]
+    assert NumberOfItemsFee().cache_key_source() == ["max(number_of_items, 4)"]
+
+
+def test__cache_is_not_used_for_uncacheable_steps():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    calculator = DeliveryFeeCalculator([CartValueFee(), ItemCountFee()], [], cache_size=100)
+    DeliveryFeeCalculator.clear_singleton_instance()
+
+    assert calculator.cache_stats is None
+    assert calculator.calculate(order_info(cart_value=5, number_of_items=3)) == 998
+
+
+def test__cache_can_be_enabled_and_disabled():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    calculator = DeliveryFeeCalculator()
+    DeliveryFeeCalculator.clear_singleton_instance()
+    assert calculator.cache_stats is None
+
+    calculator.enable_cache(10)
+    calculator.calculate(order_info())
+    assert calculator.cache_stats.misses == 1
+
+    calculator.disable_cache()
+    assert calculator.cache_stats is None
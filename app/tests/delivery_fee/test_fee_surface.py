@@ -0,0 +1,145 @@
+import random
+from datetime import datetime, time
+import pytest
+from app.delivery_fee.fee_calculation_steps import (
+    CartValueFee,
+    DeliveryDistanceFee,
+    NumberOfItemsFee,
+)
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator, PricingPipeline
+from app.delivery_fee.fee_surface import load_fee_surface
+from app.delivery_fee.fee_transformers import RushHourFeeTransformer
+from app.delivery_fee.models import OrderInfo, OrderRecord
+from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(3000, seed=25)
+CUSTOM_STEPS = [
+    CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=1500)),
+    DeliveryDistanceFee(DeliveryDistanceFee.ConfigOptions(
+        delivery_distance_low_threshold=700, additional_fee_applied_per_meters_traveled=300)),
+    NumberOfItemsFee(NumberOfItemsFee.ConfigOptions(number_of_items_surcharge_threshold=2)),
+]
+LOCAL_RUSH_HOUR = RushHourFeeTransformer(RushHourFeeTransformer.ConfigOptions(
+    rush_day="Monday", rush_hour_start=time(7, 30), rush_hour_end=time(9),
+    rush_hour_fee_factor=1.5, timezone="Europe/Helsinki"))
+
+
+def small_order_infos(count: int, seed: int) -> list[OrderInfo]:
+    # Mostly inside a surface up to 3000 meters and 12 items.
+    rng = random.Random(seed)
+    return [order_info.model_copy(update={
+        "cart_value": rng.randrange(2500), "delivery_distance": rng.randrange(3200),
+        "number_of_items": rng.randrange(14)})
+            for order_info in random_order_infos(count, seed=seed)]
+
+
+@pytest.mark.parametrize("calculation_steps, transformers", [
+    (settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS),
+    (CUSTOM_STEPS, [LOCAL_RUSH_HOUR, *settings.ALL_FEE_TRANSFORMERS[1:]]),
+])
+def test__surface_matches_the_compiled_pipeline(calculation_steps, transformers, tmp_path):
+    pipeline = PricingPipeline.build(calculation_steps, transformers)
+    surface_pipeline = PricingPipeline.build(calculation_steps, transformers,
+                                             fee_surface_dir=tmp_path)
+    assert surface_pipeline.fee_surface is not None
+
+    for order_info in [*ORDER_INFOS, *small_order_infos(3000, seed=5)]:
+        assert surface_pipeline.calculate_fee(order_info) == pipeline.calculate_fee(order_info)
+
+
+@pytest.mark.parametrize("surcharge_threshold, bulk_charge_threshold", [(4, 2), (1, 6), (3, 3)])
+def test__surface_matches_the_pipeline_over_the_whole_range(
+        surcharge_threshold, bulk_charge_threshold, tmp_path):
+    calculation_steps = [
+        CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=300)),
+        DeliveryDistanceFee(DeliveryDistanceFee.ConfigOptions(
+            delivery_distance_low_threshold=700, additional_fee_applied_per_meters_traveled=300)),
+        NumberOfItemsFee(NumberOfItemsFee.ConfigOptions(
+            number_of_items_surcharge_threshold=surcharge_threshold,
+            bulk_charge_threshold=bulk_charge_threshold)),
+    ]
+    pipeline = PricingPipeline.build(calculation_steps, settings.ALL_FEE_TRANSFORMERS)
+    surface = load_fee_surface(calculation_steps, settings.ALL_FEE_TRANSFORMERS, tmp_path,
+                               max_distance=1500, max_items=10)
+    assert surface is not None
+    surface_pipeline = surface.compile(settings.ALL_FEE_TRANSFORMERS[0],
+                                       pipeline.compiled_pipeline)
+
+    free_delivery_threshold = settings.EXCLUDE_FEE_CONFIG_OPTIONS.exclusion_cart_value_threshold
+    cart_values = [0, 1, 299, 300, 301, free_delivery_threshold - 1, free_delivery_threshold]
+    # In the rush hour and at the same time a day later.
+    order_times = [datetime(2024, 1, 5, 16), datetime(2024, 1, 6, 16)]
+    for cart_value in cart_values:
+        for delivery_distance in range(1701):
+            for number_of_items in range(13):
+                for order_time in order_times:
+                    order_record = OrderRecord(cart_value, delivery_distance, number_of_items,
+                                               order_time)
+                    assert surface_pipeline(*order_record) == \
+                        pipeline.calculate_fee(order_record), order_record
+
+
+def test__surface_is_built_once_and_mapped_afterwards(tmp_path):
+    surface = load_fee_surface(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS,
+                               tmp_path, max_distance=3000, max_items=12)
+    assert surface is not None
+    assert list(tmp_path.iterdir()) == [surface.path]
+    modified = surface.path.stat().st_mtime_ns
+
+    mapped = load_fee_surface(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS,
+                              tmp_path, max_distance=3000, max_items=12)
+    assert mapped.path == surface.path and mapped.path.stat().st_mtime_ns == modified
+    assert mapped.table.tolist() == surface.table.tolist()
+
+    # Another range or configuration has a file of its own.
+    other = load_fee_surface(CUSTOM_STEPS, settings.ALL_FEE_TRANSFORMERS, tmp_path,
+                             max_distance=3000, max_items=12)
+    assert other.path != surface.path and len(list(tmp_path.iterdir())) == 2
+
+
+def test__broken_surface_file_is_rebuilt(tmp_path):
+    surface = load_fee_surface(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS,
+                               tmp_path, max_distance=3000, max_items=12)
+    fees = surface.table.tolist()
+    surface.path.write_bytes(surface.path.read_bytes()[:-4])
+
+    rebuilt = load_fee_surface(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS,
+                               tmp_path, max_distance=3000, max_items=12)
+    assert rebuilt.table.tolist() == fees
+
+
+@pytest.mark.parametrize("calculation_steps, transformers", [
+    (settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS[:-1]),
+    (settings.ALL_CALCULATION_STEPS[::-1], settings.ALL_FEE_TRANSFORMERS),
+    ([CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=30000)),
+      *settings.ALL_CALCULATION_STEPS[1:]], settings.ALL_FEE_TRANSFORMERS),
+    ([CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=-1)),
+      *settings.ALL_CALCULATION_STEPS[1:]], settings.ALL_FEE_TRANSFORMERS),
+])
+def test__unsupported_configuration_has_no_surface(calculation_steps, transformers, tmp_path):
+    assert load_fee_surface(calculation_steps, transformers, tmp_path) is None
+    pipeline = PricingPipeline.build(calculation_steps, transformers, fee_surface_dir=tmp_path)
+    assert pipeline.fee_surface is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test__calculator_with_surface_matches_step_by_step_calculation(tmp_path):
+    DeliveryFeeCalculator.clear_singleton_instance()
+    try:
+        delivery_fee_calculator = DeliveryFeeCalculator(
+            settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS,
+            fee_surface_dir=tmp_path)
+        assert delivery_fee_calculator.pipeline.fee_surface is not None
+        for order_info in ORDER_INFOS:
+            assert delivery_fee_calculator.calculate_fee(order_info) == \
+                delivery_fee_calculator._calculate_step_by_step(order_info)
+        # In the rush hour and at the same time a day later.
+        for order_time in [datetime(2024, 1, 5, 16), datetime(2024, 1, 6, 16)]:
+            order_info = OrderInfo(cart_value=500, delivery_distance=1600, number_of_items=6,
+                                   time=order_time.isoformat() + "Z")
+            assert delivery_fee_calculator.calculate_fee(order_info) == \
+                delivery_fee_calculator._calculate_step_by_step(order_info)
+    finally:
+        DeliveryFeeCalculator.clear_singleton_instance()
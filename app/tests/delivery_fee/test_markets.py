@@ -0,0 +1,86 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from http import HTTPStatus
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from app.main import create_app, create_lean_app
+from app.delivery_fee import settings
+from app.delivery_fee.fee_calculation_steps import CartValueFee
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.markets import MARKET_REGISTRY, MarketRegistry
+from app.delivery_fee.raw_endpoints import CONFIG_VERSION_HEADER, create_delivery_fee_routes
+from app.delivery_fee.router import create_delivery_fee_router
+
+
+ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4,
+         "time": "2024-01-15T13:00:00Z"}
+
+# A market whose small order surcharge starts at 15€ instead of 10€.
+MARKETS = MarketRegistry.build({
+    "fi": (settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS),
+    "xx": ([CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=1500)),
+            *settings.ALL_CALCULATION_STEPS[1:]], settings.ALL_FEE_TRANSFORMERS),
+})
+
+
+def fastapi_client(quote_fast_path: bool) -> TestClient:
+    app = FastAPI()
+    app.include_router(create_delivery_fee_router(quote_fast_path, markets=MARKETS),
+                       prefix="/api/delivery")
+    return TestClient(app)
+
+
+MARKET_CLIENTS = [
+    fastapi_client(quote_fast_path=True),
+    fastapi_client(quote_fast_path=False),
+    TestClient(Starlette(routes=[Mount("/api/delivery",
+                                       routes=create_delivery_fee_routes(markets=MARKETS))])),
+]
+
+
+def test__registry_is_immutable():
+    assert list(MARKETS) == ["fi", "xx"] and len(MARKETS) == 2
+    with pytest.raises(TypeError):
+        MARKETS["de"] = MARKETS["fi"]
+    with pytest.raises(TypeError):
+        MARKETS._pipelines["de"] = MARKETS["fi"]
+
+
+def test__markets_with_the_same_rules_have_the_same_version():
+    assert MARKET_REGISTRY["fi"].version == MARKET_REGISTRY["de"].version
+    assert MARKET_REGISTRY["fi"].version == DELIVERY_FEE_CALCULATOR.version
+    assert MARKETS["fi"].version != MARKETS["xx"].version
+
+
+@pytest.mark.parametrize("client", MARKET_CLIENTS)
+def test__every_market_is_priced_with_its_own_rules(client: TestClient):
+    for market, delivery_fee in [("fi", 710), ("xx", 1210)]:
+        response = client.post(f"/api/delivery/calculate_delivery_fee/{market}/", json=ORDER)
+
+        assert response.status_code == HTTPStatus.OK
+        assert response.json() == {"delivery_fee": delivery_fee}
+        assert response.headers[CONFIG_VERSION_HEADER] == MARKETS[market].version
+
+
+@pytest.mark.parametrize("client", MARKET_CLIENTS)
+def test__market_routes_validate_the_order(client: TestClient):
+    response = client.post("/api/delivery/calculate_delivery_fee/xx/",
+                           json={**ORDER, "cart_value": -1})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json() == client.post("/api/delivery/calculate_delivery_fee/",
+                                          json={**ORDER, "cart_value": -1}).json()
+
+
+@pytest.mark.parametrize("client", MARKET_CLIENTS)
+def test__unknown_market_is_not_found(client: TestClient):
+    response = client.post("/api/delivery/calculate_delivery_fee/se/", json=ORDER)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.parametrize("create", [create_app, create_lean_app])
+def test__apps_serve_the_settings_markets(create):
+    client = TestClient(create())
+    for market in settings.MARKETS:
+        response = client.post(f"/api/delivery/calculate_delivery_fee/{market}/", json=ORDER)
+        assert response.json() == {"delivery_fee": 710}
@@ -0,0 +1,89 @@
+import pytest
+from pydantic import ValidationError
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+from app.delivery_fee.pipeline_compiler import compile_pipeline
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.fee_calculation_steps import (
+    DeliveryFeeCalculationStep,
+    CartValueFee,
+    DeliveryDistanceFee,
+)
+from app.delivery_fee.fee_transformers import RushHourFeeTransformer
+from app.delivery_fee import settings as settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(2000, seed=3)
+
+
+class ItemCountFee(DeliveryFeeCalculationStep):
+    """Custom step without a compiled form."""
+
+    def calculate(self, order_info: OrderInfo) -> DeliveryFee:
+        return DeliveryFee(delivery_fee=order_info.number_of_items)
+
+
+@pytest.fixture
+def delivery_fee_calculator():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    yield DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS)
+    DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def test__compiled_pipeline_matches_step_by_step_calculation(
+        delivery_fee_calculator: DeliveryFeeCalculator):
+    compiled_pipeline = compile_pipeline(settings.ALL_CALCULATION_STEPS,
+                                         settings.ALL_FEE_TRANSFORMERS)
+    assert compiled_pipeline is not None
+
+    for order_info in ORDER_INFOS:
+        expected_fee = delivery_fee_calculator._calculate_step_by_step(order_info)
+        assert compiled_pipeline(order_info.cart_value, order_info.delivery_distance,
+                                 order_info.number_of_items, order_info.time) == expected_fee
+        assert delivery_fee_calculator.calculate(order_info) == expected_fee
+
+
+def test__pipeline_with_custom_step_is_not_compiled():
+    assert compile_pipeline([*settings.ALL_CALCULATION_STEPS, ItemCountFee()],
+                            settings.ALL_FEE_TRANSFORMERS) is None
+
+
+@pytest.mark.parametrize("step", [
+    CartValueFee(CartValueFee.ConfigOptions(cart_value_surcharge_threshold=-1)),
+    DeliveryDistanceFee(DeliveryDistanceFee.ConfigOptions(
+        additional_fee_applied_per_meters_traveled=0)),
+])
+def test__step_with_unsupported_config_options_is_not_compiled(step: DeliveryFeeCalculationStep):
+    assert step.compiled_source() is None
+
+
+def test__rush_hour_with_unknown_day_is_compiled_as_no_op():
+    transformer = RushHourFeeTransformer(
+        RushHourFeeTransformer.ConfigOptions(rush_day="friday"))
+    assert transformer.compiled_source() == []
+
+
+def test__calculator_falls_back_to_step_by_step_calculation(
+        delivery_fee_calculator: DeliveryFeeCalculator):
+    delivery_fee_calculator.calculation_steps = [
+        *settings.ALL_CALCULATION_STEPS, ItemCountFee()]
+
+    for order_info in ORDER_INFOS[:100]:
+        expected_fee = min(delivery_fee_calculator._calculate_step_by_step(order_info),
+                           settings.LIMIT_FEE_CONFIG_OPTIONS.highest_limit_of_delivery_fee)
+        assert delivery_fee_calculator.calculate(order_info) == expected_fee
+
+
+def test__calculator_is_compiled_again_when_configured(
+        delivery_fee_calculator: DeliveryFeeCalculator):
+    order_info = OrderInfo(cart_value=0, delivery_distance=0,
+                           number_of_items=100, time="2024-01-15T13:00:00Z")
+    assert delivery_fee_calculator.calculate(order_info) == 15e2
+
+    delivery_fee_calculator.transformers = []
+    assert delivery_fee_calculator.calculate(order_info) == 10e2 + 96 * 50 + 1.2e2
+
+
+def test__config_options_can_not_be_changed_after_compiling():
+    with pytest.raises(ValidationError):
+        settings.CART_VALUE_CONFIG_OPTIONS.cart_value_surcharge_threshold = 0
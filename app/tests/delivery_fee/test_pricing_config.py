@@ -0,0 +1,242 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+import pytest
+from fastapi.testclient import TestClient
+from app.main import create_app, create_lean_app
+from app.delivery_fee import settings
+from app.delivery_fee.fee_calculator import (
+    DELIVERY_FEE_CALCULATOR,
+    DeliveryFeeCalculator,
+    configuration_version,
+)
+from app.delivery_fee.models import OrderInfo
+from app.delivery_fee.pricing_config import (
+    PricingConfigError,
+    PricingConfigWatcher,
+    load_pricing_config,
+    parse_pricing_config,
+)
+from app.delivery_fee.raw_endpoints import CONFIG_VERSION_HEADER
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+PRICING_RULES_PATH = Path(__file__).parents[2] / "delivery_fee" / "pricing_rules.yaml"
+ORDER_INFOS = random_order_infos(500, seed=17)
+ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4,
+         "time": "2024-01-15T13:00:00Z"}
+
+SETTINGS_CONFIG = {
+    "version": "settings",
+    "calculation_steps": [
+        {"type": "CartValueFee", "options": {"cart_value_surcharge_threshold": 1000}},
+        {"type": "DeliveryDistanceFee", "options": {
+            "delivery_distance_low_threshold": 1000,
+            "delivery_distance_surcharge_for_low_threshold": 200,
+            "additional_fee": 100, "additional_fee_applied_per_meters_traveled": 500}},
+        {"type": "NumberOfItemsFee", "options": {
+            "number_of_items_surcharge_threshold": 4, "surcharge_per_item_over_threshold": 50,
+            "bulk_charge": 120, "bulk_charge_threshold": 12}},
+    ],
+    "transformers": [
+        {"type": "RushHourFeeTransformer", "options": {
+            "rush_day": "Friday", "rush_hour_start": "15:00:00",
+            "rush_hour_end": "19:59:59.999999", "rush_hour_fee_factor": 1.2}},
+        {"type": "ReduceFeeTransformer", "options": {
+            "exclusion_cart_value_threshold": 20000, "exclusion_delivery_fee_factor": 1}},
+        {"type": "LimitFeeTransformer", "options": {"highest_limit_of_delivery_fee": 1500}},
+    ],
+}
+
+
+def with_option(step_index: int, **options) -> dict:
+    data = json.loads(json.dumps(SETTINGS_CONFIG))
+    data["calculation_steps"][step_index]["options"].update(options)
+    return data
+
+
+@pytest.fixture
+def calculator():
+    DeliveryFeeCalculator.clear_singleton_instance()
+    yield DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS)
+    DeliveryFeeCalculator.clear_singleton_instance()
+
+
+def test__config_file_can_express_the_settings(calculator: DeliveryFeeCalculator):
+    expected_fees = calculator.calculate_fees(ORDER_INFOS)
+    parse_pricing_config(SETTINGS_CONFIG).apply_to(calculator)
+
+    assert calculator.version == "settings"
+    assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+
+
+def test__missing_options_get_the_defaults(calculator: DeliveryFeeCalculator):
+    expected_fees = calculator.calculate_fees(ORDER_INFOS)
+    parse_pricing_config({
+        "calculation_steps": [{"type": type(step).__name__}
+                              for step in settings.ALL_CALCULATION_STEPS],
+        "transformers": [{"type": type(transformer).__name__}
+                         for transformer in settings.ALL_FEE_TRANSFORMERS],
+    }).apply_to(calculator)
+
+    assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+    # Without a version in the file, the version is the hash of the configuration.
+    assert calculator.version == configuration_version(settings.ALL_CALCULATION_STEPS,
+                                                       settings.ALL_FEE_TRANSFORMERS)
+
+
+def test__configuration_version_changes_with_the_options():
+    first = parse_pricing_config(SETTINGS_CONFIG)
+    second = parse_pricing_config(with_option(0, cart_value_surcharge_threshold=1200))
+    assert (configuration_version(first.calculation_steps, first.transformers) ==
+            configuration_version(settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS))
+    assert (configuration_version(first.calculation_steps, first.transformers) !=
+            configuration_version(second.calculation_steps, second.transformers))
+
+
+@pytest.mark.parametrize("data, message", [
+    ([], "must be an object"),
+    ({**SETTINGS_CONFIG, "steps": []}, "unknown keys: steps"),
+    ({**SETTINGS_CONFIG, "version": 3}, "version must be a non-empty string"),
+    ({**SETTINGS_CONFIG, "transformers": None}, "transformers must be a list"),
+    ({**SETTINGS_CONFIG, "calculation_steps": [{"type": "SpeedFee"}]},
+     r"calculation_steps\[0\]: unknown type 'SpeedFee'"),
+    ({**SETTINGS_CONFIG, "calculation_steps": [{"type": ["CartValueFee"]}]},
+     r"calculation_steps\[0\]: unknown type"),
+    ({**SETTINGS_CONFIG, "calculation_steps": [{"type": "CartValueFee", "option": {}}]},
+     r"calculation_steps\[0\] must be an object with a type and options"),
+    (with_option(1, additional_fees=100),
+     r"calculation_steps\[1\]: unknown options additional_fees"),
+    (with_option(2, bulk_charge="a lot"),
+     r"calculation_steps\[2\]: bulk_charge: Input should be a valid integer"),
+])
+def test__invalid_config_is_rejected(data, message: str):
+    with pytest.raises(PricingConfigError, match=message):
+        parse_pricing_config(data)
+
+
+def test__load_pricing_config(tmp_path):
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps(SETTINGS_CONFIG))
+    assert load_pricing_config(path).version == "settings"
+
+    path.write_text("{")
+    with pytest.raises(PricingConfigError, match="can't read"):
+        load_pricing_config(path)
+    with pytest.raises(PricingConfigError, match="can't read"):
+        load_pricing_config(tmp_path / "missing.json")
+
+
+def test__yaml_pricing_rules_are_the_settings(calculator: DeliveryFeeCalculator):
+    expected_fees = calculator.calculate_fees(ORDER_INFOS)
+    load_pricing_config(PRICING_RULES_PATH).apply_to(calculator)
+
+    assert calculator.version == configuration_version(settings.ALL_CALCULATION_STEPS,
+                                                       settings.ALL_FEE_TRANSFORMERS)
+    assert calculator.calculate_fees(ORDER_INFOS) == expected_fees
+
+
+def test__specification_passes_with_the_yaml_pricing_rules():
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider",
+         str(Path(__file__).parents[1] / "specification")],
+        env={**os.environ, "DELIVERY_FEE_PRICING_CONFIG": str(PRICING_RULES_PATH)},
+        capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout
+
+
+def test__yaml_scalars_are_read_like_json(tmp_path):
+    path = tmp_path / "pricing.yml"
+    path.write_text("""
+version: 2024-02-01
+calculation_steps:
+  - type: CartValueFee
+    options: {cart_value_surcharge_threshold: 12e2}
+transformers:
+  - type: RushHourFeeTransformer
+    options: {rush_day: Monday, rush_hour_start: 12:30, rush_hour_end: 13:30:00.5}
+""")
+    pricing_config = load_pricing_config(path)
+
+    assert pricing_config.version == "2024-02-01"
+    cart_value_options = pricing_config.calculation_steps[0].config_options
+    assert cart_value_options.cart_value_surcharge_threshold == 1200
+    rush_hour_options = pricing_config.transformers[0].config_options
+    assert (rush_hour_options.rush_hour_start.isoformat(),
+            rush_hour_options.rush_hour_end.isoformat()) == ("12:30:00", "13:30:00.500000")
+
+    path.write_text("calculation_steps: [")
+    with pytest.raises(PricingConfigError, match="can't read"):
+        load_pricing_config(path)
+    path.write_text("calculation_steps: []\ntransformers: []\nrules: []")
+    with pytest.raises(PricingConfigError, match="unknown keys: rules"):
+        load_pricing_config(path)
+
+
+def test__calculation_finishes_with_the_pipeline_it_started_with(
+        calculator: DeliveryFeeCalculator):
+    order_info = OrderInfo(cart_value=500, delivery_distance=1000, number_of_items=1,
+                           time="2024-01-15T13:00:00Z")
+    old_pipeline = calculator.pipeline
+    parse_pricing_config(with_option(0, cart_value_surcharge_threshold=1200)).apply_to(
+        calculator)
+
+    assert old_pipeline.calculate_fee(order_info) == 700
+    assert calculator.calculate_fee(order_info) == 900
+    assert calculator.pipeline.version == "settings"
+
+
+def test__invalid_reload_keeps_the_configuration(calculator: DeliveryFeeCalculator, tmp_path):
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps(SETTINGS_CONFIG))
+    watcher = PricingConfigWatcher(path, calculator)
+    assert watcher.reload() and calculator.version == "settings"
+
+    path.write_text(json.dumps({**with_option(0, cart_value_surcharge_threshold="high"),
+                                "version": "broken"}))
+    assert not watcher.reload()
+    assert calculator.version == "settings"
+    assert "cart_value_surcharge_threshold" in str(watcher.last_error)
+
+
+def test__watcher_reloads_the_changed_file(calculator: DeliveryFeeCalculator, tmp_path):
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps(SETTINGS_CONFIG))
+    watcher = PricingConfigWatcher(path, calculator)
+    watcher.reload()
+    watcher.start()
+    try:
+        # Replaced atomically, the way deployment tools usually write files.
+        new_path = tmp_path / "pricing.json.new"
+        new_path.write_text(json.dumps({**SETTINGS_CONFIG, "version": "v2"}))
+        new_path.replace(path)
+
+        deadline = time.monotonic() + 10
+        while calculator.version != "v2" and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+
+    assert calculator.version == "v2"
+
+
+@pytest.mark.parametrize("create", [create_app, create_lean_app])
+@pytest.mark.parametrize("path, body", [
+    ("/api/delivery/calculate_delivery_fee/", json.dumps(ORDER)),
+    ("/api/delivery/calculate_delivery_fees/", json.dumps([ORDER])),
+    ("/api/delivery/calculate_delivery_fees/stream/", json.dumps(ORDER) + "\n"),
+])
+def test__responses_carry_the_config_version(create, path: str, body: str):
+    response = TestClient(create()).post(path, content=body)
+
+    assert response.status_code == 200
+    assert response.headers[CONFIG_VERSION_HEADER] == DELIVERY_FEE_CALCULATOR.version
+
+
+def test__fastapi_route_without_fast_path_carries_the_config_version():
+    response = TestClient(create_app(quote_fast_path=False)).post(
+        "/api/delivery/calculate_delivery_fee/", json=ORDER)
+    assert response.headers[CONFIG_VERSION_HEADER] == DELIVERY_FEE_CALCULATOR.version
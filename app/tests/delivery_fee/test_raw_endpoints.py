@@ -0,0 +1,54 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.main import create_app, create_lean_app
+
+
+FASTAPI_CLIENT = TestClient(create_app(quote_fast_path=False))
+FAST_PATH_CLIENT = TestClient(create_app(quote_fast_path=True))
+LEAN_CLIENT = TestClient(create_lean_app())
+
+VALID_ORDER = {"cart_value": 790, "delivery_distance": 2235,
+               "number_of_items": 4, "time": "2024-01-15T13:00:00Z"}
+
+
+@pytest.mark.parametrize("path", ["/api/delivery/calculate_delivery_fee/",
+                                  "/api/delivery/calculate_delivery_fees/"])
+@pytest.mark.parametrize("request_kwargs", [
+    {},
+    {"content": b""},
+    {"content": b"{invalid json"},
+    {"content": b"[1, 2"},
+    {"content": b"null"},
+    {"content": b"{}"},
+    {"content": b"[]"},
+    {"content": b"\"text\""},
+    {"json": VALID_ORDER},
+    {"json": [VALID_ORDER, {**VALID_ORDER, "cart_value": -1}, None, "order"]},
+    {"json": {**VALID_ORDER, "cart_value": -1, "number_of_items": 1.5}},
+    {"json": {**VALID_ORDER, "delivery_distance": "", "time": "2024-01-15"}},
+    {"json": {**VALID_ORDER, "time": "invalid"}},
+    {"json": {**VALID_ORDER, "extra": "ignored"}},
+    {"json": VALID_ORDER, "headers": {"content-type": "text/plain"}},
+    {"json": VALID_ORDER, "headers": {"content-type": "application/json; charset=utf-8"}},
+    {"json": VALID_ORDER, "headers": {"content-type": "application/vnd.api+json"}},
+], ids=lambda request_kwargs: repr(request_kwargs)[:60])
+@pytest.mark.parametrize("client", [FAST_PATH_CLIENT, LEAN_CLIENT], ids=["fast_path", "lean"])
+def test__raw_endpoint_responses_are_same_as_fastapi_responses(
+        path: str, request_kwargs: dict, client: TestClient):
+    fastapi_response = FASTAPI_CLIENT.post(path, **request_kwargs)
+    raw_response = client.post(path, **request_kwargs)
+
+    assert raw_response.status_code == fastapi_response.status_code
+    assert raw_response.json() == fastapi_response.json()
+    assert raw_response.headers["content-type"] == fastapi_response.headers["content-type"]
+
+
+def test__quote_fast_path_has_same_docs():
+    assert (FAST_PATH_CLIENT.get("/openapi.json").json() ==
+            FASTAPI_CLIENT.get("/openapi.json").json())
+
+
+def test__quote_fast_path_only_allows_post():
+    response = FAST_PATH_CLIENT.get("/api/delivery/calculate_delivery_fee/")
+    assert response.status_code == FASTAPI_CLIENT.get(
+        "/api/delivery/calculate_delivery_fee/").status_code == 405
@@ -0,0 +1,84 @@
+import pytest
+from fastapi.testclient import TestClient
+from http import HTTPStatus
+from app import config
+from app.main import create_app, create_lean_app
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.server_timing import ServerTiming, is_requested
+
+
+QUOTE_PATH = "/api/delivery/calculate_delivery_fee/"
+ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4,
+         "time": "2024-01-15T13:00:00Z"}
+TIMED_CLIENTS = [TestClient(create_app(server_timing=True)),
+                 TestClient(create_lean_app(server_timing=True))]
+
+
+def timing_names(header: str) -> list[str]:
+    names = []
+    for metric in header.split(", "):
+        name, duration = metric.split(";")
+        assert duration.startswith("dur=") and float(duration[len("dur="):]) >= 0
+        names.append(name)
+    return names
+
+
+@pytest.mark.parametrize("client", TIMED_CLIENTS)
+def test__requested_timing_is_returned(client):
+    response = client.post(QUOTE_PATH, json=ORDER, headers={"X-Server-Timing": "1"})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"delivery_fee": 710}
+    assert timing_names(response.headers["server-timing"]) == [
+        "body", "validate",
+        *(f"{kind}.{name}" for kind, name in DELIVERY_FEE_CALCULATOR.stages),
+        "serialize"]
+
+
+@pytest.mark.parametrize("client", TIMED_CLIENTS)
+def test__invalid_request_is_timed_until_validation(client):
+    response = client.post(QUOTE_PATH, json={**ORDER, "cart_value": -1},
+                           headers={"X-Server-Timing": "1"})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert timing_names(response.headers["server-timing"]) == ["body", "validate"]
+
+
+@pytest.mark.parametrize("client", TIMED_CLIENTS)
+def test__requests_are_not_timed_without_header(client):
+    response = client.post(QUOTE_PATH, json=ORDER)
+    assert response.json() == {"delivery_fee": 710}
+    assert "server-timing" not in response.headers
+
+
+@pytest.mark.parametrize("client", TIMED_CLIENTS)
+def test__sampled_requests_are_timed(client, monkeypatch):
+    monkeypatch.setattr(config, "SERVER_TIMING_SAMPLE_RATE", 1.0)
+    assert "server-timing" in client.post(QUOTE_PATH, json=ORDER).headers
+    # The header can also opt out of the sampling.
+    assert "server-timing" not in client.post(QUOTE_PATH, json=ORDER,
+                                              headers={"X-Server-Timing": "0"}).headers
+
+
+@pytest.mark.parametrize("create", [create_app, create_lean_app])
+def test__header_is_ignored_when_server_timing_is_off(create):
+    response = TestClient(create(server_timing=False)).post(
+        QUOTE_PATH, json=ORDER, headers={"X-Server-Timing": "1"})
+    assert response.json() == {"delivery_fee": 710}
+    assert "server-timing" not in response.headers
+
+
+def test__is_requested():
+    assert is_requested({"x-server-timing": "1"}, 0)
+    assert not is_requested({"x-server-timing": "0"}, 1)
+    assert not is_requested({}, 0)
+    assert is_requested({}, 1)
+
+
+def test__header_value():
+    timing = ServerTiming()
+    timing.add("validate", 0.0000215)
+    with timing.measure("serialize"):
+        pass
+
+    assert timing.header_value().startswith("validate;dur=0.022, serialize;dur=0.")
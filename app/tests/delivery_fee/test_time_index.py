@@ -0,0 +1,112 @@
+from datetime import datetime, time, timedelta, timezone
+import numpy as np
+import pytest
+from functools import reduce
+from operator import mul
+import random
+from app.delivery_fee.time_index import (
+    MICROSECONDS_IN_DAY,
+    FactorIntervalIndex,
+    WeeklyIntervalIndex,
+    calendar_microsecond,
+    calendar_microsecond_many,
+    microsecond_of_week,
+    microsecond_of_week_many,
+)
+from app.delivery_fee.fee_transformers import RushHourFeeTransformer
+from app.delivery_fee import settings as settings
+
+
+FRIDAY = 4 * MICROSECONDS_IN_DAY
+
+
+def test__microsecond_of_week():
+    assert microsecond_of_week(datetime(2024, 1, 15)) == 0  # Monday
+    assert microsecond_of_week(
+        datetime(2024, 2, 2, 19, 59, 59, 999999, tzinfo=timezone.utc)
+    ) == FRIDAY + 20 * 60 * 60 * 1_000_000 - 1
+
+
+def test__microsecond_of_week_uses_wall_clock_time():
+    timestamp = datetime(2024, 2, 2, 21, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert microsecond_of_week(timestamp) == FRIDAY + 21 * 60 * 60 * 1_000_000
+
+
+def test__microsecond_of_week_many_matches_scalar():
+    timestamps = [datetime(1969, 12, 31, 23, 59, 59, 999999), datetime(1970, 1, 1),
+                  datetime(2024, 2, 2, 15), datetime(2024, 2, 4, 23, 59)]
+    assert microsecond_of_week_many(
+        np.array(timestamps, dtype='datetime64[us]')
+    ).tolist() == [microsecond_of_week(timestamp) for timestamp in timestamps]
+
+
+def test__interval_index_bounds_are_inclusive():
+    index = WeeklyIntervalIndex([(10, 20), (30, 40)])
+    for microsecond in [10, 15, 20, 30, 40]:
+        assert microsecond in index
+    for microsecond in [0, 9, 21, 29, 41]:
+        assert microsecond not in index
+
+    microseconds = np.arange(0, 50)
+    assert index.contains_many(microseconds).tolist() == [
+        microsecond in index for microsecond in microseconds]
+
+
+def test__interval_index_merges_overlapping_intervals():
+    index = WeeklyIntervalIndex([(30, 40), (10, 20), (15, 25), (26, 28), (50, 45)])
+    assert index.intervals == [(10, 28), (30, 40)]
+
+
+def test__empty_interval_index():
+    index = WeeklyIntervalIndex()
+    assert 0 not in index
+    assert index.contains_many(np.arange(3)).tolist() == [False] * 3
+    assert len(WeeklyIntervalIndex.for_weekday("friday", time(15), time(20))) == 0
+    assert len(WeeklyIntervalIndex.for_weekday("Friday", time(20), time(15))) == 0
+
+
+def test__rush_hour_matches_pandas_implementation():
+    pandas = pytest.importorskip("pandas")
+    config_options = settings.FRIDAY_RUSH_HOUR_CONFIG_OPTIONS
+    rush_hours = RushHourFeeTransformer(config_options)._rush_hours
+
+    first_timestamp = datetime(2024, 1, 26, 14, 59, 59, 999990, tzinfo=timezone.utc)
+    for offset in [*range(0, 30), *range(5 * 60 * 60 * 10**6 - 30, 5 * 60 * 60 * 10**6 + 30)]:
+        timestamp = first_timestamp + timedelta(microseconds=offset)
+        pandas_timestamp = pandas.Timestamp(timestamp)
+        expected = (pandas_timestamp.day_name() == config_options.rush_day and
+                    config_options.rush_hour_start <= pandas_timestamp.time()
+                    <= config_options.rush_hour_end)
+        assert (microsecond_of_week(timestamp) in rush_hours) == expected
+
+
+def test__calendar_microsecond_many_matches_scalar():
+    timestamps = [datetime(1969, 12, 31, 23, 59, 59, 999999), datetime(1970, 1, 1),
+                  datetime(2024, 2, 29, 15), datetime(2024, 12, 31, 23, 59)]
+    assert calendar_microsecond(datetime(1, 1, 1)) == MICROSECONDS_IN_DAY
+    assert calendar_microsecond_many(
+        np.array(timestamps, dtype='datetime64[us]')
+    ).tolist() == [calendar_microsecond(timestamp) for timestamp in timestamps]
+
+
+@pytest.mark.parametrize("combine, identity", [(max, -1.0), (mul, 1.0)])
+def test__factor_interval_index_combines_overlapping_factors(combine, identity: float):
+    rng = random.Random(22)
+    intervals = []
+    for _ in range(50):
+        start = rng.randrange(1000)
+        intervals.append((start, start + rng.randrange(-5, 100), rng.choice([0.5, 1.2, 2.0])))
+    index = FactorIntervalIndex(intervals, combine, identity)
+
+    values = list(range(-10, 1200))
+    expected_factors = [reduce(combine, (factor for start, end, factor in intervals
+                                         if start <= value <= end), identity)
+                        for value in values]
+    assert [index.factor_at(value) for value in values] == expected_factors
+    assert index.factors_many(np.array(values)).tolist() == expected_factors
+    assert len(index) < 2 * len(intervals)
+
+
+def test__factor_interval_index_without_intervals():
+    index = FactorIntervalIndex([(5, 4, 2.0)], max, -1.0)
+    assert len(index) == 0 and index.factor_at(5) == -1.0
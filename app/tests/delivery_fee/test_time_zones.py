@@ -0,0 +1,48 @@
+import random
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
+import pytest
+from app.delivery_fee.time_index import calendar_microsecond
+from app.delivery_fee.time_zones import LAST_YEAR, ZoneOffsets, zone_offsets
+
+
+@pytest.mark.parametrize("name", ["Europe/Helsinki", "America/New_York", "Australia/Lord_Howe",
+                                  "Africa/Casablanca", "Asia/Kolkata", "UTC"])
+def test__local_times_match_the_timezone_database(name: str):
+    offsets = zone_offsets(name)
+    rng = random.Random(23)
+    utc_times = [datetime(1970, 1, 1) + timedelta(seconds=rng.randrange(130 * 365 * 86400))
+                 for _ in range(5000)]
+
+    expected_local_times = [
+        calendar_microsecond(utc_time.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(name)))
+        for utc_time in utc_times]
+    utc_microseconds = [calendar_microsecond(utc_time) for utc_time in utc_times]
+    assert [offsets.local_calendar_microsecond(utc_microsecond)
+            for utc_microsecond in utc_microseconds] == expected_local_times
+    assert offsets.local_calendar_microsecond_many(
+        np.array(utc_microseconds, dtype=np.int64)).tolist() == expected_local_times
+
+
+def test__offsets_change_at_the_exact_transition():
+    offsets = zone_offsets("Europe/Helsinki")
+    # Daylight saving time started at 2024-03-31 01:00 UTC and ended at 2024-10-27 01:00 UTC.
+    for transition, before, after in [(datetime(2024, 3, 31, 1), 2, 3),
+                                      (datetime(2024, 10, 27, 1), 3, 2)]:
+        assert offsets.offset_at(calendar_microsecond(transition) - 1) == before * 3600_000_000
+        assert offsets.offset_at(calendar_microsecond(transition)) == after * 3600_000_000
+    # The last offset of the table is used after it.
+    assert offsets.offset_at(calendar_microsecond(datetime(LAST_YEAR + 5, 7, 1))) == (
+        2 * 3600_000_000)
+
+
+def test__fixed_and_unknown_zones():
+    assert zone_offsets("UTC").is_fixed and zone_offsets("UTC").offsets == (0,)
+    assert zone_offsets("Asia/Kolkata").offsets == (int(5.5 * 3600_000_000),)
+    assert len(zone_offsets("Europe/Helsinki")) > 200
+    assert zone_offsets("Europe/Helsinki") is zone_offsets("Europe/Helsinki")
+
+    for name in ["Mars/Olympus_Mons", "", "../etc/passwd"]:
+        with pytest.raises(ValueError, match="is not a timezone name"):
+            ZoneOffsets(name)
@@ -0,0 +1,149 @@
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.batch_pricing import main, order_columns_of, price_file, read_record_batches
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.models import OrderInfo
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(1000)
+EXPECTED_FEES = [DELIVERY_FEE_CALCULATOR.calculate_fee(order_info)
+                 for order_info in ORDER_INFOS]
+
+
+def orders_table(time_type: pa.DataType = pa.timestamp("us")) -> pa.Table:
+    times = [order_info.time.replace(tzinfo=None) for order_info in ORDER_INFOS]
+    if pa.types.is_string(time_type):
+        times = [time.isoformat() for time in times]
+    return pa.table({
+        "order_id": list(range(len(ORDER_INFOS))),
+        "cart_value": [order_info.cart_value for order_info in ORDER_INFOS],
+        "delivery_distance": [order_info.delivery_distance for order_info in ORDER_INFOS],
+        "number_of_items": [order_info.number_of_items for order_info in ORDER_INFOS],
+        "time": pa.array(times, type=time_type),
+    })
+
+
+def write_input(table: pa.Table, path, file_format: str, batch_size: int = 300):
+    if file_format == "parquet":
+        pq.write_table(table, path, row_group_size=batch_size)
+        return
+    open_writer = pa.ipc.new_file if file_format == "arrow_file" else pa.ipc.new_stream
+    with open_writer(path, table.schema) as writer:
+        writer.write_table(table, max_chunksize=batch_size)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow_file", "arrow_stream"])
+def test__priced_file_has_same_fees_as_calculator(tmp_path, file_format):
+    write_input(orders_table(), tmp_path / "orders", file_format)
+
+    report = price_file(tmp_path / "orders", tmp_path / "priced.parquet", batch_size=128)
+
+    priced = pq.read_table(tmp_path / "priced.parquet")
+    assert priced.column_names == ["order_id", "cart_value", "delivery_distance",
+                                   "number_of_items", "time", "delivery_fee"]
+    assert priced.column("delivery_fee").to_pylist() == EXPECTED_FEES
+    assert priced.column("order_id").to_pylist() == list(range(len(ORDER_INFOS)))
+    assert report.rows == len(ORDER_INFOS)
+    assert report.batches > 1
+
+
+def test__parquet_is_read_in_batches_of_batch_size(tmp_path):
+    write_input(orders_table(), tmp_path / "orders.parquet", "parquet", batch_size=1000)
+    batch_sizes = [batch.num_rows for batch in
+                   read_record_batches(tmp_path / "orders.parquet", batch_size=256)]
+    assert batch_sizes == [256, 256, 256, 232]
+
+
+@pytest.mark.parametrize("time_type", [pa.timestamp("ns"), pa.string()])
+def test__time_column_types(tmp_path, time_type):
+    write_input(orders_table(time_type), tmp_path / "orders.parquet", "parquet")
+    price_file(tmp_path / "orders.parquet", tmp_path / "priced.parquet")
+    assert (pq.read_table(tmp_path / "priced.parquet").column("delivery_fee").to_pylist() ==
+            EXPECTED_FEES)
+
+
+def test__timezone_aware_times_use_wall_clock_time(tmp_path):
+    # Friday 16:30 in Helsinki is in the rush hour, 14:30 in UTC is not.
+    time = pa.array([1705674600_000_000], type=pa.timestamp("us", tz="Europe/Helsinki"))
+    table = pa.table({"cart_value": [790], "delivery_distance": [2235],
+                      "number_of_items": [4], "time": time})
+    write_input(table, tmp_path / "orders.parquet", "parquet")
+
+    price_file(tmp_path / "orders.parquet", tmp_path / "priced.parquet")
+
+    order_info = OrderInfo(cart_value=790, delivery_distance=2235, number_of_items=4,
+                           time="2024-01-19T16:30:00+02:00")
+    assert (pq.read_table(tmp_path / "priced.parquet").column("delivery_fee").to_pylist() ==
+            [DELIVERY_FEE_CALCULATOR.calculate_fee(order_info)] == [852])
+
+
+def test__timezone_aware_times_keep_their_utc_offsets():
+    # 14:30 UTC in winter and in summer.
+    times = pa.array([1705674600_000_000, 1718807400_000_000], type=pa.timestamp("us"))
+
+    def order_columns_with(time_zone: str):
+        return order_columns_of(pa.RecordBatch.from_pydict({
+            "cart_value": [790, 790], "delivery_distance": [2235, 2235],
+            "number_of_items": [4, 4], "time": times.cast(pa.timestamp("us", tz=time_zone))}))
+
+    order_columns = order_columns_with("Europe/Helsinki")
+    assert order_columns.utc_offset.tolist() == [2 * 3600 * 10**6, 3 * 3600 * 10**6]
+    assert order_columns.order_record(1).time.isoformat() == "2024-06-19T17:30:00+03:00"
+    assert order_columns_with("UTC").utc_offset is None
+
+
+def test__existing_fee_column_is_replaced(tmp_path):
+    table = orders_table().append_column("fee", pa.array([-1] * len(ORDER_INFOS)))
+    write_input(table, tmp_path / "orders.parquet", "parquet")
+
+    price_file(tmp_path / "orders.parquet", tmp_path / "priced.parquet", fee_column="fee")
+
+    priced = pq.read_table(tmp_path / "priced.parquet")
+    assert priced.column_names.count("fee") == 1
+    assert priced.column("fee").to_pylist() == EXPECTED_FEES
+
+
+def test__empty_input(tmp_path):
+    write_input(orders_table().slice(0, 0), tmp_path / "orders", "arrow_stream")
+    report = price_file(tmp_path / "orders", tmp_path / "priced.parquet")
+
+    assert report.rows == 0
+    priced = pq.read_table(tmp_path / "priced.parquet")
+    assert priced.num_rows == 0 and "delivery_fee" in priced.column_names
+
+
+@pytest.mark.parametrize("table, message", [
+    (orders_table().drop_columns(["time"]), "missing columns: time"),
+    (orders_table().set_column(1, "cart_value", pa.array([None] * len(ORDER_INFOS),
+                                                         type=pa.int64())),
+     "cart_value must not contain nulls"),
+    (orders_table().set_column(1, "cart_value", pa.array([-1] * len(ORDER_INFOS))),
+     "cart_value must be non-negative"),
+])
+def test__invalid_orders(tmp_path, table, message):
+    write_input(table, tmp_path / "orders.parquet", "parquet")
+    with pytest.raises(ValueError, match=f"rows 0-299: {message}"):
+        price_file(tmp_path / "orders.parquet", tmp_path / "priced.parquet", batch_size=300)
+
+
+def test__failed_pricing_leaves_no_partial_output(tmp_path):
+    # The first batch is written before the second one fails.
+    table = orders_table()
+    table = table.set_column(1, "cart_value", pa.array(
+        [-1 if row == 500 else order_info.cart_value
+         for row, order_info in enumerate(ORDER_INFOS)]))
+    write_input(table, tmp_path / "orders.parquet", "parquet")
+    with pytest.raises(ValueError, match="rows 300-599: cart_value must be non-negative"):
+        price_file(tmp_path / "orders.parquet", tmp_path / "priced.parquet", batch_size=300)
+
+    assert list(tmp_path.iterdir()) == [tmp_path / "orders.parquet"]
+
+
+def test__main_reports_rows_per_second(tmp_path, capsys):
+    write_input(orders_table(), tmp_path / "orders.parquet", "parquet")
+    main([str(tmp_path / "orders.parquet"), str(tmp_path / "priced.parquet")])
+    report = capsys.readouterr().err
+    assert report.startswith("Priced 1,000 orders in 1 batches in ")
+    assert report.endswith(" orders/s)\n")
@@ -0,0 +1,170 @@
+import json
+import os
+import pytest
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet as pq
+from app.batch_runner import CHECKPOINT_FILE_NAME, Shard, main, plan_shards, run
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.fee_transformers import LimitFeeTransformer
+from app.delivery_fee import settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+ORDER_INFOS = random_order_infos(600)
+
+
+def orders_table(start: int, stop: int) -> pa.Table:
+    order_infos = ORDER_INFOS[start:stop]
+    return pa.table({
+        "order_id": list(range(start, stop)),
+        "cart_value": [order_info.cart_value for order_info in order_infos],
+        "delivery_distance": [order_info.delivery_distance for order_info in order_infos],
+        "number_of_items": [order_info.number_of_items for order_info in order_infos],
+        "time": pa.array([order_info.time.replace(tzinfo=None) for order_info in order_infos],
+                         type=pa.timestamp("us")),
+    })
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    input_dir = tmp_path / "orders"
+    (input_dir / "2024").mkdir(parents=True)
+    # 10 row groups of 30 orders.
+    pq.write_table(orders_table(0, 300), input_dir / "2024" / "01.parquet", row_group_size=30)
+    pq.write_table(orders_table(300, 400), input_dir / "2024" / "02.parquet")
+    with pa.ipc.new_file(input_dir / "2024" / "03.arrow", orders_table(0, 1).schema) as writer:
+        writer.write_table(orders_table(400, 500))
+    table = orders_table(500, 600)
+    table = table.set_column(4, "time", pa.array(
+        [time.isoformat() + "Z" for time in table.column("time").to_pylist()]))
+    pyarrow.csv.write_csv(table, input_dir / "2024" / "04.csv")
+    (input_dir / "README.txt").write_text("not an order file")
+    return input_dir
+
+
+def read_output(output_dir) -> dict[int, int]:
+    fees = {}
+    for path in output_dir.glob("*.parquet"):
+        table = pq.read_table(path)
+        fees.update(zip(table.column("order_id").to_pylist(),
+                        table.column("delivery_fee").to_pylist()))
+    return fees
+
+
+def expected_fees() -> dict[int, int]:
+    return {order_id: DELIVERY_FEE_CALCULATOR.calculate_fee(order_info)
+            for order_id, order_info in enumerate(ORDER_INFOS)}
+
+
+def test__plan_shards(input_dir):
+    shards = plan_shards(input_dir, row_groups_per_shard=4)
+    assert [shard.id for shard in shards] == [
+        "2024/01.parquet#0-3", "2024/01.parquet#4-7", "2024/01.parquet#8-9",
+        "2024/02.parquet", "2024/03.arrow", "2024/04.csv"]
+    assert shards[1].row_groups == range(4, 8)
+    assert shards[1].output_file_name == "2024__01.parquet.row_groups_4-7.parquet"
+
+
+def test__plan_shards_of_single_file(input_dir):
+    assert plan_shards(input_dir / "2024" / "02.parquet") == [
+        Shard(input_dir / "2024" / "02.parquet", "02.parquet")]
+
+
+def test__run_prices_all_shards(input_dir, tmp_path):
+    report = run(input_dir, tmp_path / "priced", workers=2, row_groups_per_shard=4)
+
+    assert report.shards == 6 and report.skipped_shards == 0 and report.rows == 600
+    assert read_output(tmp_path / "priced") == expected_fees()
+    assert not list((tmp_path / "priced").glob("*.tmp"))
+
+
+def test__run_resumes_from_checkpoint(input_dir, tmp_path):
+    # The CSV shard fails, the other shards are still completed.
+    csv_path = input_dir / "2024" / "04.csv"
+    valid_csv = csv_path.read_bytes()
+    invalid_table = pyarrow.csv.read_csv(csv_path)
+    pyarrow.csv.write_csv(invalid_table.set_column(1, "cart_value", pa.array(
+        [-1] * invalid_table.num_rows)), csv_path)
+    with pytest.raises(ValueError, match="shard 2024/04.csv failed: .*must be non-negative"):
+        run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+
+    checkpoint = json.loads((tmp_path / "priced" / CHECKPOINT_FILE_NAME).read_text())
+    assert "2024/04.csv" not in checkpoint["completed_shards"]
+    assert not list((tmp_path / "priced").glob("*.tmp"))
+    assert len(checkpoint["completed_shards"]) >= 1
+
+    csv_path.write_bytes(valid_csv)
+    report = run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+    assert report.skipped_shards == len(checkpoint["completed_shards"])
+    assert report.shards - report.skipped_shards == 6 - len(checkpoint["completed_shards"])
+    assert read_output(tmp_path / "priced") == expected_fees()
+
+
+def test__shards_finished_after_a_failure_are_recorded(tmp_path):
+    # The small CSV shard fails while the large shard is still running in the
+    # other worker, which finishes it before the run stops.
+    input_dir = tmp_path / "slow_orders"
+    input_dir.mkdir()
+    pq.write_table(pa.concat_tables([orders_table(0, 600)] * 500),
+                   input_dir / "large.parquet")
+    invalid_table = orders_table(0, 10)
+    pyarrow.csv.write_csv(invalid_table.set_column(1, "cart_value", pa.array([-1] * 10)),
+                          input_dir / "invalid.csv")
+    with pytest.raises(ValueError, match="shard invalid.csv failed"):
+        run(input_dir, tmp_path / "priced", workers=2, row_groups_per_shard=4)
+
+    checkpoint = json.loads((tmp_path / "priced" / CHECKPOINT_FILE_NAME).read_text())
+    assert list(checkpoint["completed_shards"]) == ["large.parquet"]
+    assert [path.name for path in (tmp_path / "priced").iterdir()
+            if path.name != CHECKPOINT_FILE_NAME] == ["large.parquet.parquet"]
+
+
+def test__changed_input_is_priced_again(input_dir, tmp_path):
+    run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+    pq.write_table(orders_table(300, 350), input_dir / "2024" / "02.parquet")
+    os.utime(input_dir / "2024" / "02.parquet", ns=(0, 0))
+
+    report = run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+    assert report.skipped_shards == 5 and report.rows == 50
+
+
+def test__rerun_with_other_options_replaces_the_shards(input_dir, tmp_path):
+    run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+    report = run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=100)
+
+    assert report.shards == 4 and report.skipped_shards == 0
+    assert len(list((tmp_path / "priced").glob("*.parquet"))) == 4
+    assert sum(pq.read_metadata(path).num_rows
+               for path in (tmp_path / "priced").glob("*.parquet")) == 600
+
+
+def test__workers_use_the_pipeline_of_the_calculator(input_dir, tmp_path):
+    pipeline = DELIVERY_FEE_CALCULATOR.pipeline
+    lower_limit = LimitFeeTransformer(LimitFeeTransformer.ConfigOptions(
+        highest_limit_of_delivery_fee=500))
+    try:
+        # Like a pricing config file applied to the calculator of this process.
+        DELIVERY_FEE_CALCULATOR.configure(settings.ALL_CALCULATION_STEPS,
+                                          [*settings.ALL_FEE_TRANSFORMERS[:-1], lower_limit],
+                                          version="limit-5")
+        limited_fees = expected_fees()
+        assert max(limited_fees.values()) == 500
+        run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+        assert read_output(tmp_path / "priced") == limited_fees
+    finally:
+        DELIVERY_FEE_CALCULATOR.configure(pipeline.calculation_steps, pipeline.transformers,
+                                          pipeline.version)
+
+    # Shards priced with another configuration are not reused.
+    report = run(input_dir, tmp_path / "priced", workers=1, row_groups_per_shard=4)
+    assert report.skipped_shards == 0
+    assert read_output(tmp_path / "priced") == expected_fees() != limited_fees
+
+
+def test__main(input_dir, tmp_path, capsys):
+    main([str(input_dir), str(tmp_path / "priced"), "--workers", "1"])
+    main([str(input_dir), str(tmp_path / "priced"), "--workers", "1"])
+    first, second = capsys.readouterr().err.splitlines()
+    assert first.startswith("Priced 600 orders in 5 shards (0 already done)")
+    assert second.startswith("Priced 0 orders in 0 shards (5 already done)")
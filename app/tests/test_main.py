@@ -1,3 +1,7 @@
+import os
+import subprocess
+import sys
+import pytest
 from fastapi.testclient import TestClient
 from http import HTTPStatus
 from app.main import app
@@ -10,3 +14,18 @@ def test_docs_redirect():
     response = client.get("/", follow_redirects=False)
     assert response.status_code == HTTPStatus.PERMANENT_REDIRECT
     assert response.headers["location"] == "/docs"
+
+
+@pytest.mark.parametrize("startup_mode", ["standard", "lean"])
+def test_heavy_modules_are_not_imported_at_startup(startup_mode: str):
+    code = ("import sys, app.main; print(' '.join(module for module in "
+            "('numpy', 'pandas', 'uvicorn', 'fastapi') if module in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True, env={**os.environ,
+                                             "DELIVERY_FEE_STARTUP_MODE": startup_mode})
+    imported_modules = result.stdout.split()
+
+    assert "numpy" not in imported_modules
+    assert "pandas" not in imported_modules
+    assert "uvicorn" not in imported_modules
+    assert ("fastapi" in imported_modules) == (startup_mode == "standard")
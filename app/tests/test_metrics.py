@@ -0,0 +1,162 @@
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from app.delivery_fee import city_pricing, settings
+from app.delivery_fee.city_pricing import CityPricingStore, write_city_table
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, DeliveryFeeCalculator
+from app.main import create_app, create_lean_app
+from app.metrics import (LATENCY_BUCKETS, PROMETHEUS_CONTENT_TYPE, LatencyHistogram,
+                         RequestMetrics, StageMetrics)
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+QUOTE_PATH = "/api/delivery/calculate_delivery_fee/"
+ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4,
+         "time": "2024-01-15T13:00:00Z"}
+
+
+@pytest.fixture
+def calculator():
+    calculator = DELIVERY_FEE_CALCULATOR
+    sample_every = calculator.stage_metrics.sample_every if calculator.stage_metrics else None
+    yield calculator
+    if sample_every is None:
+        calculator.disable_metrics()
+    else:
+        calculator.enable_metrics(sample_every)
+
+
+def test__histogram_buckets_are_cumulative():
+    histogram = LatencyHistogram()
+    for seconds in (0.00005, 0.0001, 0.0003, 1000):
+        histogram.observe(seconds)
+
+    cumulative_counts, count, total = histogram.snapshot()
+    assert len(cumulative_counts) == len(LATENCY_BUCKETS) + 1
+    # The upper bounds are inclusive.
+    assert cumulative_counts[:3] == [2, 2, 3]
+    assert cumulative_counts[-2:] == [3, 4]
+    assert count == 4 and total == pytest.approx(1000.00045)
+
+
+def test__histogram_sums_the_counts_of_all_threads():
+    histogram = LatencyHistogram()
+
+    def observe():
+        for _ in range(1000):
+            histogram.observe(0.001)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert histogram.snapshot()[1] == 4000
+
+
+def test__stage_metrics_times_every_nth_calculation():
+    stage_metrics = StageMetrics([("step", "A"), ("step", "A"), ("transformer", "B")], 3)
+    assert stage_metrics.stages == [("step", "A"), ("step", "A#2"), ("transformer", "B")]
+
+    timed = [stage_metrics.count_calculation() for _ in range(7)]
+    assert timed == [False, False, True, False, False, True, False]
+    stage_metrics.record_timed_calculation([0.5, 0.25, 1.0])
+    stage_metrics.record_timed_calculation([0.5, 0.25, 1.0])
+
+    assert stage_metrics.totals() == (7, 2, [1.0, 0.5, 2.0])
+    with pytest.raises(ValueError):
+        StageMetrics([], 0)
+
+
+def test__request_metrics_are_rendered_in_prometheus_format():
+    request_metrics = RequestMetrics()
+    request_metrics.observe("POST", '/say "hi"', 200, 0.002)
+
+    lines = request_metrics.render()
+    assert 'delivery_fee_http_requests_total{method="POST",path="/say \\"hi\\"",status="200"} 1' \
+        in lines
+    assert ('delivery_fee_http_request_duration_seconds_bucket{method="POST",'
+            'path="/say \\"hi\\"",status="200",le="0.001"} 0') in lines
+    assert ('delivery_fee_http_request_duration_seconds_bucket{method="POST",'
+            'path="/say \\"hi\\"",status="200",le="+Inf"} 1') in lines
+
+
+def uncached_calculator(metrics_sample_every: int | None) -> DeliveryFeeCalculator:
+    DeliveryFeeCalculator.clear_singleton_instance()
+    calculator = DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS,
+                                       settings.ALL_FEE_TRANSFORMERS,
+                                       metrics_sample_every=metrics_sample_every)
+    DeliveryFeeCalculator.clear_singleton_instance()
+    return calculator
+
+
+def test__timed_calculations_calculate_the_same_fees():
+    order_infos = random_order_infos(200)
+    calculator = uncached_calculator(metrics_sample_every=None)
+    assert calculator.stage_metrics is None
+    expected_fees = [calculator.calculate_fee(order_info) for order_info in order_infos]
+
+    calculator.enable_metrics(sample_every=1)
+    fees = [calculator.calculate_fee(order_info) for order_info in order_infos]
+
+    assert fees == expected_fees
+    calculations, timed_calculations, stage_seconds = calculator.stage_metrics.totals()
+    assert calculations == timed_calculations == 200
+    assert len(stage_seconds) == len(calculator.calculation_steps) + len(calculator.transformers)
+    assert all(seconds > 0 for seconds in stage_seconds)
+
+
+def test__configure_resets_the_stage_metrics():
+    calculator = uncached_calculator(metrics_sample_every=1)
+    calculator.calculate_fees(random_order_infos(10))
+    assert calculator.stage_metrics.totals()[0] == 10
+    calculator.configure(calculator.calculation_steps, calculator.transformers)
+
+    assert calculator.stage_metrics.totals()[0] == 0
+
+
+@pytest.mark.parametrize("create", [create_app, create_lean_app])
+def test__metrics_endpoint(create, calculator):
+    calculator.enable_metrics(sample_every=1)
+    client = TestClient(create())
+    client.post(QUOTE_PATH, json=ORDER)
+    client.post(QUOTE_PATH, json={**ORDER, "cart_value": -1})
+    client.post("/api/delivery/not_a_route/", json=ORDER)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == PROMETHEUS_CONTENT_TYPE
+    lines = response.text.splitlines()
+    assert any(line.startswith('delivery_fee_http_requests_total{method="POST",'
+                               f'path="{QUOTE_PATH}",status="200"}} ') for line in lines)
+    assert any(line.startswith('delivery_fee_http_requests_total{method="POST",'
+                               f'path="{QUOTE_PATH}",status="422"}} ') for line in lines)
+    assert not any("not_a_route" in line or 'path="/metrics"' in line for line in lines)
+    assert any(line.startswith('delivery_fee_stage_calls_total{kind="step",') for line in lines)
+    assert any(line.startswith('delivery_fee_stage_seconds_total{kind="transformer",')
+               for line in lines)
+
+
+@pytest.mark.parametrize("create", [create_app, create_lean_app])
+def test__city_quotes_are_recorded_by_their_route(create, tmp_path, monkeypatch):
+    table_path = tmp_path / "cities.bin"
+    write_city_table(table_path, {
+        "helsinki": (settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS)})
+    monkeypatch.setattr(city_pricing, "CITY_PRICING_STORE", CityPricingStore(table_path))
+    client = TestClient(create())
+    assert client.post(QUOTE_PATH + "cities/helsinki/", json=ORDER).status_code == 200
+    assert client.post(QUOTE_PATH + "cities/atlantis/", json=ORDER).status_code == 404
+
+    lines = client.get("/metrics").text.splitlines()
+    city_path = QUOTE_PATH + "cities/{city}/"
+    assert any(line.startswith('delivery_fee_http_requests_total{method="POST",'
+                               f'path="{city_path}",status="200"}} ') for line in lines)
+    assert any(line.startswith('delivery_fee_http_requests_total{method="POST",'
+                               f'path="{city_path}",status="404"}} ') for line in lines)
+    assert not any("helsinki" in line or "atlantis" in line for line in lines)
+
+
+def test__metrics_endpoint_is_not_in_openapi_schema():
+    assert "/metrics" not in TestClient(create_app()).get("/openapi.json").json()["paths"]
+
@@ -0,0 +1,145 @@
+import json
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR, PricingPipeline
+from app.delivery_fee.fee_transformers import (
+    LimitFeeTransformer,
+    ReduceFeeTransformer,
+    RushHourFeeTransformer,
+)
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee import settings
+from app.tests.delivery_fee.test_pricing_config import PRICING_RULES_PATH
+from app.tests.test_batch_pricing import ORDER_INFOS, EXPECTED_FEES, orders_table, write_input
+from app.what_if import WhatIfSimulator, load_order_columns, main
+
+
+HIGHER_LIMIT = LimitFeeTransformer(LimitFeeTransformer.ConfigOptions(
+    highest_limit_of_delivery_fee=2000))
+CANDIDATE = PricingPipeline.build(settings.ALL_CALCULATION_STEPS, [
+    *settings.ALL_FEE_TRANSFORMERS[:-1], HIGHER_LIMIT])
+CANDIDATE_CONFIG = {
+    "version": "limit-20",
+    "calculation_steps": [{"type": "CartValueFee"}, {"type": "DeliveryDistanceFee"},
+                          {"type": "NumberOfItemsFee"}],
+    "transformers": [{"type": "RushHourFeeTransformer"}, {"type": "ReduceFeeTransformer"},
+                     {"type": "LimitFeeTransformer",
+                      "options": {"highest_limit_of_delivery_fee": 2000}}],
+}
+
+
+@pytest.fixture(scope="module")
+def orders_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("orders") / "orders.parquet"
+    write_input(orders_table(), path, "parquet")
+    return path
+
+
+@pytest.fixture(scope="module")
+def simulator(orders_path):
+    return WhatIfSimulator.from_file(orders_path, batch_size=128)
+
+
+def test__orders_are_loaded_once_in_file_order(orders_path, simulator: WhatIfSimulator):
+    assert len(simulator.order_columns) == len(ORDER_INFOS)
+    assert simulator.order_columns.cart_value.tolist() == [
+        order_info.cart_value for order_info in ORDER_INFOS]
+    assert simulator.baseline.fees.tolist() == EXPECTED_FEES
+    assert simulator.baseline.version == DELIVERY_FEE_CALCULATOR.version
+
+
+def test__candidate_is_compared_with_the_baseline(simulator: WhatIfSimulator):
+    report = simulator.evaluate("limit-20", CANDIDATE)
+    expected_fees = [CANDIDATE.calculate_fee(order_info) for order_info in ORDER_INFOS]
+
+    assert report.candidate.fees.tolist() == expected_fees
+    assert report.deltas.tolist() == [fee - expected_fee for fee, expected_fee
+                                      in zip(expected_fees, EXPECTED_FEES)]
+    assert report.revenue_change == sum(expected_fees) - sum(EXPECTED_FEES) > 0
+    assert report.share_of_higher_fees == pytest.approx(
+        np.mean(np.array(expected_fees) > np.array(EXPECTED_FEES)))
+    assert report.share_of_lower_fees == 0
+    assert "limit-20" in report.format() and "revenue" in report.format()
+
+
+def test__share_of_orders_hit_by_every_transformer(simulator: WhatIfSimulator):
+    limit = settings.LIMIT_FEE_CONFIG_OPTIONS.highest_limit_of_delivery_fee
+    threshold = settings.EXCLUDE_FEE_CONFIG_OPTIONS.exclusion_cart_value_threshold
+    fees_before_limit = [PricingPipeline.build(
+        settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS[:-1]
+    ).calculate_fee(order_info) for order_info in ORDER_INFOS]
+
+    shares = dict(simulator.baseline.transformer_shares)
+    assert list(shares) == ["RushHourFeeTransformer", "ReduceFeeTransformer",
+                            "LimitFeeTransformer"]
+    assert shares["LimitFeeTransformer"] == pytest.approx(
+        np.mean(np.array(fees_before_limit) >= limit))
+    assert shares["ReduceFeeTransformer"] == pytest.approx(np.mean([
+        order_info.cart_value >= threshold for order_info in ORDER_INFOS]))
+
+    # Repeated transformers are numbered.
+    twice = PricingPipeline.build([], [RushHourFeeTransformer(), ReduceFeeTransformer(),
+                                       RushHourFeeTransformer()])
+    assert [label for label, _ in simulator.price("twice", twice).transformer_shares] == [
+        "RushHourFeeTransformer", "ReduceFeeTransformer", "RushHourFeeTransformer #2"]
+
+
+def test__orders_at_the_cap_or_free_already_are_counted():
+    # Before the cap, the fee of the first order is exactly the cap and the fee
+    # of the last one is over it. The second order is over the waiver threshold,
+    # which still applies when the order is free already without any steps.
+    order_columns = OrderInfoColumns.from_arrays(
+        [1000, 20000, 1000], [7000, 0, 7500], [6, 0, 6], ["2024-01-15T13:00:00Z"] * 3)
+    simulator = WhatIfSimulator(order_columns)
+    shares = dict(simulator.baseline.transformer_shares)
+    assert simulator.baseline.fees.tolist() == [1500, 0, 1500]
+    assert shares["LimitFeeTransformer"] == pytest.approx(2 / 3)
+    assert shares["ReduceFeeTransformer"] == pytest.approx(1 / 3)
+
+    free = simulator.price("free", PricingPipeline.build([], settings.ALL_FEE_TRANSFORMERS))
+    assert free.fees.tolist() == [0, 0, 0]
+    assert dict(free.transformer_shares) == {"RushHourFeeTransformer": 0,
+                                             "ReduceFeeTransformer": pytest.approx(1 / 3),
+                                             "LimitFeeTransformer": 0}
+    assert "orders hit by LimitFeeTransformer: 66.67% -> 0.00%" in \
+        simulator.evaluate("free", PricingPipeline.build([], settings.ALL_FEE_TRANSFORMERS)
+                           ).format()
+
+
+def test__invalid_orders_are_reported_with_their_rows(tmp_path):
+    table = orders_table()
+    table = table.set_column(table.schema.get_field_index("cart_value"), "cart_value",
+                             [[-1 if row == 700 else order_info.cart_value
+                               for row, order_info in enumerate(ORDER_INFOS)]])
+    write_input(table, tmp_path / "orders.parquet", "parquet")
+
+    with pytest.raises(ValueError, match="rows 600-899: cart_value must be non-negative"):
+        load_order_columns(tmp_path / "orders.parquet", batch_size=300)
+
+
+def test__main_prints_the_reports_and_writes_the_deltas(orders_path, tmp_path, capsys):
+    (tmp_path / "limit.json").write_text(json.dumps(CANDIDATE_CONFIG))
+
+    main([str(orders_path), str(tmp_path / "limit.json"),
+          str(PRICING_RULES_PATH), "--deltas", str(tmp_path / "deltas.parquet")])
+
+    output = capsys.readouterr().out
+    assert "limit (version limit-20) against baseline" in output
+    assert "pricing_rules" in output and "(+0.00 €, +0.00%)" in output
+    deltas = pq.read_table(tmp_path / "deltas.parquet")
+    assert deltas.column_names == ["baseline_fee", "limit_delta", "pricing_rules_delta"]
+    assert deltas.column("baseline_fee").to_pylist() == EXPECTED_FEES
+    assert deltas.column("limit_delta").to_pylist() == [
+        CANDIDATE.calculate_fee(order_info) - fee
+        for order_info, fee in zip(ORDER_INFOS, EXPECTED_FEES)]
+    assert set(deltas.column("pricing_rules_delta").to_pylist()) == {0}
+
+
+def test__main_rejects_invalid_candidates(orders_path, tmp_path, capsys):
+    (tmp_path / "broken.json").write_text(
+        '{"calculation_steps": [], "transformers": [{"type": "Nope"}]}')
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(orders_path), str(tmp_path / "broken.json")])
+    assert exit_info.value.code == 1
+    assert "Nope" in capsys.readouterr().err
@@ -0,0 +1,284 @@
+"""
+What-if re-pricing of historical orders, to see the effect of a pricing change
+before it is made.
+
+The orders of a Parquet, Arrow IPC or CSV file (the same files as
+`app.batch_pricing` reads) are loaded into memory as columns once. Every
+candidate configuration (a JSON or YAML file in the format of
+`app.delivery_fee.pricing_config`) is then evaluated with a single vectorized
+pass over the columns and compared with the baseline, which is the
+configuration of `app/delivery_fee/settings.py` unless another one is given.
+
+For every candidate the report has the change of the revenue (the sum of the
+delivery fees), the share of orders whose fee goes up or down, the fee
+percentiles and the share of orders every transformer applies to: the orders
+hitting the cap of `LimitFeeTransformer` (also those exactly at the cap), the
+orders over the waiver threshold of `ReduceFeeTransformer` (also those which
+were free already) and, for the other transformers, the orders whose fee they
+change. The per-order fee changes can also be written to a Parquet file, in the
+order of the input rows.
+
+Run with: python -m app.what_if orders.parquet candidate.yaml [candidate.json ...]
+"""
+import argparse
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Self
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.batch_pricing import DEFAULT_BATCH_SIZE, order_columns_of, read_record_batches
+from app.delivery_fee.fee_calculator import PricingPipeline
+from app.delivery_fee.fee_transformers import LimitFeeTransformer, ReduceFeeTransformer
+from app.delivery_fee.order_columns import OrderInfoColumns
+from app.delivery_fee.pricing_config import load_pricing_config
+from app.delivery_fee import settings
+
+
+BASELINE_NAME = "baseline"
+FEE_PERCENTILES = (10, 50, 90)
+
+
+@dataclass(frozen=True)
+class ScenarioOutcome:
+    """The delivery fees of all the orders with one configuration."""
+    name: str
+    version: str
+    fees: np.ndarray  # int64, in cents, in the order of the orders
+    # (transformer, share of the orders it applies to) in the order the
+    # transformers are applied, see `_applies_to`.
+    transformer_shares: list[tuple[str, float]]
+
+    @property
+    def revenue(self) -> int:
+        return int(self.fees.sum())
+
+    def fee_percentiles(self) -> list[float]:
+        if not len(self.fees):
+            return [0.0 for _ in FEE_PERCENTILES]
+        return [float(percentile) for percentile in np.percentile(self.fees, FEE_PERCENTILES)]
+
+
+@dataclass(frozen=True)
+class CandidateReport:
+    baseline: ScenarioOutcome
+    candidate: ScenarioOutcome
+    seconds: float
+
+    @property
+    def deltas(self) -> np.ndarray:
+        """Change of the fee of every order in cents."""
+        return self.candidate.fees - self.baseline.fees
+
+    @property
+    def revenue_change(self) -> int:
+        return self.candidate.revenue - self.baseline.revenue
+
+    @property
+    def revenue_change_ratio(self) -> float:
+        return self.revenue_change / self.baseline.revenue if self.baseline.revenue else 0.0
+
+    @property
+    def share_of_higher_fees(self) -> float:
+        return _share(self.candidate.fees > self.baseline.fees)
+
+    @property
+    def share_of_lower_fees(self) -> float:
+        return _share(self.candidate.fees < self.baseline.fees)
+
+    def format(self) -> str:
+        baseline, candidate = self.baseline, self.candidate
+        lines = [
+            f"{candidate.name} (version {candidate.version}) against {baseline.name} "
+            f"(version {baseline.version}), {len(candidate.fees):,} orders in "
+            f"{self.seconds:.2f} s",
+            f"  revenue: {_euros(baseline.revenue)} -> {_euros(candidate.revenue)} "
+            f"({_euros(self.revenue_change, sign=True)}, {self.revenue_change_ratio:+.2%})",
+            f"  orders with a higher fee: {self.share_of_higher_fees:.2%}, "
+            f"with a lower fee: {self.share_of_lower_fees:.2%}",
+            f"  fee p{'/p'.join(map(str, FEE_PERCENTILES))}: "
+            f"{_euro_list(baseline.fee_percentiles())} -> "
+            f"{_euro_list(candidate.fee_percentiles())}",
+        ]
+        baseline_shares = dict(baseline.transformer_shares)
+        candidate_shares = dict(candidate.transformer_shares)
+        for transformer in dict.fromkeys([*baseline_shares, *candidate_shares]):
+            lines.append(f"  orders hit by {transformer}: "
+                         f"{_percent(baseline_shares.get(transformer))} -> "
+                         f"{_percent(candidate_shares.get(transformer))}")
+        return "\n".join(lines)
+
+
+class WhatIfSimulator:
+    """Evaluates candidate configurations against the baseline over the same
+    orders, which are kept in memory as columns. The baseline is priced once
+    when the simulator is created."""
+
+    def __init__(self, order_columns: OrderInfoColumns,
+                 baseline: PricingPipeline | None = None) -> None:
+        if baseline is None:
+            baseline = PricingPipeline.build(settings.ALL_CALCULATION_STEPS,
+                                             settings.ALL_FEE_TRANSFORMERS)
+        self.order_columns = order_columns
+        self.baseline = self.price(BASELINE_NAME, baseline)
+
+    @classmethod
+    def from_file(cls, path: str | Path, baseline: PricingPipeline | None = None,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> Self:
+        """Loads the orders of the file. Raises `ValueError` if the orders are
+        invalid, the row numbers of the failed batch are in the message."""
+        return cls(load_order_columns(path, batch_size), baseline)
+
+    def price(self, name: str, pipeline: PricingPipeline) -> ScenarioOutcome:
+        """Prices all the orders with the pipeline in one vectorized pass."""
+        transformer_shares = []
+        stages = pipeline.calculate_columns_by_stage(self.order_columns)
+        # The fees after the last step are the fees before the first transformer.
+        for _ in range(len(pipeline.calculation_steps) + 1):
+            fees = next(stages)
+        for label, transformer, transformed_fees in zip(
+                _labels(pipeline.transformers), pipeline.transformers, stages):
+            transformer_shares.append((label, _share(_applies_to(
+                transformer, self.order_columns, fees, transformed_fees))))
+            fees = transformed_fees
+        return ScenarioOutcome(name, pipeline.version, fees, transformer_shares)
+
+    def evaluate(self, name: str, candidate: PricingPipeline) -> CandidateReport:
+        started = time.perf_counter()
+        outcome = self.price(name, candidate)
+        return CandidateReport(self.baseline, outcome, time.perf_counter() - started)
+
+
+def load_order_columns(path: str | Path,
+                       batch_size: int = DEFAULT_BATCH_SIZE) -> OrderInfoColumns:
+    """Reads all the orders of the file into one set of columns. Raises
+    `ValueError` if the orders are invalid."""
+    batches = []
+    rows = 0
+    for batch in read_record_batches(path, batch_size):
+        try:
+            batches.append(order_columns_of(batch))
+        except ValueError as error:
+            raise ValueError(f"invalid orders in rows {rows}-{rows + batch.num_rows - 1}: "
+                             f"{error}") from error
+        rows += batch.num_rows
+    if not batches:
+        return OrderInfoColumns.from_arrays([], [], [], np.array([], dtype="datetime64[us]"))
+    # The batches were validated already.
+    utc_offset = None
+    if any(columns.utc_offset is not None for columns in batches):
+        utc_offset = np.concatenate([
+            np.zeros(len(columns), dtype=np.int64) if columns.utc_offset is None
+            else columns.utc_offset for columns in batches])
+    return OrderInfoColumns(*(np.concatenate([getattr(columns, name) for columns in batches])
+                              for name in ("cart_value", "delivery_distance",
+                                           "number_of_items", "time")), utc_offset)
+
+
+def write_deltas(path: str | Path, reports: Iterable[CandidateReport]) -> None:
+    """Writes the baseline fee and the fee change of every candidate of every
+    order to a Parquet file, in the order of the orders."""
+    reports = list(reports)
+    columns = {}
+    if reports:
+        columns[f"{reports[0].baseline.name}_fee"] = reports[0].baseline.fees
+    for report in reports:
+        columns[f"{report.candidate.name}_delta"] = report.deltas
+    pq.write_table(pa.table(columns), path)
+
+
+def _applies_to(transformer, order_columns: OrderInfoColumns, fees: np.ndarray,
+                transformed_fees: np.ndarray) -> np.ndarray:
+    # The cap and the waiver apply by their conditions, even when they leave
+    # the fee as it is. Other transformers by whether they change the fee.
+    if isinstance(transformer, LimitFeeTransformer):
+        return fees >= transformer.config_options.highest_limit_of_delivery_fee
+    if isinstance(transformer, ReduceFeeTransformer):
+        return (order_columns.cart_value >=
+                transformer.config_options.exclusion_cart_value_threshold)
+    return transformed_fees != fees
+
+
+def _labels(transformers: list) -> list[str]:
+    # Class names, numbered when a transformer is used more than once.
+    labels = []
+    for transformer in transformers:
+        label = name = type(transformer).__name__
+        number = 1
+        while label in labels:
+            number += 1
+            label = f"{name} #{number}"
+        labels.append(label)
+    return labels
+
+
+def _share(mask: np.ndarray) -> float:
+    return np.count_nonzero(mask) / len(mask) if len(mask) else 0.0
+
+
+def _euros(cents: float, sign: bool = False) -> str:
+    return f"{cents / 100:{'+' if sign else ''},.2f} €"
+
+
+def _euro_list(cents: list[float]) -> str:
+    return "/".join(f"{value / 100:.2f}" for value in cents) + " €"
+
+
+def _percent(share: float | None) -> str:
+    return "-" if share is None else f"{share:.2%}"
+
+
+def _pipeline_of(path: str) -> PricingPipeline:
+    pricing_config = load_pricing_config(path)
+    return PricingPipeline.build(pricing_config.calculation_steps, pricing_config.transformers,
+                                 pricing_config.version)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the revenue and fees of candidate pricing configurations "
+                    "with the current one over historical orders.")
+    parser.add_argument("orders", help="Parquet, Arrow IPC or CSV file of orders")
+    parser.add_argument("candidates", nargs="+",
+                        help="JSON or YAML pricing configuration files to evaluate")
+    parser.add_argument("--baseline",
+                        help="pricing configuration file to compare with "
+                             "(default: app/delivery_fee/settings.py)")
+    parser.add_argument("--deltas", help="Parquet file to write the per-order fee changes to")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows per record batch of Parquet input (default: {DEFAULT_BATCH_SIZE})")
+    args = parser.parse_args(argv)
+
+    # Candidates are named by their file names, or by their paths if those are not unique.
+    names = [Path(candidate).stem for candidate in args.candidates]
+    if len(set(names)) != len(names):
+        names = args.candidates
+    if len(set(names)) != len(names) or BASELINE_NAME in names:
+        parser.error("the candidates must be different files and not named "
+                     f"{BASELINE_NAME!r}")
+
+    try:
+        baseline = None
+        if args.baseline is not None:
+            baseline = _pipeline_of(args.baseline)
+        candidates = [_pipeline_of(candidate) for candidate in args.candidates]
+
+        started = time.perf_counter()
+        simulator = WhatIfSimulator.from_file(args.orders, baseline, args.batch_size)
+        print(f"Loaded and priced {len(simulator.order_columns):,} orders in "
+              f"{time.perf_counter() - started:.2f} s", file=sys.stderr)
+
+        reports = []
+        for name, candidate in zip(names, candidates):
+            reports.append(simulator.evaluate(name, candidate))
+            print(reports[-1].format())
+        if args.deltas is not None:
+            write_deltas(args.deltas, reports)
+    except (OSError, ValueError) as error:
+        parser.exit(1, f"{parser.prog}: error: {error}\n")
+
+
+if __name__ == "__main__":
+    main()
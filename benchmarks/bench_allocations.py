@@ -0,0 +1,128 @@
+"""
+Counts the model constructions, deep copies and traced memory of one quote with
+the step by step calculation, before and after fees were passed through the
+steps and transformers as plain integers. The "before" version is the previous
+implementation, where every step returned a `DeliveryFee`, every fee operation
+built a new model and every transformer deep copied the fee.
+
+Run with: python -m benchmarks.bench_allocations
+"""
+import argparse
+import copy
+import tracemalloc
+from contextlib import contextmanager
+from math import ceil
+from typing import Callable
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+import app.delivery_fee.settings as settings
+from benchmarks.timing import print_comparison, time_per_call
+
+
+def model_based_quote(order_info: OrderInfo) -> DeliveryFee:
+    """The previous step by step calculation with the default settings. The rush
+    hour check is done with the standard library instead of pandas, so that only
+    the fee handling differs."""
+    cart_value = settings.CART_VALUE_CONFIG_OPTIONS
+    distance = settings.DELIVERY_DISTANCE_CONFIG_OPTIONS
+    items = settings.NUMBER_OF_ITEMS_CONFIG_OPTIONS
+    rush_hour = settings.FRIDAY_RUSH_HOUR_CONFIG_OPTIONS
+    reduce_fee = settings.EXCLUDE_FEE_CONFIG_OPTIONS
+    limit_fee = settings.LIMIT_FEE_CONFIG_OPTIONS
+    calculated_fee = DeliveryFee(delivery_fee=0)
+
+    step_fee = DeliveryFee(delivery_fee=0)
+    if order_info.cart_value < cart_value.cart_value_surcharge_threshold:
+        step_fee += cart_value.cart_value_surcharge_threshold - order_info.cart_value
+    calculated_fee += step_fee
+
+    step_fee = DeliveryFee(delivery_fee=0)
+    if order_info.delivery_distance > 0:
+        step_fee += distance.delivery_distance_surcharge_for_low_threshold
+    if order_info.delivery_distance > distance.delivery_distance_low_threshold:
+        additional_fee_multiplier = ceil(
+            (order_info.delivery_distance - distance.delivery_distance_low_threshold) /
+            distance.additional_fee_applied_per_meters_traveled)
+        step_fee += additional_fee_multiplier * distance.additional_fee
+    calculated_fee += step_fee
+
+    step_fee = DeliveryFee(delivery_fee=0)
+    if order_info.number_of_items > items.number_of_items_surcharge_threshold:
+        step_fee += ((order_info.number_of_items - items.number_of_items_surcharge_threshold) *
+                     items.surcharge_per_item_over_threshold)
+    if order_info.number_of_items > items.bulk_charge_threshold:
+        step_fee += items.bulk_charge
+    calculated_fee += step_fee
+
+    calculated_fee = copy.deepcopy(calculated_fee)
+    if (order_info.time.strftime("%A") == rush_hour.rush_day and
+            rush_hour.rush_hour_start <= order_info.time.time() <= rush_hour.rush_hour_end):
+        calculated_fee *= rush_hour.rush_hour_fee_factor
+
+    calculated_fee = copy.deepcopy(calculated_fee)
+    if order_info.cart_value >= reduce_fee.exclusion_cart_value_threshold:
+        calculated_fee -= calculated_fee * reduce_fee.exclusion_delivery_fee_factor
+
+    calculated_fee = copy.deepcopy(calculated_fee)
+    if calculated_fee >= limit_fee.highest_limit_of_delivery_fee:
+        calculated_fee = DeliveryFee(delivery_fee=limit_fee.highest_limit_of_delivery_fee)
+
+    return calculated_fee
+
+
+@contextmanager
+def count_calls(owner: object, name: str, counts: dict[str, int], key: str):
+    function = getattr(owner, name)
+
+    def counted(*args, **kwargs):
+        counts[key] += 1
+        return function(*args, **kwargs)
+
+    setattr(owner, name, counted)
+    try:
+        yield
+    finally:
+        setattr(owner, name, function)
+
+
+def count_allocations(quote: Callable[[], DeliveryFee]) -> dict[str, int]:
+    counts = {"models": 0, "deep copies": 0}
+    with (count_calls(DeliveryFee, "__init__", counts, "models"),
+          count_calls(copy, "deepcopy", counts, "deep copies")):
+        quote()
+
+    tracemalloc.start()
+    quote()
+    counts["peak traced bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=10_000)
+    args = parser.parse_args()
+
+    calculator = DeliveryFeeCalculator()
+    # During the rush hour, so that the rush hour transformer changes the fee too.
+    order_info = OrderInfo(cart_value=790, delivery_distance=2235, number_of_items=14,
+                           time="2024-01-19T16:00:00Z")
+    assert model_based_quote(order_info) == calculator._calculate_step_by_step(order_info)
+
+    quotes = {
+        "before (models)": lambda: model_based_quote(order_info),
+        "after (integers)": lambda: calculator._calculate_step_by_step(order_info),
+        "after (compiled)": lambda: calculator.calculate(order_info),
+    }
+    print("Allocations per quote:")
+    for title, quote in quotes.items():
+        counts = count_allocations(quote)
+        print(f"    {title:18} " + ", ".join(f"{key}: {value}" for key, value in counts.items()))
+
+    print_comparison("Step by step quote",
+                     time_per_call(quotes["before (models)"], args.number),
+                     time_per_call(quotes["after (integers)"], args.number))
+
+
+if __name__ == "__main__":
+    main()
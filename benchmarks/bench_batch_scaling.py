@@ -0,0 +1,71 @@
+"""
+Measures how the sharded batch runner (`app.batch_runner`) scales with the
+number of worker processes. Writes a data set of random orders to Parquet files
+in a temporary directory and prices all of it with 1, 2, 4, ... workers up to
+the number of CPUs. Prints the orders per second, the speedup over one worker
+and the parallel efficiency (speedup / workers) of each run.
+
+The time includes starting the worker processes, so the data set must be big
+enough for the pricing to dominate the startup of the pool.
+
+Run with: python -m benchmarks.bench_batch_scaling --rows 20000000
+"""
+import argparse
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.batch_runner import run
+
+
+def write_orders(directory: Path, rows: int, files: int, row_group_size: int) -> None:
+    rng = np.random.default_rng(2024)
+    first_time = np.datetime64("2024-01-01T00:00:00", "us")
+    for file_index in range(files):
+        file_rows = rows // files + (file_index < rows % files)
+        microseconds = rng.integers(0, 366 * 24 * 60 * 60 * 10**6, file_rows)
+        pq.write_table(pa.table({
+            "cart_value": rng.integers(0, 25000, file_rows),
+            "delivery_distance": rng.integers(0, 20000, file_rows),
+            "number_of_items": rng.integers(0, 30, file_rows),
+            "time": first_time + microseconds.astype("timedelta64[us]"),
+        }), directory / f"orders_{file_index:03d}.parquet", row_group_size=row_group_size)
+
+
+def worker_counts(max_workers: int) -> list[int]:
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        input_dir = Path(temporary_directory) / "orders"
+        input_dir.mkdir()
+        write_orders(input_dir, args.rows, args.files, args.row_group_size)
+
+        print(f"{args.rows:,} orders in {args.files} files, {os.cpu_count()} CPUs")
+        single_worker_rate = None
+        for workers in worker_counts(args.max_workers):
+            report = run(input_dir, Path(temporary_directory) / f"priced_{workers}",
+                         workers=workers, resume=False)
+            single_worker_rate = single_worker_rate or report.rows_per_second
+            speedup = report.rows_per_second / single_worker_rate
+            print(f"    {workers:3} workers: {report.rows_per_second:12,.0f} orders/s, "
+                  f"{speedup:5.2f}x speedup, {speedup / workers:4.0%} efficiency")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Compares one `CalendarSurchargeTransformer` with many windows to stacking one
+`RushHourFeeTransformer` per window, which was the only way to have more than
+one window before. Both are measured in the compiled pipeline, per order of
+random order times, as the number of windows grows.
+
+Run with: python -m benchmarks.bench_calendar_surcharge
+"""
+import argparse
+import random
+from datetime import time
+from app.delivery_fee.fee_transformers import (
+    CalendarSurchargeTransformer,
+    RushHourFeeTransformer,
+    WeeklySurchargeWindow,
+)
+from app.delivery_fee.pipeline_compiler import compile_pipeline
+from app.delivery_fee.time_index import WEEKDAY_NAMES
+from app.tests.delivery_fee.random_orders import random_order_infos
+from benchmarks.timing import print_comparison, time_per_call
+
+
+def random_windows(count: int) -> list[WeeklySurchargeWindow]:
+    rng = random.Random(count)
+    return [WeeklySurchargeWindow(day=rng.choice(WEEKDAY_NAMES), start=time(hour),
+                                  end=time(rng.randrange(hour, 24), 59), factor=1.1)
+            for hour in (rng.randrange(24) for _ in range(count))]
+
+
+def time_per_order(transformers: list, order_times: list, number: int) -> float:
+    compiled_pipeline = compile_pipeline([], transformers)
+    return time_per_call(lambda: [compiled_pipeline(0, 0, 0, order_time)
+                                  for order_time in order_times], number) / len(order_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    order_times = [order_info.time for order_info in random_order_infos(1000, seed=0)]
+    for count in (1, 10, 100, 1000):
+        windows = random_windows(count)
+        stacked = [RushHourFeeTransformer(RushHourFeeTransformer.ConfigOptions(
+            rush_day=window.day, rush_hour_start=window.start, rush_hour_end=window.end,
+            rush_hour_fee_factor=window.factor)) for window in windows]
+        calendar = CalendarSurchargeTransformer(
+            CalendarSurchargeTransformer.ConfigOptions(weekly_windows=windows))
+        print_comparison(f"{count} windows, per order",
+                         time_per_order(stacked, order_times, args.number),
+                         time_per_order([calendar], order_times, args.number))
+
+
+if __name__ == "__main__":
+    main()
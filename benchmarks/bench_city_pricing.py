@@ -0,0 +1,96 @@
+"""
+Measures the city pricing table of `app.delivery_fee.city_pricing` as the
+number of cities grows: the cold lookup of a city (binary search and building
+its pipeline), the warm lookup of a cached city, and the traced memory of a
+worker which has quoted every city, compared to building the pipelines of all
+the cities eagerly like `MarketRegistry` does.
+
+Run with: python -m benchmarks.bench_city_pricing [--cities 1000 10000 100000]
+"""
+import argparse
+import gc
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from app.delivery_fee import settings
+from app.delivery_fee.city_pricing import CityPricingStore, write_city_table
+from app.delivery_fee.fee_calculation_steps import CartValueFee
+from app.delivery_fee.markets import MarketComponents, MarketRegistry
+from benchmarks.timing import time_per_call
+
+
+# Building every pipeline eagerly takes too long beyond this many cities.
+MAX_EAGER_CITIES = 10_000
+
+
+def random_cities(count: int, seed: int = 0) -> dict[str, MarketComponents]:
+    # Cities with different small order surcharge thresholds, so their
+    # configurations differ like the configurations of real cities would.
+    rng = random.Random(seed)
+    return {f"city-{index:06d}": (
+        [CartValueFee(CartValueFee.ConfigOptions(
+            cart_value_surcharge_threshold=rng.randrange(500, 2000, 50))),
+         *settings.ALL_CALCULATION_STEPS[1:]],
+        settings.ALL_FEE_TRANSFORMERS) for index in range(count)}
+
+
+def traced_bytes(build) -> tuple[int, object]:
+    tracemalloc.start()
+    built = build()
+    # The compiled pipelines are reference cycles, only the live ones count.
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return traced, built
+
+
+def measure(count: int, max_cities: int, directory: Path) -> None:
+    cities = random_cities(count)
+    path = directory / f"cities-{count}.bin"
+    write_city_table(path, cities)
+    names = list(cities)
+    random.Random(1).shuffle(names)
+
+    store = CityPricingStore(path, max_cities=max_cities)
+    cold_names = names[:min(count, max_cities, 1000)]
+    start = time.perf_counter()
+    for name in cold_names:
+        store.pipeline(name)
+    cold_us = (time.perf_counter() - start) / len(cold_names) * 1e6
+    warm_ns = time_per_call(lambda: store.pipeline(cold_names[0]), 100_000)
+    store.close()
+
+    def quote_every_city() -> CityPricingStore:
+        store = CityPricingStore(path, max_cities=max_cities)
+        for name in names:
+            store.pipeline(name)
+        return store
+
+    lazy_bytes, store = traced_bytes(quote_every_city)
+    store.close()
+    print(f"{count} cities ({path.stat().st_size / 1024:.0f} KiB table):")
+    print(f"    cold lookup:  {cold_us:10.1f} us/call")
+    print(f"    warm lookup:  {warm_ns:10.1f} ns/call")
+    print(f"    memory after quoting every city, at most {max_cities} cities kept: "
+          f"{lazy_bytes / 1024 ** 2:8.1f} MiB")
+    if count <= MAX_EAGER_CITIES:
+        eager_bytes, _ = traced_bytes(lambda: MarketRegistry.build(cities))
+        print(f"    memory of every pipeline built eagerly:{'':20}"
+              f"{eager_bytes / 1024 ** 2:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cities", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--max-cities", type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.cities:
+            measure(count, args.max_cities, Path(directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Measures the precomputed fee surface: how long building it and mapping an
+already built file take, and the fee of an order looked up from the surface
+against the compiled pipeline, for orders in the range of the surface.
+
+Run with: python -m benchmarks.bench_fee_surface
+"""
+import argparse
+import tempfile
+import time
+from app.delivery_fee.fee_calculator import PricingPipeline
+from app.delivery_fee.fee_surface import load_fee_surface
+from app.delivery_fee import settings
+from app.tests.delivery_fee.random_orders import random_order_infos
+from benchmarks.timing import print_comparison, time_per_call
+from app import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--max-distance", type=int, default=config.FEE_SURFACE_MAX_DISTANCE)
+    parser.add_argument("--max-items", type=int, default=config.FEE_SURFACE_MAX_ITEMS)
+    args = parser.parse_args()
+
+    steps, transformers = settings.ALL_CALCULATION_STEPS, settings.ALL_FEE_TRANSFORMERS
+    order_infos = [order_info for order_info in random_order_infos(2000, seed=0)
+                   if order_info.delivery_distance <= args.max_distance and
+                   order_info.number_of_items <= args.max_items]
+    pipeline = PricingPipeline.build(steps, transformers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for action in ("built", "mapped"):
+            started = time.perf_counter()
+            surface = load_fee_surface(steps, transformers, directory,
+                                       args.max_distance, args.max_items)
+            print(f"surface {action} in {(time.perf_counter() - started) * 1000:.1f} ms "
+                  f"({len(surface):,} fees, {surface.path.stat().st_size / 2**20:.1f} MiB)")
+        surface_pipeline = surface.compile(transformers[0], pipeline.compiled_pipeline)
+
+        def time_per_order(compiled_pipeline) -> float:
+            return time_per_call(lambda: [
+                compiled_pipeline(order_info.cart_value, order_info.delivery_distance,
+                                  order_info.number_of_items, order_info.time)
+                for order_info in order_infos], args.number) / len(order_infos)
+
+        print_comparison("compiled pipeline -> fee surface lookup",
+                         time_per_order(pipeline.compiled_pipeline),
+                         time_per_order(surface_pipeline))
+
+
+if __name__ == "__main__":
+    main()
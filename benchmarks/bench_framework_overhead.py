@@ -0,0 +1,54 @@
+"""
+Compares the per request overhead of the quote endpoint with the plain FastAPI
+route (before) and with the quote fast path, which validates the raw body with
+pydantic-core and serializes the response with orjson (after). The framework
+overhead is the time of a request minus the time of validating the same body
+and calculating the fee without any framework.
+
+Run with: python -m benchmarks.bench_framework_overhead
+"""
+import argparse
+import asyncio
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.models import OrderInfo
+from app.main import create_app, create_lean_app
+from benchmarks.asgi import post, time_per_request
+from benchmarks.timing import print_comparison, time_per_call
+
+
+PATH = "/api/delivery/calculate_delivery_fee/"
+VALID_BODY = (b'{"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4, '
+              b'"time": "2024-01-15T13:00:00Z"}')
+INVALID_BODY = (b'{"cart_value": -1, "delivery_distance": 2235, "number_of_items": 4, '
+                b'"time": "2024-01-15T13:00:00Z"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=5_000)
+    args = parser.parse_args()
+
+    apps = {"FastAPI route": create_app(quote_fast_path=False),
+            "quote fast path": create_app(quote_fast_path=True),
+            "lean app": create_lean_app()}
+    for body in [VALID_BODY, INVALID_BODY]:
+        responses = {asyncio.run(post(app, PATH, body)) for app in apps.values()}
+        assert len(responses) == 1, responses
+
+    core_ns = time_per_call(lambda: DELIVERY_FEE_CALCULATOR.calculate_fee(
+        OrderInfo.model_validate_json(VALID_BODY)), args.number)
+    print(f"Validation and calculation without a framework: {core_ns:.1f} ns/call")
+
+    for title, body in [("Valid quote", VALID_BODY), ("Invalid quote (422)", INVALID_BODY)]:
+        request_ns = {name: time_per_request(app, PATH, body, args.number)
+                      for name, app in apps.items()}
+        print_comparison(f"{title}, FastAPI route vs quote fast path",
+                         request_ns["FastAPI route"], request_ns["quote fast path"])
+        print(f"    lean app:   {request_ns['lean app']:10.1f} ns/call")
+        if body is VALID_BODY:
+            print("    framework overhead: " + ", ".join(
+                f"{name} {request_ns[name] - core_ns:.0f} ns" for name in apps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures the compiled `RushHourFeeTransformer` with the rush hour in UTC and
+in the local time of a timezone, against converting every order time to the
+local time with `zoneinfo`. The local time is looked up from the offset table
+of the timezone, which is read once, instead.
+
+Run with: python -m benchmarks.bench_local_rush_hour
+"""
+import argparse
+from datetime import timezone
+from math import ceil
+from zoneinfo import ZoneInfo
+from app.delivery_fee.fee_transformers import RushHourFeeTransformer
+from app.delivery_fee.pipeline_compiler import compile_pipeline
+from app.delivery_fee.time_index import WEEKDAY_NAMES, microsecond_of_day
+from app.tests.delivery_fee.random_orders import random_order_infos
+from benchmarks.timing import time_per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--timezone", default="Europe/Helsinki")
+    args = parser.parse_args()
+
+    order_times = [order_info.time for order_info in random_order_infos(1000, seed=0)]
+    options = RushHourFeeTransformer.ConfigOptions()
+
+    def time_per_order(function) -> float:
+        return time_per_call(lambda: [function(order_time) for order_time in order_times],
+                             args.number) / len(order_times)
+
+    for name, timezone_name in [("UTC", "UTC"), (args.timezone, args.timezone)]:
+        compiled_pipeline = compile_pipeline([], [RushHourFeeTransformer(
+            options.model_copy(update={"timezone": timezone_name}))])
+        print(f"{f'compiled, {name}':>40}: "
+              f"{time_per_order(lambda order_time: compiled_pipeline(0, 0, 0, order_time)):8.1f} "
+              "ns/order")
+
+    # The same rule with a zoneinfo conversion per order.
+    zone = ZoneInfo(args.timezone)
+    rush_weekday = WEEKDAY_NAMES.index(options.rush_day)
+    rush_hour_start = microsecond_of_day(options.rush_hour_start)
+    rush_hour_end = microsecond_of_day(options.rush_hour_end)
+
+    def zoneinfo_fee(order_time) -> int:
+        local_time = order_time.replace(tzinfo=timezone.utc).astimezone(zone)
+        if (local_time.weekday() == rush_weekday and
+                rush_hour_start <= microsecond_of_day(local_time.time()) <= rush_hour_end):
+            return ceil(300 * options.rush_hour_fee_factor)
+        return 300
+
+    print(f"{f'zoneinfo per order, {args.timezone}':>40}: "
+          f"{time_per_order(zoneinfo_fee):8.1f} ns/order")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measures the overhead of the always-on metrics of `app.metrics`: a request to
+the quote endpoint of the lean app with and without `RequestMetricsMiddleware`,
+and an uncached calculation with and without the stage metrics, both with every
+calculation timed and with the default sampling.
+
+Run with: python -m benchmarks.bench_metrics
+"""
+import argparse
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from app import config
+from app.delivery_fee import settings
+from app.delivery_fee.fee_calculator import DeliveryFeeCalculator
+from app.delivery_fee.models import OrderInfo
+from app.delivery_fee.raw_endpoints import delivery_fee_routes
+from app.main import add_metrics
+from benchmarks.asgi import time_per_request
+from benchmarks.timing import time_per_call
+
+
+QUOTE_PATH = "/api/delivery/calculate_delivery_fee/"
+BODY = (b'{"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4, '
+        b'"time": "2024-01-15T13:00:00Z"}')
+
+
+def print_overhead(title: str, without_metrics_ns: float, with_metrics_ns: float) -> None:
+    print(f"{title}:")
+    print(f"    without metrics: {without_metrics_ns:10.1f} ns/call")
+    print(f"    with metrics:    {with_metrics_ns:10.1f} ns/call "
+          f"({with_metrics_ns / without_metrics_ns - 1:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--number", type=int, default=50_000)
+    args = parser.parse_args()
+
+    app = Starlette(routes=[Mount("/api/delivery", routes=delivery_fee_routes)])
+    without_metrics = time_per_request(app, QUOTE_PATH, BODY, args.requests)
+    app = Starlette(routes=[Mount("/api/delivery", routes=delivery_fee_routes)])
+    add_metrics(app)
+    with_metrics = time_per_request(app, QUOTE_PATH, BODY, args.requests)
+    print_overhead("Quote request", without_metrics, with_metrics)
+
+    DeliveryFeeCalculator.clear_singleton_instance()
+    calculator = DeliveryFeeCalculator(settings.ALL_CALCULATION_STEPS,
+                                       settings.ALL_FEE_TRANSFORMERS)
+    order_info = OrderInfo.model_validate_json(BODY)
+    without_metrics = time_per_call(lambda: calculator.calculate_fee(order_info), args.number)
+    for sample_every in (config.METRICS_SAMPLE_EVERY, 1):
+        calculator.enable_metrics(sample_every)
+        with_metrics = time_per_call(lambda: calculator.calculate_fee(order_info), args.number)
+        print_overhead(f"Calculation, timing 1 in {sample_every} calculations",
+                       without_metrics, with_metrics)
+
+
+if __name__ == "__main__":
+    main()
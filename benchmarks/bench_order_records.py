@@ -0,0 +1,38 @@
+"""
+Compares calling the calculator directly with validated pydantic models and
+with the lightweight `OrderRecord`, the way batch workers use it as a library.
+Both include building the order from raw values, which is what dominates the
+profile of the batch workers.
+
+Run with: python -m benchmarks.bench_order_records
+"""
+import argparse
+from datetime import datetime, timezone
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.models import OrderInfo, OrderRecord
+from benchmarks.timing import print_comparison, time_per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20_000)
+    args = parser.parse_args()
+
+    time = datetime(2024, 1, 19, 16, tzinfo=timezone.utc)
+
+    def with_models() -> int:
+        order_info = OrderInfo(cart_value=790, delivery_distance=2235,
+                               number_of_items=4, time=time.isoformat())
+        return DELIVERY_FEE_CALCULATOR.calculate(order_info).delivery_fee
+
+    def with_records() -> int:
+        return DELIVERY_FEE_CALCULATOR.calculate_fee(OrderRecord(790, 2235, 4, time))
+
+    assert with_models() == with_records()
+    print_comparison("Quote from raw values",
+                     time_per_call(with_models, args.number),
+                     time_per_call(with_records, args.number))
+
+
+if __name__ == "__main__":
+    main()
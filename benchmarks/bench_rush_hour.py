@@ -0,0 +1,66 @@
+"""
+Compares the rush hour check of `RushHourFeeTransformer` before and after the
+precomputed microsecond-of-week index. The "before" version is the previous
+implementation, which built a `pandas.Timestamp` and compared the weekday name.
+
+Run with: python -m benchmarks.bench_rush_hour
+"""
+import argparse
+from copy import deepcopy
+from pandas import Timestamp
+from app.delivery_fee.fee_transformers import RushHourFeeTransformer
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+from app.delivery_fee.time_index import microsecond_of_week
+import app.delivery_fee.settings as settings
+from benchmarks.timing import print_comparison, time_per_call
+
+
+def pandas_transform(config_options: RushHourFeeTransformer.ConfigOptions,
+                     delivery_info: OrderInfo, delivery_fee: DeliveryFee) -> DeliveryFee:
+    timestamp = Timestamp(delivery_info.time)
+    transformed_delivery_fee = deepcopy(delivery_fee)
+
+    if (timestamp.day_name() == config_options.rush_day and
+            (config_options.rush_hour_start <= timestamp.time() <= config_options.rush_hour_end)):
+        transformed_delivery_fee *= config_options.rush_hour_fee_factor
+
+    return transformed_delivery_fee
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20_000)
+    args = parser.parse_args()
+
+    config_options = settings.FRIDAY_RUSH_HOUR_CONFIG_OPTIONS
+    transformer = RushHourFeeTransformer(config_options)
+    rush_hours = transformer._rush_hours
+    delivery_fee = DeliveryFee(delivery_fee=500)
+
+    for time in ["2024-02-02T16:00:00Z", "2024-02-01T16:00:00Z"]:
+        order_info = OrderInfo(cart_value=500, delivery_distance=0,
+                               number_of_items=0, time=time)
+        timestamp = order_info.time
+        assert (pandas_transform(config_options, order_info, delivery_fee) ==
+                transformer.transform(order_info, delivery_fee))
+
+        def pandas_check():
+            pandas_timestamp = Timestamp(timestamp)
+            return (pandas_timestamp.day_name() == config_options.rush_day and
+                    config_options.rush_hour_start <= pandas_timestamp.time()
+                    <= config_options.rush_hour_end)
+
+        print(f"Order time {time}")
+        print_comparison(
+            "  rush hour check",
+            time_per_call(pandas_check, args.number),
+            time_per_call(lambda: microsecond_of_week(timestamp) in rush_hours, args.number))
+        print_comparison(
+            "  RushHourFeeTransformer.transform",
+            time_per_call(lambda: pandas_transform(config_options, order_info, delivery_fee),
+                          args.number),
+            time_per_call(lambda: transformer.transform(order_info, delivery_fee), args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures the cold start of the app: the time to import `app.main` and the
+latency of the first and second delivery fee requests, in a fresh interpreter
+for every startup mode. The requests are sent directly to the ASGI app, so the
+numbers do not include a server or the network.
+
+Run with: python -m benchmarks.bench_startup [--budget-ms 500]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Runs in a fresh interpreter, prints the measurements as JSON.
+MEASURE_STARTUP = r"""
+import asyncio, json, sys, time
+
+start = time.perf_counter()
+import app.main
+import_ms = (time.perf_counter() - start) * 1e3
+
+BODY = b'{"cart_value":790,"delivery_distance":2235,"number_of_items":4,"time":"2024-01-15T13:00:00Z"}'
+SCOPE = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+         "scheme": "http", "path": "/api/delivery/calculate_delivery_fee/", "raw_path": b"",
+         "query_string": b"", "root_path": "", "client": ("127.0.0.1", 1),
+         "server": ("127.0.0.1", 80), "headers": [(b"content-type", b"application/json")]}
+
+
+async def request_ms():
+    messages = [{"type": "http.request", "body": BODY, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    start = time.perf_counter()
+    await app.main.app(dict(SCOPE), receive, send)
+    elapsed_ms = (time.perf_counter() - start) * 1e3
+    assert sent[0]["status"] == 200 and sent[1]["body"] == b'{"delivery_fee":710}', sent
+    return elapsed_ms
+
+
+async def main():
+    first_ms = await request_ms()
+    second_ms = await request_ms()
+    heavy_modules = [module for module in ("fastapi", "numpy", "pandas", "uvicorn")
+                     if module in sys.modules]
+    print(json.dumps({"import_ms": import_ms, "first_request_ms": first_ms,
+                      "second_request_ms": second_ms, "heavy_modules": heavy_modules}))
+
+asyncio.run(main())
+"""
+
+
+def measure_startup(startup_mode: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE_STARTUP], capture_output=True, text=True, check=True,
+        env={**os.environ, "DELIVERY_FEE_STARTUP_MODE": startup_mode})
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of fresh interpreters per mode, the best one is reported")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if import + first request of the lean mode takes longer")
+    args = parser.parse_args()
+
+    ready_ms = {}
+    for startup_mode in ("standard", "lean"):
+        measurements = [measure_startup(startup_mode) for _ in range(args.repeat)]
+        best = min(measurements, key=lambda measurement: (measurement["import_ms"] +
+                                                          measurement["first_request_ms"]))
+        ready_ms[startup_mode] = best["import_ms"] + best["first_request_ms"]
+        print(f"{startup_mode}:")
+        print(f"    import app.main:  {best['import_ms']:8.1f} ms")
+        print(f"    first request:    {best['first_request_ms']:8.2f} ms")
+        print(f"    second request:   {best['second_request_ms']:8.2f} ms")
+        print(f"    ready:            {ready_ms[startup_mode]:8.1f} ms")
+        print(f"    heavy modules:    {', '.join(best['heavy_modules']) or '-'}")
+
+    if args.budget_ms is not None and ready_ms["lean"] > args.budget_ms:
+        print(f"FAIL: lean startup took {ready_ms['lean']:.1f} ms, "
+              f"budget is {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Measures the compiled `TieredFee` step as the number of bands grows, against
+the compiled `DeliveryDistanceFee` that the same two bands replace. Up to
+`TieredFee.DENSE_TABLE_MAX_VALUE` the fees are looked up from a precomputed
+table, beyond it by a binary search over the bands.
+
+Run with: python -m benchmarks.bench_tiered_fee
+"""
+import argparse
+import random
+from app.delivery_fee.fee_calculation_steps import DeliveryDistanceFee, FeeBand, TieredFee
+from app.delivery_fee.pipeline_compiler import compile_pipeline
+from benchmarks.timing import time_per_call
+
+
+def tiered_fee(band_count: int, max_distance: int) -> TieredFee:
+    rng = random.Random(band_count)
+    return TieredFee(TieredFee.ConfigOptions(order_field="delivery_distance", bands=[
+        FeeBand(above=above, base_fee=rng.randrange(1000), fee_per_unit=rng.randrange(100),
+                unit=rng.randrange(1, 1000))
+        for above in sorted(rng.sample(range(max_distance), band_count))]))
+
+
+def time_per_order(step, distances: list[int], number: int) -> float:
+    # The distance steps don't use the time of the order.
+    compiled_pipeline = compile_pipeline([step], [])
+    return time_per_call(lambda: [compiled_pipeline(0, distance, 0, None)
+                                  for distance in distances], number) / len(distances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    distances = random.Random(0).choices(range(20_000), k=1000)
+    two_bands = TieredFee(TieredFee.ConfigOptions(order_field="delivery_distance", bands=[
+        FeeBand(above=0, base_fee=200),
+        FeeBand(above=1000, base_fee=200, fee_per_unit=100, unit=500)]))
+    print(f"{'DeliveryDistanceFee':>32}: "
+          f"{time_per_order(DeliveryDistanceFee(), distances, args.number):8.1f} ns/order")
+    print(f"{'TieredFee, 2 bands (table)':>32}: "
+          f"{time_per_order(two_bands, distances, args.number):8.1f} ns/order")
+    for band_count in (10, 100, 1000, 10_000):
+        # Bands up to 100 km, so that the binary search is used.
+        step = tiered_fee(band_count, 100_000)
+        print(f"{f'TieredFee, {band_count} bands (bisect)':>32}: "
+              f"{time_per_order(step, distances, args.number):8.1f} ns/order")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the validation of the order JSON with the previous Python field
+validators to the declarative validation in pydantic-core, for valid orders and
+for orders which fail the non-negative or the time check. The "before" model is
+the previous `OrderInfo`, where every field had a Python `field_validator`.
+
+Run with: python -m benchmarks.bench_validation
+"""
+import argparse
+import json
+from datetime import datetime
+from pydantic import BaseModel, ValidationError, field_validator
+from app.delivery_fee.models import OrderInfo
+from benchmarks.timing import print_comparison, time_per_call
+
+
+class PythonValidatedOrderInfo(BaseModel):
+    cart_value: int
+    delivery_distance: int
+    number_of_items: int
+    time: datetime
+
+    @field_validator('cart_value')
+    def cart_value__must_be_non_negative(cls, value):
+        if value < 0:
+            raise ValueError('cart_value must be non-negative')
+        return value
+
+    @field_validator('delivery_distance')
+    def delivery_distance__must_be_non_negative(cls, value):
+        if value < 0:
+            raise ValueError('delivery_distance must be non-negative')
+        return value
+
+    @field_validator('number_of_items', mode='after')
+    def number_of_items__must_be_non_negative(cls, value):
+        if value < 0:
+            raise ValueError('number_of_items must be non-negative')
+        return value
+
+    @field_validator('time', mode='before')
+    def delivery_time__parser(cls, value):
+        try:
+            if isinstance(value, str):
+                return datetime.fromisoformat(value)
+            raise ValueError()
+        except ValueError:
+            raise ValueError(
+                'time must be in UTC ISO format (e.g. 2024-01-15T13:00:00Z)')
+
+
+VALID_ORDER = {"cart_value": 790, "delivery_distance": 2235, "number_of_items": 4,
+               "time": "2024-01-15T13:00:00Z"}
+PAYLOADS = {
+    "valid order": VALID_ORDER,
+    "negative cart value": {**VALID_ORDER, "cart_value": -1},
+    "invalid time": {**VALID_ORDER, "time": "2024-01-15 1pm"},
+}
+
+
+def validate_json(model: type[BaseModel], payload: bytes) -> None:
+    try:
+        model.model_validate_json(payload)
+    except ValidationError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20_000)
+    args = parser.parse_args()
+
+    for title, order in PAYLOADS.items():
+        payload = json.dumps(order).encode()
+        print_comparison(f"Validate {title}",
+                         time_per_call(lambda: validate_json(PythonValidatedOrderInfo, payload),
+                                       args.number),
+                         time_per_call(lambda: validate_json(OrderInfo, payload), args.number))
+
+
+if __name__ == "__main__":
+    main()
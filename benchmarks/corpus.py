@@ -0,0 +1,36 @@
+"""
+The orders the benchmark suite is run with: the orders of the specification
+tests, which cover the edge cases of every step and transformer, and random
+orders, which cover the common cases.
+"""
+import ast
+from pathlib import Path
+from app.delivery_fee.models import OrderInfo
+from app.tests.delivery_fee.random_orders import random_order_infos
+
+
+SPECIFICATION_TESTS_PATH = (Path(__file__).parent.parent /
+                            "app" / "tests" / "specification" / "test_from_specifications.py")
+
+
+def specification_order_infos() -> list[OrderInfo]:
+    """Returns the order infos built in the specification tests, in the order of
+    the tests. The tests are parsed instead of imported, so every new test case
+    that builds an `OrderInfo` from literals is picked up automatically."""
+    tree = ast.parse(SPECIFICATION_TESTS_PATH.read_text())
+    order_infos: list[tuple[int, OrderInfo]] = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+                node.func.id == "OrderInfo" and not node.args):
+            try:
+                fields = {keyword.arg: ast.literal_eval(keyword.value)
+                          for keyword in node.keywords}
+            except ValueError:
+                # Not built from literals.
+                continue
+            order_infos.append((node.lineno, OrderInfo(**fields)))
+    return [order_info for _, order_info in sorted(order_infos, key=lambda item: item[0])]
+
+
+def benchmark_corpus(random_orders: int = 200, seed: int = 2024) -> list[OrderInfo]:
+    return specification_order_infos() + random_order_infos(random_orders, seed)
@@ -0,0 +1,220 @@
+"""
+Benchmark suite with a baseline file and a regression gate. Measures every
+calculation step's `calculate`, every transformer's `transform`,
+`DeliveryFeeCalculator.calculate` end to end and the quote route of the app
+through an in-process ASGI client, over the orders of `benchmarks.corpus`.
+
+Every benchmark is the best time per order (or request) in nanoseconds over
+several rounds of the whole corpus (see `benchmarks.timing.time_per_call`).
+
+Record a baseline:
+    python -m benchmarks.suite run --output benchmarks/baseline.json
+Check the current code against it, fails if any benchmark is more than 20%
+slower than in the baseline:
+    python -m benchmarks.suite compare benchmarks/baseline.json --threshold 0.2
+Benchmarks that look slower are measured again (`--retries`) before failing,
+so that a single disturbed measurement does not fail the check.
+
+Baselines are only comparable on the same machine, so record the baseline and
+compare against it on the same machine (e.g. the same CI runner type).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+from dataclasses import dataclass
+from typing import Callable
+import orjson
+from app.delivery_fee.fee_calculator import DELIVERY_FEE_CALCULATOR
+from app.delivery_fee.models import DeliveryFee, OrderInfo
+from app.main import create_app
+from benchmarks.asgi import post
+from benchmarks.corpus import benchmark_corpus
+from benchmarks.timing import time_per_call
+
+
+BASELINE_VERSION = 1
+DEFAULT_THRESHOLD = 0.2
+QUOTE_PATH = "/api/delivery/calculate_delivery_fee/"
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    # Runs the benchmarked code once for every order of the corpus.
+    run_corpus: Callable[[], object]
+    corpus_size: int
+    number: int
+
+    def measure(self, repeat: int) -> float:
+        """Best time per order in nanoseconds."""
+        return time_per_call(self.run_corpus, self.number, repeat) / self.corpus_size
+
+
+def collect_benchmarks(order_infos: list[OrderInfo]) -> list[Benchmark]:
+    calculator = DELIVERY_FEE_CALCULATOR
+    benchmarks = []
+
+    for step in calculator.calculation_steps:
+        benchmarks.append(Benchmark(
+            f"step.{type(step).__name__}.calculate",
+            lambda step=step: [step.calculate(order_info) for order_info in order_infos],
+            len(order_infos), number=50))
+
+    # Every transformer gets the fees that the steps and the earlier
+    # transformers calculated for the orders, same as in the calculator.
+    fees = []
+    for order_info in order_infos:
+        fee = 0
+        for step in calculator.calculation_steps:
+            fee = max(fee + step.calculate(order_info).delivery_fee, 0)
+        fees.append(DeliveryFee(delivery_fee=fee))
+    for transformer in calculator.transformers:
+        inputs = list(zip(order_infos, fees))
+        benchmarks.append(Benchmark(
+            f"transformer.{type(transformer).__name__}.transform",
+            lambda transformer=transformer, inputs=inputs: [
+                transformer.transform(order_info, fee) for order_info, fee in inputs],
+            len(inputs), number=50))
+        fees = [transformer.transform(order_info, fee) for order_info, fee in inputs]
+    assert [fee.delivery_fee for fee in fees] == calculator.calculate_fees(order_infos)
+
+    benchmarks.append(Benchmark(
+        "calculator.calculate",
+        lambda: [calculator.calculate(order_info) for order_info in order_infos],
+        len(order_infos), number=50))
+
+    app = create_app()
+    bodies = [orjson.dumps(order_info.model_dump(mode="json")) for order_info in order_infos]
+
+    async def post_corpus():
+        for body in bodies:
+            await post(app, QUOTE_PATH, body)
+
+    benchmarks.append(Benchmark(
+        "http.calculate_delivery_fee",
+        lambda: asyncio.run(post_corpus()), len(bodies), number=3))
+    return benchmarks
+
+
+def run_benchmarks(only: list[str] | None = None, repeat: int = 5,
+                   random_orders: int = 200) -> dict[str, float]:
+    """Returns the nanoseconds per order of every benchmark whose name starts
+    with one of the `only` prefixes (all by default)."""
+    results = {}
+    for benchmark in collect_benchmarks(benchmark_corpus(random_orders)):
+        if only and not benchmark.name.startswith(tuple(only)):
+            continue
+        results[benchmark.name] = benchmark.measure(repeat)
+        print(f"    {benchmark.name:55} {results[benchmark.name]:10.1f} ns", file=sys.stderr)
+    return results
+
+
+def remeasure(names: list[str], results: dict[str, float], repeat: int = 5,
+              random_orders: int = 200) -> None:
+    """Measures the benchmarks again and keeps the best time in `results`. A
+    noisy neighbour can slow down one measurement, but rarely all of them."""
+    for benchmark in collect_benchmarks(benchmark_corpus(random_orders)):
+        if benchmark.name in names:
+            results[benchmark.name] = min(results[benchmark.name], benchmark.measure(repeat))
+
+
+def find_regressions(baseline: dict[str, float], current: dict[str, float],
+                     threshold: float) -> list[str]:
+    """Returns the names of the benchmarks that are more than `threshold`
+    (0.2 = 20%) slower than in the baseline."""
+    return [name for name in sorted(baseline.keys() & current.keys())
+            if current[name] / baseline[name] - 1 > threshold]
+
+
+def print_comparison(baseline: dict[str, float], current: dict[str, float],
+                     regressions: list[str]) -> None:
+    """Benchmarks missing from either side are reported, but they are not failed."""
+    for name in sorted(baseline.keys() | current.keys()):
+        if name not in current or name not in baseline:
+            print(f"    {name:55} {'only in ' + ('baseline' if name in baseline else 'current')}")
+            continue
+        change = current[name] / baseline[name] - 1
+        print(f"    {name:55} {baseline[name]:10.1f} ns -> {current[name]:10.1f} ns "
+              f"({change:+6.1%}){'  REGRESSION' if name in regressions else ''}")
+
+
+def read_results(path: str) -> dict[str, float]:
+    with open(path) as file:
+        results = json.load(file)
+    if results.get("version") != BASELINE_VERSION:
+        raise ValueError(f"{path} is not a version {BASELINE_VERSION} benchmark file")
+    return {name: benchmark["ns_per_order"]
+            for name, benchmark in results["benchmarks"].items()}
+
+
+def write_results(path: str, results: dict[str, float]) -> None:
+    with open(path, "w") as file:
+        json.dump({
+            "version": BASELINE_VERSION,
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor(), "cpu_count": os.cpu_count()},
+            "benchmarks": {name: {"ns_per_order": round(ns_per_order, 1)}
+                           for name, ns_per_order in results.items()},
+        }, file, indent=2)
+        file.write("\n")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", help="write the results to this JSON file")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="run the benchmarks and compare them with a baseline")
+    compare_parser.add_argument("baseline", help="baseline JSON file written by run")
+    compare_parser.add_argument("--current", help="compare this JSON file written by run "
+                                                  "instead of running the benchmarks")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="largest allowed slowdown, 0.2 = 20%% "
+                                     f"(default: {DEFAULT_THRESHOLD})")
+    compare_parser.add_argument("--retries", type=int, default=2,
+                                help="measure regressed benchmarks again this many times "
+                                     "before failing, keeping the best time (default: 2)")
+    compare_parser.add_argument("--output", help="also write the current results to this file")
+
+    for subparser in (run_parser, compare_parser):
+        subparser.add_argument("--only", action="append",
+                               help="run only the benchmarks whose name starts with this "
+                                    "prefix, can be given many times")
+        subparser.add_argument("--repeat", type=int, default=5)
+        subparser.add_argument("--random-orders", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    running = args.command == "run" or not args.current
+    current = (run_benchmarks(args.only, args.repeat, args.random_orders) if running
+               else read_results(args.current))
+    if args.command == "run":
+        if args.output:
+            write_results(args.output, current)
+        return
+
+    baseline = read_results(args.baseline)
+    if args.only:
+        baseline = {name: ns for name, ns in baseline.items() if name.startswith(tuple(args.only))}
+    regressions = find_regressions(baseline, current, args.threshold)
+    for _ in range(args.retries if running else 0):
+        if not regressions:
+            break
+        remeasure(regressions, current, args.repeat, args.random_orders)
+        regressions = find_regressions(baseline, current, args.threshold)
+
+    if args.output:
+        write_results(args.output, current)
+    print_comparison(baseline, current, regressions)
+    if regressions:
+        parser.exit(1, f"{len(regressions)} benchmarks regressed more than "
+                       f"{args.threshold:.0%}: {', '.join(regressions)}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""
+Small timing helpers shared by the benchmarks.
+"""
+import timeit
+from typing import Callable
+
+
+def time_per_call(function: Callable[[], object], number: int = 10_000,
+                  repeat: int = 5) -> float:
+    """Returns the best time of one call in nanoseconds over `repeat` rounds
+    of `number` calls. The best round is the one least disturbed by other
+    processes, so it is the most stable value to compare."""
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def print_comparison(title: str, before_ns: float, after_ns: float) -> None:
+    print(f"{title}:")
+    print(f"    before: {before_ns:10.1f} ns/call")
+    print(f"    after:  {after_ns:10.1f} ns/call ({before_ns / after_ns:.1f}x faster)")